@@ -54,6 +54,16 @@ TOLERANCE_ATTEMPTS: int = int(os.getenv('MPR_DIST_TOLERANCE_ATTEMPTS', 3))
 TOLERANCE_RATE: float = float(os.getenv('MPR_DIST_TOLERANCE_ERROR_RATE', 0.25))
 TOLERANCE_TEST_ERRONEOUS_FILENAME: str = os.getenv('MPR_TOLERANCE_TEST_ERRONEOUS_FILENAME')
 
+DISTRIBUTION_WORKERS: int = int(os.getenv('MPR_DIST_WORKERS', 1))
+DISTRIBUTION_REPORT_TIMINGS: bool = getenv_bool('MPR_DIST_REPORT_TIMINGS')
+
+SUBMISSION_DOWNLOAD_WORKERS: int = int(os.getenv('MPR_DOWNLOAD_WORKERS', 4))
+SUBMISSION_DOWNLOAD_CONNECTIONS_PER_HOST: int = int(os.getenv('MPR_DOWNLOAD_CONNECTIONS_PER_HOST',
+                                                              SUBMISSION_DOWNLOAD_WORKERS))
+SUBMISSION_DOWNLOAD_TIMEOUT: float = float(os.getenv('MPR_DOWNLOAD_TIMEOUT', 60))
+SUBMISSION_SENDFILE_HEADER: str = os.getenv('MPR_SUBMISSION_SENDFILE_HEADER')
+SUBMISSION_SENDFILE_PREFIX: str = os.getenv('MPR_SUBMISSION_SENDFILE_PREFIX', '/protected-submissions/')
+
 FRONTEND_LANDING_URL = os.environ['MPR_LANDING_ROUTE']
 
 # LTI configuration
@@ -64,6 +74,16 @@ LTI_ENFORCE_SSL = False  # TODO want this to be True in prod; add config for X-F
 # Canvas API configuration
 CANVAS_API_URL = os.environ['MPR_CANVAS_API_URL']
 CANVAS_API_TOKEN = os.environ['MPR_CANVAS_API_TOKEN']
+CANVAS_API_TIMEOUT: float = float(os.getenv('MPR_CANVAS_API_TIMEOUT', 60))
+CANVAS_API_MAX_RETRIES: int = int(os.getenv('MPR_CANVAS_API_MAX_RETRIES', 4))
+CANVAS_API_BACKOFF: float = float(os.getenv('MPR_CANVAS_API_BACKOFF', 0.5))
+CANVAS_API_MAX_BACKOFF: float = float(os.getenv('MPR_CANVAS_API_MAX_BACKOFF', 10))
+CANVAS_API_RATE_LIMIT_THRESHOLD: float = float(os.getenv('MPR_CANVAS_API_RATE_LIMIT_THRESHOLD', 150))
+CANVAS_API_PAGE_WORKERS: int = int(os.getenv('MPR_CANVAS_API_PAGE_WORKERS', 4))
+CANVAS_SYNC_TTL: float = float(os.getenv('MPR_CANVAS_SYNC_TTL', 300))
+CANVAS_SYNC_LEASE: float = float(os.getenv('MPR_CANVAS_SYNC_LEASE', 120))
+CANVAS_SYNC_WAIT: float = float(os.getenv('MPR_CANVAS_SYNC_WAIT', 10))
+CANVAS_SYNC_WORKERS: int = int(os.getenv('MPR_CANVAS_SYNC_WORKERS', 2))
 
 # Application definition
 INSTALLED_APPS = [
@@ -34,6 +34,11 @@ urlpatterns = [
             ]))
         ])),
 
+        url(r'^data/', include([
+            url(r'^$', api.csv_for_course_and_rubric),
+            url(r'^rubric/(?P<rubric_id>[0-9]+)', api.csv_for_course_and_rubric)
+        ])),
+
         url(r'^rubric/', include([   # TODO change URI to /rubrics/ ?
             url(r'^$', api.create_or_update_rubric),
             url(r'^all/', include([
@@ -1,23 +1,29 @@
-import io
+import os
+import re
 import csv
-import os.path
 import logging
 import mimetypes
 from itertools import chain
 from datetime import datetime
+from urllib.parse import quote
 
 from dateutil.tz import tzutc
 from toolz.itertoolz import join
 from django.db import transaction
 from django.conf import settings
-from django.http import Http404, HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse, FileResponse
+from django.utils.http import http_date
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.views.decorators.http import require_POST
 from django.core.exceptions import PermissionDenied, ObjectDoesNotExist
 from rolepermissions.roles import get_user_roles
 from rolepermissions.checkers import has_role
 
-import peer_review.etl as etl
+import peer_review.sync as sync
 import peer_review.canvas as canvas
+import peer_review.storage as storage
+import peer_review.completion as completion
+import peer_review.summaries as summaries
 from peer_review.util import to_camel_case, keymap_all
 from peer_review.distribution import add_to_distribution
 from peer_review.exceptions import ReviewsInProgressException, APIException
@@ -53,8 +59,7 @@ def logged_in_user_details(request):
 # TODO refactor this based on what we're actually using on the new students list implementation
 @authorized_json_endpoint(roles=['instructor'])
 def all_students(request, course_id):
-    etl.persist_sections(course_id)
-    etl.persist_students(course_id)
+    sync.ensure_synced(course_id, 'roster')
 
     course_model = CanvasCourse.objects.get(id=course_id)
     course = {'id': course_model.id, 'name': course_model.name}
@@ -82,8 +87,7 @@ def all_students(request, course_id):
 
 @authorized_json_endpoint(roles=['instructor'])
 def all_peer_review_assignment_details(request, course_id):
-    etl.persist_course(course_id)
-    assignments = etl.persist_assignments(course_id)
+    assignments = sync.course_assignments(course_id)
     fetched_assignment_ids = tuple(map(lambda a: a.id, assignments))
 
     if fetched_assignment_ids:
@@ -193,7 +197,7 @@ def rubric_info_for_peer_review_assignment(request, course_id, passback_assignme
 
     # TODO might need to persist course here if assignment-level launches are added for instructors
     course = CanvasCourse.objects.get(id=course_id)
-    fetched_assignments = etl.persist_assignments(course_id)
+    fetched_assignments = sync.course_assignments(course_id)
 
     return RubricForm.rubric_info(course, passback_assignment, fetched_assignments)
 
@@ -239,10 +243,14 @@ def create_or_update_rubric(request, params, course_id):
                     pass
                 Criterion.objects.filter(rubric_id=rubric.id).delete()
 
+            rubric.criteria_count = len(criteria)
             rubric.save()
             for criterion in criteria:
                 criterion.rubric_id = rubric.id
                 criterion.save()
+            # reviews may have been assigned by hand already; their completion depends on the new criteria
+            completion.rebuild(rubric_ids=[rubric.id])
+            summaries.rebuild(rubric_ids=[rubric.id])
 
         return params
     except ReviewsInProgressException:
@@ -250,10 +258,100 @@ def create_or_update_rubric(request, params, course_id):
         raise APIException(data={'error': error}, status_code=403)
 
 
+_BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _submission_etag(content, stat):
+    if content.sha256:
+        return '"%s"' % content.sha256
+    # files from before the content-addressed store are told apart the way web servers usually do
+    return '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+
+
+def _requested_range(request, etag, last_modified, size):
+    """
+    Find the byte range of a file that a request asks for.  Only single ranges are served as such.
+
+    :return: Tuple of the first and last offsets (inclusive), None to send the whole file (no range was asked for, more
+             than one was, or the file has changed since the If-Range), or False if the range is outside of the file
+    """
+    match = _BYTE_RANGE.match(request.META.get('HTTP_RANGE', '').replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range not in (etag, http_date(last_modified)):
+        return None
+
+    first, last = match.groups()
+    if first:
+        first = int(first)
+        if last and int(last) < first:
+            return None
+        last = min(int(last), size - 1) if last else size - 1
+    else:
+        suffix_length = int(last)
+        if suffix_length == 0:
+            return False
+        first, last = max(size - suffix_length, 0), size - 1
+    if first >= size:
+        return False
+    return first, last
+
+
+class _FileRange:
+    """ Reads only the requested range of an open file, for `FileResponse`. """
+    def __init__(self, file, first, last):
+        file.seek(first)
+        self.file = file
+        self.remaining = last - first + 1
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def _submission_response(request, path, content_type, etag, last_modified, size):
+    header = settings.SUBMISSION_SENDFILE_HEADER
+    if header:
+        # the front proxy sends the file, and answers range requests itself
+        response = HttpResponse(content_type=content_type)
+        if header.lower() == 'x-accel-redirect':
+            relative_path = os.path.relpath(path, settings.MEDIA_ROOT)
+            response[header] = quote(settings.SUBMISSION_SENDFILE_PREFIX.rstrip('/') + '/' + relative_path)
+        else:
+            response[header] = path
+        return response
+
+    requested_range = _requested_range(request, etag, last_modified, size)
+    if requested_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % size
+        return response
+
+    # a whole file is handed to the WSGI server as is, which sends it with os.sendfile where it can
+    submission_file = open(path, 'rb')
+    if requested_range is None:
+        response = FileResponse(submission_file, content_type=content_type)
+        response['Content-Length'] = size
+    else:
+        first, last = requested_range
+        response = FileResponse(_FileRange(submission_file, first, last), content_type=content_type, status=206)
+        response['Content-Length'] = last - first + 1
+        response['Content-Range'] = 'bytes %d-%d/%d' % (first, last, size)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
 @authorized_endpoint(roles=['instructor', 'student'])
 def submission_for_review(request, course_id, review_id):
     try:
-        peer_review = PeerReview.objects.get(id=review_id)
+        peer_review = PeerReview.objects.select_related('submission').get(id=review_id)
     except PeerReview.DoesNotExist:
         raise Http404
 
@@ -264,14 +362,24 @@ def submission_for_review(request, course_id, review_id):
         raise PermissionDenied
 
     submission = peer_review.submission
-    submission_path = os.path.join(settings.MEDIA_ROOT, 'submissions', submission.filename)
-
-    with open(submission_path, 'rb') as submission_file:
-        submission_bytes = submission_file.read()
+    content = storage.content_for(submission.filename)
+    try:
+        stat = os.stat(content.path)
+    except FileNotFoundError:
+        LOGGER.error('Submission file %s for peer review (ID %s) is missing', submission.filename, review_id)
+        raise Http404
 
+    etag = _submission_etag(content, stat)
+    last_modified = int(stat.st_mtime)
     content_type = mimetypes.guess_type(submission.filename)[0] or 'application/octet-stream'
-    response = HttpResponse(submission_bytes, content_type)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _submission_response(request, content.path, content_type, etag, last_modified, stat.st_size)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
     response['Content-Disposition'] = 'attachment; filename="%s"' % submission.filename
+    patch_cache_control(response, private=True)
 
     return response
 
@@ -339,21 +447,39 @@ def submit_peer_review(request, params, course_id, review_id):
     ]
 
     with transaction.atomic():
+        # serializes concurrent submissions of the same review, so its counters match the comments that win
+        was_complete = PeerReview.objects.select_for_update().get(id=peer_review.id).is_complete
         existing_comments.delete()
         for comment in comments:
             comment.save()
+        completion.record_comments(peer_review, comments, len(criteria_ids))
+        if peer_review.is_complete != was_complete:
+            summaries.add_completed_reviews(rubric.id, 1 if peer_review.is_complete else -1)
 
     return params
 
 
+class _Echo:
+    """ Stands in for a file for csv.writer, handing back each line it writes instead of keeping it. """
+    def write(self, value):
+        return value
+
+
+def _csv_response(rows):
+    writer = csv.writer(_Echo(), delimiter=',', quoting=csv.QUOTE_MINIMAL)
+    lines = (writer.writerow(row) for row in chain([Comments.csv_header], rows))
+
+    response = StreamingHttpResponse(lines, content_type="text/csv")
+    response["Content-Disposition"] = "attachment"
+
+    return response
+
+
 @authorized_endpoint(roles=['instructor'])
 def csv_for_student_and_rubric(request, course_id, student_id, rubric_id=None):
 
     try:
-        all_comments = Comments.all_comments_for_student(
-            student_id=student_id,
-            rubric_id=rubric_id
-        )
+        rows = Comments.csv_rows_for_student(student_id, rubric_id=rubric_id)
     except Rubric.DoesNotExist:
         LOGGER.error('Rubric %s does not exist to download CSV data', rubric_id)
         raise Http404
@@ -361,27 +487,19 @@ def csv_for_student_and_rubric(request, course_id, student_id, rubric_id=None):
         LOGGER.error('Student %s does not exist to download CSV data', student_id)
         raise Http404
 
-    rows = [['Prompt', 'Reviewer', 'Author', 'Criterion ID', 'Comment']] + [
-        [
-            comment.peer_review.submission.assignment.title,
-            comment.peer_review.student.sortable_name,
-            comment.peer_review.submission.author.sortable_name,
-            comment.criterion.id,
-            comment.comment
-        ]
-        for comment in all_comments
-    ]
+    return _csv_response(rows)
 
-    output = io.StringIO()
-    writer = csv.writer(output, delimiter=',', quoting=csv.QUOTE_MINIMAL)
-    for row in rows:
-        writer.writerow(row)
-    csv_data = output.getvalue()
 
-    response = HttpResponse(csv_data, content_type="text/csv")
-    response["Content-Disposition"] = "attachment"
+@authorized_endpoint(roles=['instructor'])
+def csv_for_course_and_rubric(request, course_id, rubric_id=None):
 
-    return response
+    try:
+        rows = Comments.csv_rows_for_course(course_id, rubric_id=rubric_id)
+    except Rubric.DoesNotExist:
+        LOGGER.error('Rubric %s does not exist in course %s to download CSV data', rubric_id, course_id)
+        raise Http404
+
+    return _csv_response(rows)
 
 
 @authorized_json_endpoint(roles=['instructor'])
@@ -446,7 +564,7 @@ def rubric_status_for_student(request, course_id, rubric_id, student_id):
 def single_review(request, course_id, review_id):
 
     try:
-        peer_review = PeerReview.objects.get(id=review_id)
+        peer_review = PeerReview.objects.select_related('submission').get(id=review_id)
 
         if has_role(request.user, 'student'):
             logged_in_user_id = int(request.session['lti_launch_params']['custom_canvas_user_id'])
@@ -484,7 +602,7 @@ def non_reviewers_for_rubric(request, course_id, rubric_id):
     except Rubric.DoesNotExist:
         raise Http404
 
-    etl.persist_students(course_id)
+    sync.ensure_synced(course_id, 'roster')
 
     non_reviewers = Students.non_reviewers_for_rubric(course_id, rubric)
     submissions = canvas.retrieve('submissions', course_id, rubric.reviewed_assignment.id)
@@ -1,12 +1,31 @@
 import re
+import json
+import time
+import hashlib
+import random
+import logging
 import requests
 import mimetypes
+import threading
 from io import SEEK_SET, SEEK_END
+from itertools import islice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from toolz.dicttoolz import merge
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qs, parse_qsl, urlencode
 from django.conf import settings
 
-# TODO rethink the token state flow???
+from peer_review.models import CanvasResponseCache
+
+log = logging.getLogger(__name__)
+
+# responses worth retrying; requests that are not idempotent are only retried when Canvas throttled them, since the
+# other errors may have happened after Canvas acted on the request
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+_IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+
+# longest pause before a request while the remaining rate limit quota is below the threshold
+MAX_THROTTLE_DELAY = 2.0
 
 _page_regex = re.compile('<(?P<page_url>.*)>.*rel="(?P<page_key>.*)"')
 
@@ -36,16 +55,15 @@ _routes = {
 }
 
 
-def _make_headers():
-    return {'Authorization': 'Bearer %s' % settings.CANVAS_API_TOKEN}
-
-
 def _make_url(resource, params):
     return urljoin(settings.CANVAS_API_URL, _routes[resource]['route'] % tuple(params))
 
 
 def _parse_links(response):
-    link_header = response.headers.get('link')
+    return _parse_link_header(response.headers.get('link'))
+
+
+def _parse_link_header(link_header):
     if link_header:
         link_parts = link_header.split(',')
         matches = [_page_regex.match(page) for page in link_parts]
@@ -54,52 +72,334 @@ def _parse_links(response):
         return links
 
 
-def retrieve(resource, *params):
-    resources = []
-    url = _make_url(resource, params)
-    route_params = _routes[resource].get('params') if 'params' in _routes[resource] else {}
-    while True:
-        headers = _make_headers()
-        response = requests.get(url, headers=headers, params=merge(
-            route_params, {'per_page': 100}))  # 100 is Canvas hard maximum
+def _page_number(url):
+    page = parse_qs(urlsplit(url).query).get('page', [''])[0] if url else ''
+    return int(page) if page.isdigit() else None
+
+
+def _numbered_page_urls(next_url, last_url):
+    """
+    Build the URLs of every page from `next_url` through `last_url`, if Canvas numbered them.  Bookmark-style pages
+    (`page=bookmark:...`) can only be followed one at a time.
+
+    :return: List of page URLs, or None if the pages are not numbered
+    """
+    first_page, last_page = _page_number(next_url), _page_number(last_url)
+    if first_page is None or last_page is None or last_page < first_page:
+        return None
+    scheme, netloc, path, query, fragment = urlsplit(next_url)
+    query_params = [(key, value) for key, value in parse_qsl(query, keep_blank_values=True) if key != 'page']
+    return [urlunsplit((scheme, netloc, path, urlencode(query_params + [('page', page)]), fragment))
+            for page in range(first_page, last_page + 1)]
+
+
+def _cache_key(token, url, params):
+    request_key = json.dumps([token, url, sorted((params or {}).items())])
+    return hashlib.sha256(request_key.encode('utf8')).hexdigest()
+
+
+def _upload_files(files):
+    """ The file objects in a request's `files`, which may be a dictionary or a list of values or tuples. """
+    if not files:
+        return []
+    values = files.values() if isinstance(files, dict) else (value for _, value in files)
+    values = (value[1] if isinstance(value, tuple) else value for value in values)
+    return [value for value in values if hasattr(value, 'read')]
+
+
+class CanvasClient:
+    """
+    Makes Canvas API requests over one persistent (keep-alive) session.
+
+    Requests that Canvas throttles (429), fails (5xx) or that fail to connect are retried with exponential backoff and
+    jitter, up to `settings.CANVAS_API_MAX_RETRIES` times.  Once Canvas reports (in `X-Rate-Limit-Remaining`) that less
+    than `settings.CANVAS_API_RATE_LIMIT_THRESHOLD` of the rate limit quota is left, each request is delayed in
+    proportion to how little is left, so that Canvas is not pushed into throttling us.
+
+    Clients may be shared between threads.
+    """
+
+    def __init__(self, token=None):
+        """
+        :param token: Canvas API token to authenticate as; defaults to `settings.CANVAS_API_TOKEN`
+        """
+        self._token = token
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+        self._rate_limit_remaining = None
+        self._metrics = {'requests': 0, 'retries': 0, 'not_modified': 0, 'elapsed_seconds': 0.0,
+                         'throttled_seconds': 0.0}
+
+    def close(self):
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def metrics(self):
+        """
+        Totals over every request made by this client: number of requests (including retries), number of retries,
+        number of cached pages that Canvas reported unchanged, seconds spent waiting on responses and seconds spent
+        throttling.
+        """
+        with self._lock:
+            return dict(self._metrics)
+
+    def _record(self, **amounts):
+        with self._lock:
+            for key, amount in amounts.items():
+                self._metrics[key] += amount
+
+    def _make_headers(self):
+        return {'Authorization': 'Bearer %s' % (self._token or settings.CANVAS_API_TOKEN)}
+
+    def _throttle(self):
+        threshold = settings.CANVAS_API_RATE_LIMIT_THRESHOLD
+        remaining = self._rate_limit_remaining
+        if remaining is None or threshold <= 0 or remaining >= threshold:
+            return
+        delay = MAX_THROTTLE_DELAY * (threshold - max(remaining, 0)) / threshold
+        log.debug('Canvas rate limit quota is down to %.1f; waiting %.2fs before the next request' % (remaining, delay))
+        self._record(throttled_seconds=delay)
+        time.sleep(delay)
+
+    def _update_rate_limit(self, response):
+        remaining = response.headers.get('X-Rate-Limit-Remaining')
+        if remaining is not None:
+            try:
+                self._rate_limit_remaining = float(remaining)
+            except ValueError:
+                pass
+
+    @staticmethod
+    def _backoff_delay(attempt, response):
+        """
+        :return: How long to wait before retrying, never more than `settings.CANVAS_API_MAX_BACKOFF`, or None if Canvas
+                 asked (with Retry-After) for a longer wait than that
+        """
+        delay = min(random.uniform(0, settings.CANVAS_API_BACKOFF * (2 ** attempt)), settings.CANVAS_API_MAX_BACKOFF)
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after is not None:
+            try:
+                retry_after = float(retry_after)
+            except ValueError:
+                return delay
+            if retry_after > settings.CANVAS_API_MAX_BACKOFF:
+                return None
+            delay = max(delay, retry_after)
+        return delay
+
+    def request(self, method, url, authenticated=True, **kwargs):
+        """
+        Make a request, retrying and throttling as needed.  The response is returned whatever its status; it is up to
+        the caller to check it.
+
+        :param authenticated: Whether to send the API token (Canvas's file upload URLs must not be sent it)
+        """
+        method = method.upper()
+        headers = merge(kwargs.pop('headers', {}), self._make_headers() if authenticated else {})
+        kwargs.setdefault('timeout', settings.CANVAS_API_TIMEOUT)
+
+        # every attempt reads the uploaded files, so a retry has to start reading them where the first attempt did
+        upload_files = _upload_files(kwargs.get('files'))
+        can_resend = all(getattr(f, 'seekable', lambda: False)() for f in upload_files)
+        upload_positions = [(f, f.tell()) for f in upload_files] if can_resend else []
+
+        attempt = 0
+        while True:
+            for upload_file, position in upload_positions:
+                upload_file.seek(position)
+            self._throttle()
+            start = time.perf_counter()
+            try:
+                response = self._session.request(method, url, headers=headers, **kwargs)
+                error = None
+            except (requests.ConnectionError, requests.Timeout) as ex:
+                response = None
+                error = ex
+            elapsed = time.perf_counter() - start
+            self._record(requests=1, elapsed_seconds=elapsed)
+
+            if response is not None:
+                self._update_rate_limit(response)
+                log.debug('Canvas API %s %s -> %d in %.3fs (attempt %d, rate limit remaining %s)' %
+                          (method, url, response.status_code, elapsed, attempt + 1,
+                           response.headers.get('X-Rate-Limit-Remaining', 'unknown')))
+                retryable = response.status_code == 429 or \
+                    (response.status_code in _RETRY_STATUSES and method in _IDEMPOTENT_METHODS)
+            else:
+                log.debug('Canvas API %s %s -> %s in %.3fs (attempt %d)' % (method, url, error, elapsed, attempt + 1))
+                retryable = method in _IDEMPOTENT_METHODS
+
+            delay = self._backoff_delay(attempt, response) if retryable else None
+            if delay is None or not can_resend or attempt >= settings.CANVAS_API_MAX_RETRIES:
+                if retryable and delay is None:
+                    log.warning('Canvas API %s %s asked to be retried after %ss, which is longer than we wait' %
+                                (method, url, response.headers.get('Retry-After')))
+                if error is not None:
+                    raise error
+                return response
+
+            log.warning('Canvas API %s %s failed (%s); retrying in %.2fs' %
+                        (method, url, response.status_code if response is not None else error, delay))
+            self._record(retries=1)
+            time.sleep(delay)
+            attempt += 1
+
+    def _get_page(self, url, params=None):
+        response = self.request('GET', url, params=params)
         response.raise_for_status()
-        json_data = response.json()
-        if isinstance(json_data, dict):
-            resources = json_data
-            break
-        else:
-            resources += json_data
-        links = _parse_links(response)  # TODO may be able to replace with requests's link parsing
-        url = links.get('next') if links else None
-        if not url:
-            break
-        route_params = {}
-    return resources
+        return response.json(), _parse_links(response) or {}  # TODO may be able to replace with requests's link parsing
 
+    def _get_page_if_modified(self, url, params=None):
+        """
+        Get a page with a conditional request, if an earlier response for it was cached with an ETag or Last-Modified
+        date.  Every response is cached, with or without them, so that `cached_retrieve` can rebuild the resource.
 
-def delete(resource, *params):
-    url = _make_url(resource, params)
-    headers = _make_headers()
-    response = requests.delete(url, headers=headers)
-    response.raise_for_status()
-    return response
+        :return: Tuple of the page, its links and whether it changed since it was cached
+        """
+        key = _cache_key(self._token or settings.CANVAS_API_TOKEN, url, params)
+        cached = CanvasResponseCache.objects.filter(key=key).first()
+        headers = {}
+        if cached:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
 
+        response = self.request('GET', url, params=params, headers=headers)
+        if cached and response.status_code == 304:
+            self._record(not_modified=1)
+            return json.loads(cached.body), _parse_link_header(cached.link) or {}, False
+        response.raise_for_status()
 
-def create(resource, *params, **kwargs):
-    response = requests.post(_make_url(resource, params),
-                             json=kwargs['data'],
-                             headers=_make_headers())
-    response.raise_for_status()
-    return response.json()
+        CanvasResponseCache.objects.update_or_create(key=key, defaults={
+            'url': url,
+            'etag': response.headers.get('ETag', ''),
+            'last_modified': response.headers.get('Last-Modified', ''),
+            'link': response.headers.get('link', ''),
+            'body': response.text
+        })
+        return response.json(), _parse_links(response) or {}, True
 
+    def _get_pages_concurrently(self, urls):
+        workers = min(settings.CANVAS_API_PAGE_WORKERS, len(urls))
+        log.debug('Retrieving %d pages, %d at a time' % (len(urls), workers))
+        urls = iter(urls)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque(executor.submit(self._get_page, url) for url in islice(urls, workers))
+            try:
+                while pending:
+                    json_data, _ = pending.popleft().result()
+                    url = next(urls, None)
+                    if url:
+                        pending.append(executor.submit(self._get_page, url))
+                    yield json_data
+            finally:
+                for future in pending:
+                    future.cancel()
 
-def submit_file(user_token, course_id, assignment_id, filename, contents, mime_type=None):
+    def iter_pages(self, resource, *params):
+        """
+        Retrieve a resource one page at a time, in order.  When Canvas numbers the pages and says which is the last
+        one, the pages after the first are fetched `settings.CANVAS_API_PAGE_WORKERS` at a time; otherwise each
+        page's "next" link is followed in turn.
+
+        :return: Generator of pages (each a list of objects), or of the single object if the resource is not a list
+        """
+        route_params = _routes[resource].get('params') if 'params' in _routes[resource] else {}
+        json_data, links = self._get_page(_make_url(resource, params),
+                                          merge(route_params, {'per_page': 100}))  # 100 is Canvas hard maximum
+        yield json_data
+
+        while not isinstance(json_data, dict) and links.get('next'):
+            page_urls = _numbered_page_urls(links['next'], links.get('last'))
+            if page_urls and len(page_urls) > 1 and settings.CANVAS_API_PAGE_WORKERS > 1:
+                yield from self._get_pages_concurrently(page_urls)
+                return
+            json_data, links = self._get_page(links['next'])
+            yield json_data
+
+    def iter_retrieve(self, resource, *params):
+        """
+        Retrieve a resource's objects as their pages arrive (see `iter_pages`), so that only a page or so of them needs
+        to be held at once.
+
+        :return: Generator of objects, or of the single object if the resource is not a list
+        """
+        for json_data in self.iter_pages(resource, *params):
+            if isinstance(json_data, dict):
+                yield json_data
+            else:
+                yield from json_data
+
+    def retrieve_if_modified(self, resource, *params):
+        """
+        Retrieve a resource like `retrieve`, but with conditional requests for pages that were retrieved this way
+        before, so that Canvas does not send unchanged pages again.  Pages are followed one at a time.
+
+        Cached responses are stored in the database; if the caller stores what it makes of them in the same
+        transaction, neither outlives the other.
+
+        :return: Tuple of the resource and whether any of its pages changed since they were last retrieved
+        """
+        route_params = _routes[resource].get('params') if 'params' in _routes[resource] else {}
+        json_data, links, modified = self._get_page_if_modified(
+            _make_url(resource, params), merge(route_params, {'per_page': 100}))  # 100 is Canvas hard maximum
+        if isinstance(json_data, dict):
+            return json_data, modified
+
+        resources = list(json_data)
+        while links.get('next'):
+            json_data, links, page_modified = self._get_page_if_modified(links['next'])
+            resources += json_data
+            modified = modified or page_modified
+        return resources, modified
 
-    # TODO don't do this
-    saved_token = settings.CANVAS_API_TOKEN
-    settings.CANVAS_API_TOKEN = user_token
+    def cached_retrieve(self, resource, *params):
+        """
+        Rebuild a resource from the responses cached by `retrieve_if_modified`, without contacting Canvas.
 
-    try:
+        :return: The resource, or None if any of its pages are not cached
+        """
+        route_params = _routes[resource].get('params') if 'params' in _routes[resource] else {}
+        token = self._token or settings.CANVAS_API_TOKEN
+        url, params = _make_url(resource, params), merge(route_params, {'per_page': 100})
+        resources = []
+        while url:
+            cached = CanvasResponseCache.objects.filter(key=_cache_key(token, url, params)).first()
+            if cached is None:
+                return None
+            json_data = json.loads(cached.body)
+            if isinstance(json_data, dict):
+                return json_data
+            resources += json_data
+            url, params = (_parse_link_header(cached.link) or {}).get('next'), None
+        return resources
+
+    def retrieve(self, resource, *params):
+        resources = []
+        for json_data in self.iter_pages(resource, *params):
+            if isinstance(json_data, dict):
+                return json_data
+            resources += json_data
+        return resources
+
+    def delete(self, resource, *params):
+        response = self.request('DELETE', _make_url(resource, params))
+        response.raise_for_status()
+        return response
+
+    def create(self, resource, *params, **kwargs):
+        response = self.request('POST', _make_url(resource, params), json=kwargs['data'])
+        response.raise_for_status()
+        return response.json()
+
+    def submit_file(self, course_id, assignment_id, filename, contents, mime_type=None):
         if not mime_type:
             mime_type, _ = mimetypes.guess_type(filename)
             if not mime_type:
@@ -109,29 +409,75 @@ def submit_file(user_token, course_id, assignment_id, filename, contents, mime_t
         file_size = contents.tell()
         contents.seek(0, SEEK_SET)
 
-        pending_file_desc = create('submission_file', course_id, assignment_id, data={
+        pending_file_desc = self.create('submission_file', course_id, assignment_id, data={
             'name': filename,
             'size': file_size,
             'content_type': mime_type
         })
 
-        file_upload_response = requests.post(pending_file_desc['upload_url'],
-                                             data=pending_file_desc['upload_params'],
-                                             files={'file': contents},
-                                             allow_redirects=False)
+        file_upload_response = self.request('POST', pending_file_desc['upload_url'],
+                                            authenticated=False,
+                                            data=pending_file_desc['upload_params'],
+                                            files={'file': contents},
+                                            allow_redirects=False)
         file_upload_response.raise_for_status()
 
-        file_confirmation_response = requests.post(file_upload_response.headers['location'])
+        file_confirmation_response = self.request('POST', file_upload_response.headers['location'],
+                                                  authenticated=False)
         file_confirmation_response.raise_for_status()
 
-        file_submission_json = create('submissions', course_id, assignment_id, data={
+        return self.create('submissions', course_id, assignment_id, data={
             'submission': {
                 'submission_type': 'online_upload',
                 'file_ids': [file_confirmation_response.json()['id']]
             }
         })
-    finally:
-        # TODO remove this when we fix the above
-        settings.CANVAS_API_TOKEN = saved_token
 
-    return file_submission_json
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def default_client():
+    """
+    The client used by this module's functions, which authenticates with `settings.CANVAS_API_TOKEN`.  It is created on
+    first use, so that each (forked) process gets its own connections.
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = CanvasClient()
+        return _default_client
+
+
+def iter_pages(resource, *params):
+    return default_client().iter_pages(resource, *params)
+
+
+def iter_retrieve(resource, *params):
+    return default_client().iter_retrieve(resource, *params)
+
+
+def retrieve(resource, *params):
+    return default_client().retrieve(resource, *params)
+
+
+def retrieve_if_modified(resource, *params):
+    return default_client().retrieve_if_modified(resource, *params)
+
+
+def cached_retrieve(resource, *params):
+    return default_client().cached_retrieve(resource, *params)
+
+
+def delete(resource, *params):
+    return default_client().delete(resource, *params)
+
+
+def create(resource, *params, **kwargs):
+    return default_client().create(resource, *params, **kwargs)
+
+
+def submit_file(user_token, course_id, assignment_id, filename, contents, mime_type=None):
+    with CanvasClient(token=user_token) as client:
+        return client.submit_file(course_id, assignment_id, filename, contents, mime_type=mime_type)
@@ -0,0 +1,94 @@
+import logging
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import Count, Max
+
+import peer_review.summaries as summaries
+from peer_review.util import bulk_update
+from peer_review.models import Rubric, PeerReview
+
+log = logging.getLogger(__name__)
+
+COUNTER_FIELDS = ['comment_count', 'is_complete', 'completed_at_utc']
+
+StaleCounts = namedtuple('StaleCounts', ['rubrics', 'peer_reviews'])
+
+
+def review_is_complete(comment_count, criteria_count, last_commented_at_utc):
+    # a review without comments is never complete, even for a rubric without criteria, so that it is counted the same
+    # way from the moment it is assigned; a complete review always has a completion time (comments saved through the
+    # API always have one)
+    return comment_count > 0 and comment_count >= criteria_count and last_commented_at_utc is not None
+
+
+def _counters(comment_count, criteria_count, last_commented_at_utc):
+    is_complete = review_is_complete(comment_count, criteria_count, last_commented_at_utc)
+    return comment_count, is_complete, last_commented_at_utc if is_complete else None
+
+
+def record_comments(peer_review, comments, criteria_count):
+    """
+    Bring a peer review's completion counters up to date with the comments that were just saved for it.  Call this in
+    the same transaction that replaced the comments.
+
+    :param comments: All of the review's comments
+    :param criteria_count: Number of criteria in the review's rubric
+    """
+    last_commented_at_utc = max((c.commented_at_utc for c in comments if c.commented_at_utc), default=None)
+    peer_review.comment_count, peer_review.is_complete, peer_review.completed_at_utc = \
+        _counters(len(comments), criteria_count, last_commented_at_utc)
+    peer_review.save(update_fields=COUNTER_FIELDS)
+
+
+def _stale_peer_reviews(prompt_id, criteria_count):
+    peer_reviews = PeerReview.objects \
+        .filter(submission__assignment_id=prompt_id) \
+        .annotate(actual_comment_count=Count('comments'),
+                  last_commented_at_utc=Max('comments__commented_at_utc')) \
+        .values('id', 'actual_comment_count', 'last_commented_at_utc', *COUNTER_FIELDS)
+
+    stale = []
+    for peer_review in peer_reviews:
+        counters = _counters(peer_review['actual_comment_count'], criteria_count,
+                             peer_review['last_commented_at_utc'])
+        if counters != tuple(peer_review[field] for field in COUNTER_FIELDS):
+            stale.append(PeerReview(id=peer_review['id'], **dict(zip(COUNTER_FIELDS, counters))))
+    return stale
+
+
+def rebuild(rubric_ids=None, fix=True):
+    """
+    Recount criteria and review comments from scratch and compare them with the stored counters, one rubric at a
+    time.
+
+    :param rubric_ids: Rubrics to rebuild (defaults to all of them)
+    :param fix: Whether to overwrite stale counters, or only report them
+    :return: StaleCounts of the rubrics and peer reviews whose counters were wrong
+    """
+    rubrics = Rubric.objects.annotate(actual_criteria_count=Count('criteria')).order_by('id')
+    if rubric_ids is not None:
+        rubrics = rubrics.filter(id__in=rubric_ids)
+
+    stale_rubrics = 0
+    stale_peer_reviews = 0
+    for rubric in rubrics:
+        with transaction.atomic():
+            if rubric.criteria_count != rubric.actual_criteria_count:
+                log.info('Rubric %d has %d criteria, not %d'
+                         % (rubric.id, rubric.actual_criteria_count, rubric.criteria_count))
+                stale_rubrics += 1
+                if fix:
+                    Rubric.objects.filter(id=rubric.id).update(criteria_count=rubric.actual_criteria_count)
+
+            if rubric.reviewed_assignment_id is None:
+                continue
+            stale = _stale_peer_reviews(rubric.reviewed_assignment_id, rubric.actual_criteria_count)
+            if stale:
+                log.info('%d peer reviews for rubric %d have stale completion counters' % (len(stale), rubric.id))
+                stale_peer_reviews += len(stale)
+                if fix:
+                    bulk_update(PeerReview, stale, COUNTER_FIELDS)
+                    summaries.rebuild(rubric_ids=[rubric.id])
+
+    return StaleCounts(rubrics=stale_rubrics, peer_reviews=stale_peer_reviews)
@@ -1,15 +1,24 @@
+import time
+import heapq
 import logging
-import os
+import itertools
 from datetime import datetime
+from functools import partial
+from contextlib import contextmanager
 from collections import OrderedDict
 
 from django.conf import settings
-from toolz.itertoolz import unique, frequencies, take
+from toolz.itertoolz import unique
 
 from django.db import transaction
+from django.db.models import Count
 
-from peer_review.etl import persist_students, persist_sections, persist_submissions, persist_assignments
-from peer_review.models import CanvasCourse, CanvasStudent, CanvasAssignment, PeerReview, PeerReviewDistribution, JobLog
+import peer_review.summaries as summaries
+from peer_review.util import map_concurrently
+from peer_review.etl import persist_students, persist_sections, persist_submissions, persist_assignments, \
+    remove_legacy_staging_directory
+from peer_review.models import CanvasCourse, CanvasStudent, CanvasAssignment, CanvasSubmission, PeerReview, \
+    PeerReviewDistribution, JobLog
 
 log = logging.getLogger('management_commands')
 
@@ -17,51 +26,109 @@ log = logging.getLogger('management_commands')
 DEFAULT_NUMBER_OF_REVIEWS_PER_STUDENT = 3
 
 
-def add_to_distribution(rubric, students, n=DEFAULT_NUMBER_OF_REVIEWS_PER_STUDENT):
-    reviews = PeerReview.objects.filter(submission__assignment=rubric.reviewed_assignment)
-    submission_ids = reviews.values_list('submission', flat=True)
-    review_counts = frequencies(submission_ids)
+def _make_review_queue(submission_ids, review_count_by_submission):
+    queue = [[review_count_by_submission[submission_id], order, submission_id]
+             for order, submission_id in enumerate(submission_ids)]
+    heapq.heapify(queue)
+    return queue, itertools.count(1)
 
-    new_reviews = []
-    for student in students:
-        sorted_review_counts = sorted(review_counts.items(), key=lambda p: p[1])
-        submission_ids_for_review = map(
-            lambda p: p[0],
-            take(n, sorted_review_counts)
-        )
-        for submission_id in submission_ids_for_review:
-            review = PeerReview(student=student, submission_id=submission_id)
-            new_reviews.append(review)
-            review_counts[submission_id] += 1
 
-    PeerReview.objects.bulk_create(new_reviews)
+def _take_least_reviewed(queue, picks, n, is_excluded):
+    """
+    Pop the `n` least-reviewed submissions off of the review queue, skipping any for which `is_excluded` is true.
+
+    Chosen submissions are pushed back with their review count incremented, ahead of any other submissions with the
+    new count (the same order a stable re-sort of all review counts after each pick would produce); skipped
+    submissions are pushed back unchanged.  If the queue runs out before `n` submissions are found, fewer than `n`
+    are returned.
+
+    :return: List of chosen submission IDs
+    """
+    chosen = []
+    skipped = []
+    while len(chosen) < n and queue:
+        entry = heapq.heappop(queue)
+        if is_excluded(entry[2]):
+            skipped.append(entry)
+        else:
+            chosen.append(entry)
+
+    for entry in chosen:
+        entry[0] += 1
+        entry[1] = -next(picks)
+        heapq.heappush(queue, entry)
+    for entry in skipped:
+        heapq.heappush(queue, entry)
+
+    return [entry[2] for entry in chosen]
 
 
 def make_distribution(assignment, students, submissions, n=DEFAULT_NUMBER_OF_REVIEWS_PER_STUDENT):
-    if submissions.count() < (DEFAULT_NUMBER_OF_REVIEWS_PER_STUDENT + 1):
+    submissions = list(submissions)
+    if len(submissions) < (n + 1):
         log.warning('Not enough submissions to distribute for course (%d), assignment (%d)'
                     % (assignment.course.id, assignment.id))
         return dict(), None
 
-    submissions_by_id = {submission.id: submission for submission in submissions}
-
-    submissions_to_review_by_student = {student.id: set() for student in students}
+    author_by_submission = {submission.id: submission.author_id for submission in submissions}
     review_count_by_submission = {submission.id: 0 for submission in submissions}
+    queue, picks = _make_review_queue(author_by_submission.keys(), review_count_by_submission)
 
+    submissions_to_review_by_student = {}
     for student in students:
-        # TODO careful... this may not terminate. probably an issue when len(students) < n
-        while len(submissions_to_review_by_student[student.id]) < n:
-            review_count_by_submission = OrderedDict(sorted(review_count_by_submission.items(), key=lambda t: t[1]))
-            for submission_id, _ in review_count_by_submission.items():
-                if submissions_by_id[submission_id].author_id != student.id \
-                        and submission_id not in submissions_to_review_by_student[student.id]:
-                    review_count_by_submission[submission_id] += 1
-                    submissions_to_review_by_student[student.id].add(submission_id)
-                    break
+        submission_ids = _take_least_reviewed(
+            queue, picks, n,
+            lambda submission_id: author_by_submission[submission_id] == student.id
+        )
+        if len(submission_ids) < n:
+            log.warning('Only (%d) of (%d) submissions could be assigned to student (%d) for course (%d), '
+                        'assignment (%d)' % (len(submission_ids), n, student.id, assignment.course.id, assignment.id))
+        for submission_id in submission_ids:
+            review_count_by_submission[submission_id] += 1
+        submissions_to_review_by_student[student.id] = set(submission_ids)
 
     return submissions_to_review_by_student, review_count_by_submission
 
 
+def add_to_distribution(rubric, students, n=DEFAULT_NUMBER_OF_REVIEWS_PER_STUDENT):
+    prompt = rubric.reviewed_assignment
+    students = list(students)
+
+    # one grouped query gives the review count index for every submission, including ones not yet reviewed
+    submissions = CanvasSubmission.objects.filter(assignment=prompt) \
+        .annotate(number_of_reviews=Count('peer_reviews_for_submission')) \
+        .order_by('id') \
+        .values_list('id', 'author_id', 'number_of_reviews')
+    author_by_submission = {}
+    review_count_by_submission = {}
+    for submission_id, author_id, number_of_reviews in submissions:
+        author_by_submission[submission_id] = author_id
+        review_count_by_submission[submission_id] = number_of_reviews
+    queue, picks = _make_review_queue(author_by_submission.keys(), review_count_by_submission)
+
+    existing_pairs = set(
+        PeerReview.objects.filter(submission__assignment=prompt, student__in=students)
+                          .values_list('student_id', 'submission_id')
+    )
+
+    new_reviews = []
+    for student in students:
+        submission_ids = _take_least_reviewed(
+            queue, picks, n,
+            lambda submission_id: author_by_submission[submission_id] == student.id or
+                                  (student.id, submission_id) in existing_pairs
+        )
+        if len(submission_ids) < n:
+            log.warning('Only (%d) of (%d) submissions could be assigned to student (%d) for rubric (%d)'
+                        % (len(submission_ids), n, student.id, rubric.id))
+        new_reviews.extend(PeerReview(student=student, submission_id=submission_id)
+                           for submission_id in submission_ids)
+
+    PeerReview.objects.bulk_create(new_reviews)
+    summaries.rebuild(rubric_ids=[rubric.id])
+    return new_reviews
+
+
 def distribute_reviews(rubric, utc_timestamp, force_distribution=False):
 
     # TODO need this safety check?
@@ -121,80 +188,129 @@ def distribute_reviews(rubric, utc_timestamp, force_distribution=False):
         PeerReviewDistribution.objects.create(rubric=rubric,
                                               is_distribution_complete=True,
                                               distributed_at_utc=utc_timestamp)
+        summaries.rebuild(rubric_ids=[rubric.id])
     else:
         log.warning('No peer reviews were created for course (%d), assignment (%d), rubric (%d)'
                   % (rubric.reviewed_assignment.course.id, rubric.reviewed_assignment.id, rubric.id))
 
 
+@contextmanager
+def _timed_phase(timings, phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = time.perf_counter() - start
+
+
+def _persist_assignments_for_course(course):
+    """:return: The course if its assignments could not be persisted, otherwise None"""
+    try:
+        log.debug('Persisting assignments for course %d' % course.id)
+        persist_assignments(course.id)
+    except Exception as ex:
+        log.error(f"Error persisting assignments from course {course.id}: {ex}")
+        return course
+
+
+def _persist_roster_for_course(course):
+    log.info('Persisting sections for course %d' % course.id)
+    persist_sections(course.id)
+
+    log.info('Persisting students for course %d' % course.id)
+    persist_students(course.id)
+
+
+def _distribute_prompt(prompt, utc_timestamp, force_distribution):
+    message = 'Distributing reviews for course %d prompt %d...' % (prompt.course.id, prompt.id)
+    attemptNumber = 1 + JobLog.objects.filter(message__istartswith=message).count()
+    useFaultTolerance: bool = (attemptNumber > settings.TOLERANCE_ATTEMPTS)
+
+    message += ' (Attempt: %d; Fault tolerance: %s)' % (attemptNumber, useFaultTolerance)
+
+    log.info(message)
+    JobLog.addMessage(message)
+
+    start = time.perf_counter()
+    try:
+        log.info('Fetching and persisting submissions for course %d prompt %d...' % (prompt.course.id, prompt.id))
+        persist_submissions(prompt, useFaultTolerance)
+        log.info('Finished persisting submissions for course %d prompt %d' % (prompt.course.id, prompt.id))
+
+        log.info('Distributing course %d prompt %d for review...' % (prompt.course.id, prompt.id))
+        with transaction.atomic():
+            distribute_reviews(prompt.rubric_for_prompt, utc_timestamp, force_distribution)
+        log.info('Finished review distribution for course %d prompt %d' % (prompt.course.id, prompt.id))
+
+    except Exception as ex:
+        # TODO show failed prompt distribution in status API
+        # TODO determine when is best to log exception, error, or warning.  some cases should just be warning
+        log.exception('Skipping review distribution for course %d prompt %d due to error' % (prompt.course.id, prompt.id))
+
+    log.info('Finished distributing reviews for course %d prompt %d in %.1fs'
+             % (prompt.course.id, prompt.id, time.perf_counter() - start))
+
+
 # TODO this isn't concurrency safe.  we're going to get around this for now by just using a single instance per course
-def review_distribution_task(utc_timestamp: datetime, force_distribution=False):
+def review_distribution_task(utc_timestamp: datetime, force_distribution=False, workers=None, report_timings=None):
+    if workers is None:
+        workers = settings.DISTRIBUTION_WORKERS
+    if report_timings is None:
+        report_timings = settings.DISTRIBUTION_REPORT_TIMINGS
+    timings = OrderedDict()
+
     JobLog.deleteOld()
+    remove_legacy_staging_directory()
 
     logMessage = 'Starting review distribution at %s' % utc_timestamp.isoformat()
     log.info(logMessage)
     JobLog.addMessage(logMessage)
 
     log.info('Persisting assignments for all courses')
-    # Keep track of all courses that have an error
-    courses_with_error = []
-    for course in CanvasCourse.objects.all():
-        try:
-            log.debug('Persisting assignments for course %d' % course.id)
-            persist_assignments(course.id)
-        except Exception as ex:
-            courses_with_error.append(course)
-            log.error(f"Error persisting assignments from course {course.id}: {ex}")
+    with _timed_phase(timings, 'assignments'):
+        # Keep track of all courses that have an error
+        courses_with_error = [course for course in map_concurrently(_persist_assignments_for_course,
+                                                                    CanvasCourse.objects.all(),
+                                                                    workers)
+                              if course is not None]
 
     try:
         # Get the prompts to distribute but exclude the courses that had an error earlier
         prompts_for_distribution = CanvasAssignment.objects.filter(
             rubric_for_prompt__peer_review_distribution=None,
             rubric_for_prompt__peer_review_open_date__lt=utc_timestamp
-        ).exclude(course__in=courses_with_error)
+        ).exclude(course__in=courses_with_error).select_related('course', 'rubric_for_prompt')
 
         if not prompts_for_distribution:
             log.info('No prompts ready for review distribution.')
         else:
-            courses = unique(map(lambda a: a.course, prompts_for_distribution))
-            for course in courses:
-                log.info('Persisting sections for course %d' % course.id)
-                persist_sections(course.id)
-
-                log.info('Persisting students for course %d' % course.id)
-                persist_students(course.id)
-
-            for prompt in prompts_for_distribution:
-                message = 'Distributing reviews for course %d prompt %d...' % (prompt.course.id, prompt.id)
-                attemptNumber = 1 + JobLog.objects.filter(message__istartswith=message).count()
-                useFaultTolerance: bool = (attemptNumber > settings.TOLERANCE_ATTEMPTS)
-
-                message += ' (Attempt: %d; Fault tolerance: %s)' % (attemptNumber, useFaultTolerance)
-
-                log.info(message)
-                JobLog.addMessage(message)
-
-
-                try:
-                    log.info('Fetching and persisting submissions for course %d prompt %d...' % (prompt.course.id, prompt.id))
-                    persist_submissions(prompt, useFaultTolerance)
-                    log.info('Finished persisting submissions for course %d prompt %d' % (prompt.course.id, prompt.id))
-
-                    log.info('Distributing course %d prompt %d for review...' % (prompt.course.id, prompt.id))
-                    with transaction.atomic():
-                        distribute_reviews(prompt.rubric_for_prompt, utc_timestamp, force_distribution)
-                    log.info('Finished review distribution for course %d prompt %d' % (prompt.course.id, prompt.id))
-
-                except Exception as ex:
-                    # TODO show failed prompt distribution in status API
-                    # TODO determine when is best to log exception, error, or warning.  some cases should just be warning
-                    log.exception('Skipping review distribution for course %d prompt %d due to error' % (prompt.course.id, prompt.id))
-
-                log.info('Finished distributing reviews for course %d prompt %d' % (prompt.course.id, prompt.id))
+            with _timed_phase(timings, 'sections and students'):
+                courses = unique(map(lambda a: a.course, prompts_for_distribution))
+                map_concurrently(_persist_roster_for_course, courses, workers)
+
+            with _timed_phase(timings, 'submissions and distribution'):
+                map_concurrently(partial(_distribute_prompt,
+                                         utc_timestamp=utc_timestamp,
+                                         force_distribution=force_distribution),
+                                 prompts_for_distribution,
+                                 workers)
     except Exception as ex:
         # TODO expose failed "all" distribution to health check
         log.exception('Review distribution failed due to uncaught exception')
         raise ex
 
+    # summaries are kept up to date as reviews change; this catches anything that changed some other way
+    with _timed_phase(timings, 'rubric summaries'):
+        stale_rubric_ids = summaries.rebuild()
+    if stale_rubric_ids:
+        log.warning('Rebuilt stale summaries for rubrics %s' % stale_rubric_ids)
+
+    if report_timings:
+        logMessage = 'Review distribution phase timings (%d worker(s)): %s' % \
+                     (workers, ', '.join('%s %.1fs' % (phase, seconds) for phase, seconds in timings.items()))
+        log.info(logMessage)
+        JobLog.addMessage(logMessage)
+
     logMessage = 'Finished review distribution that began at  %s' % utc_timestamp.isoformat()
     log.info(logMessage)
     JobLog.addMessage(logMessage)
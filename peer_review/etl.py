@@ -1,23 +1,50 @@
 import os
+import time
+import shutil
+import hashlib
 import logging
 import requests
-from zipfile import ZipFile
+from zipfile import ZipFile, ZipInfo, ZIP_STORED, ZIP_DEFLATED, ZIP64_LIMIT
 from functools import partial
+from collections import namedtuple
+from requests.adapters import HTTPAdapter
 
 from toolz.dicttoolz import dissoc
 from toolz.functoolz import thread_last, memoize
-from toolz.itertoolz import unique, remove
+from toolz.itertoolz import unique, remove, partition_all
 from django.db import transaction
 from django.conf import settings
 from django.utils.dateparse import parse_datetime
 
-from peer_review.util import to_camel_case
-from peer_review.canvas import retrieve
+import peer_review.storage as storage
+import peer_review.summaries as summaries
+from peer_review.util import to_camel_case, map_concurrently, bulk_update
+from peer_review.canvas import retrieve, iter_retrieve, retrieve_if_modified, cached_retrieve
 from peer_review.models import CanvasAssignment, CanvasSection, CanvasStudent, CanvasCourse, CanvasSubmission, Rubric, \
     JobLog
 
 log = logging.getLogger(__name__)
 
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+ASSIGNMENT_FIELDS = ['title', 'course_id', 'due_date_utc', 'is_peer_review_assignment']
+SECTION_FIELDS = ['name', 'course_id']
+STUDENT_FIELDS = ['username', 'full_name', 'sortable_name']
+SUBMISSION_FIELDS = ['author_id', 'assignment_id', 'filename']
+
+PersistCounts = namedtuple('PersistCounts', ['inserted', 'updated', 'unchanged'])
+
+# how many objects streamed from Canvas are handled together; the same as Canvas's largest page size
+BATCH_SIZE = 100
+
+# formats that are already compressed, so are stored rather than deflated when archiving multiple attachments
+PRECOMPRESSED_EXTENSIONS = {
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar',
+    '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp', '.pages', '.key', '.numbers', '.epub',
+    '.pdf', '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+    '.mp3', '.m4a', '.aac', '.ogg', '.mp4', '.m4v', '.mov', '.webm'
+}
+
 
 class AssignmentValidation:
     def __init__(self, **kwargs):
@@ -105,49 +132,137 @@ def persist_course(course_id):
     return course
 
 
-def persist_assignments(course_id):
-    section_name_getter = memoize(lambda section_id: retrieve('section', course_id, section_id)['name'])
-    assignment_converter = partial(_convert_assignment, section_name_getter)
-
-    canvas_assignments = retrieve('assignments', course_id)
-    assignments = [assignment_converter(canvas_assignment) for canvas_assignment in canvas_assignments]
-
-    for assignment in assignments:
-        if not assignment.is_peer_review_assignment:
-            try:
-                rubric = CanvasAssignment.objects.get(id=assignment.id).rubric_for_prompt
-                if rubric.peer_review_open_date_is_prompt_due_date:
-                    if assignment.due_date_utc:
-                        rubric.peer_review_open_date = assignment.due_date_utc
-                        rubric.save()
-                    else:
-                        log.warning(
-                            'Rubric (%d) for course (%d) has peer review open date set to prompt "%s" (%d) due date, '
-                            'but prompt has no due date!' %
-                            (rubric.id, course_id, assignment.title, assignment.id)
-                        )
-                else:
-                    if assignment.due_date_utc is None:
-                        log.warning('Prompt assignment "%s" (%d) for course (%d) does not have a due date '
-                                    '(rubric (%d))' %
-                                    (assignment.title, assignment.id, course_id, rubric.id))
-                        continue
-
-                    if rubric.peer_review_open_date is None:
-                        log.warning('Rubric (%d) for course (%d) does not have a due date (assignment "%s" (%d))' %
-                                    (rubric.id, course_id, assignment.title, assignment.id))
-                        continue
-
-                    if rubric.peer_review_open_date < assignment.due_date_utc:
-                        log.warning('Prompt "%s" (%d) for course (%d) has a due date later than rubric (%d)\'s '
-                                    'peer review open date' %
-                                    (assignment.title, assignment.id, course_id, rubric.id))
-            except CanvasAssignment.DoesNotExist:
-                pass
-            except Rubric.DoesNotExist:
-                pass
-        assignment.save()
-    return assignments
+def _open_date_update(rubric, assignment, course_id):
+    """
+    Check a prompt's rubric against the prompt's due date.
+
+    :return: Tuple of whether the rubric's peer review open date needs to follow the new due date, and whether the
+             prompt assignment should be persisted at all
+    """
+    if rubric.peer_review_open_date_is_prompt_due_date:
+        if assignment.due_date_utc:
+            return rubric.peer_review_open_date != assignment.due_date_utc, True
+        else:
+            log.warning(
+                'Rubric (%d) for course (%d) has peer review open date set to prompt "%s" (%d) due date, '
+                'but prompt has no due date!' %
+                (rubric.id, course_id, assignment.title, assignment.id)
+            )
+    else:
+        if assignment.due_date_utc is None:
+            log.warning('Prompt assignment "%s" (%d) for course (%d) does not have a due date '
+                        '(rubric (%d))' %
+                        (assignment.title, assignment.id, course_id, rubric.id))
+            return False, False
+
+        if rubric.peer_review_open_date is None:
+            log.warning('Rubric (%d) for course (%d) does not have a due date (assignment "%s" (%d))' %
+                        (rubric.id, course_id, assignment.title, assignment.id))
+            return False, False
+
+        if rubric.peer_review_open_date < assignment.due_date_utc:
+            log.warning('Prompt "%s" (%d) for course (%d) has a due date later than rubric (%d)\'s '
+                        'peer review open date' %
+                        (assignment.title, assignment.id, course_id, rubric.id))
+    return False, True
+
+
+def _changed_fields(existing, updated, fields):
+    return [field for field in fields if getattr(existing, field) != getattr(updated, field)]
+
+
+def _persist_changes(model, objs, fields):
+    """
+    Write only the objects that are new or whose `fields` differ from their existing rows, in bulk.  Of several
+    objects with the same primary key, the last one is written.
+
+    :return: `PersistCounts` of the objects
+    """
+    objs = list({obj.pk: obj for obj in objs}.values())
+    existing = model.objects.in_bulk([obj.pk for obj in objs])
+    new_objs = [obj for obj in objs if obj.pk not in existing]
+    changed_objs = [obj for obj in objs if obj.pk in existing and _changed_fields(existing[obj.pk], obj, fields)]
+    model.objects.bulk_create(new_objs)
+    bulk_update(model, changed_objs, fields)
+    return PersistCounts(inserted=len(new_objs),
+                         updated=len(changed_objs),
+                         unchanged=len(objs) - len(new_objs) - len(changed_objs))
+
+
+def _stored_section_name_getter(course_id):
+    section_names = dict(CanvasSection.objects.filter(course_id=course_id).values_list('id', 'name'))
+
+    def section_name_getter(section_id):
+        return section_names.get(section_id, 'Section %d' % section_id)
+
+    return section_name_getter
+
+
+def persist_assignments(course_id, with_counts=False):
+    """
+    Assignments are retrieved with conditional requests; if Canvas reports that none changed, the diff against the
+    stored assignments is skipped (rubric open dates are still checked, since rubrics change here rather than in
+    Canvas).
+
+    :return: List of the course's assignments from Canvas (with validations), and if `with_counts` is set, the
+             `PersistCounts` of the assignments too
+    """
+    # the cached Canvas response is only kept if the assignments made from it are
+    with transaction.atomic():
+        canvas_assignments, modified = retrieve_if_modified('assignments', course_id)
+        if modified:
+            section_name_getter = memoize(lambda section_id: retrieve('section', course_id, section_id)['name'])
+        else:
+            # nothing changed in Canvas, so it is not asked about the sections either
+            section_name_getter = _stored_section_name_getter(course_id)
+        assignment_converter = partial(_convert_assignment, section_name_getter)
+        assignments = [assignment_converter(canvas_assignment) for canvas_assignment in canvas_assignments]
+
+        rubrics_by_prompt_id = {rubric.reviewed_assignment_id: rubric
+                                for rubric in Rubric.objects.filter(
+                                    reviewed_assignment_id__in=[a.id for a in assignments
+                                                                if not a.is_peer_review_assignment])}
+
+        assignments_to_persist = []
+        rubrics_to_update = []
+        for assignment in assignments:
+            rubric = rubrics_by_prompt_id.get(assignment.id)
+            if rubric is not None:
+                update_open_date, persist_assignment = _open_date_update(rubric, assignment, course_id)
+                if update_open_date:
+                    rubric.peer_review_open_date = assignment.due_date_utc
+                    rubrics_to_update.append(rubric)
+                if not persist_assignment:
+                    continue
+            assignments_to_persist.append(assignment)
+
+        bulk_update(Rubric, rubrics_to_update, ['peer_review_open_date'])
+        if rubrics_to_update:
+            summaries.rebuild(rubric_ids=[rubric.id for rubric in rubrics_to_update])
+        if modified:
+            counts = _persist_changes(CanvasAssignment, assignments_to_persist, ASSIGNMENT_FIELDS)
+        else:
+            counts = PersistCounts(inserted=0, updated=0, unchanged=len(assignments_to_persist))
+
+    log.debug('Persisted assignments for course (%d)%s: %s; (%d) rubric open date(s) updated' %
+              (course_id, '' if modified else ' (not modified in Canvas)', counts, len(rubrics_to_update)))
+    return (assignments, counts) if with_counts else assignments
+
+
+def stored_assignments(course_id):
+    """
+    Convert the course's assignments from the Canvas response that `persist_assignments` last stored, without
+    contacting Canvas.  Section names for validations come from the stored sections; a section that has not been
+    stored yet is named by its ID.
+
+    :return: List of assignments (with validations), or None if no response was stored
+    """
+    canvas_assignments = cached_retrieve('assignments', course_id)
+    if canvas_assignments is None:
+        return None
+
+    assignment_converter = partial(_convert_assignment, _stored_section_name_getter(course_id))
+    return [assignment_converter(canvas_assignment) for canvas_assignment in canvas_assignments]
 
 
 def _convert_section(section):
@@ -155,11 +270,21 @@ def _convert_section(section):
 
 
 def persist_sections(course_id):
-    raw_sections = retrieve('sections', course_id)
-    sections = list(map(_convert_section, raw_sections))
+    """
+    Sections are retrieved with conditional requests; if Canvas reports that none changed, nothing is written.
+
+    :return: `PersistCounts` of the course's sections
+    """
     with transaction.atomic():
-        for section in sections:
-            section.save()
+        raw_sections, modified = retrieve_if_modified('sections', course_id)
+        sections = list(map(_convert_section, raw_sections))
+        if modified:
+            counts = _persist_changes(CanvasSection, sections, SECTION_FIELDS)
+        else:
+            counts = PersistCounts(inserted=0, updated=0, unchanged=len(sections))
+    log.debug('Persisted sections for course (%d)%s: %s' %
+              (course_id, '' if modified else ' (not modified in Canvas)', counts))
+    return counts
 
 
 def _convert_student(raw_student):
@@ -177,71 +302,175 @@ def _convert_student(raw_student):
     )
 
 
+def _persist_student_batch(course, course_section_ids, raw_students):
+    counts = _persist_changes(CanvasStudent, map(_convert_student, raw_students), STUDENT_FIELDS)
+    student_ids = list(unique(raw_student['id'] for raw_student in raw_students))
+
+    StudentCourse = CanvasStudent.courses.through
+    enrolled_student_ids = set(StudentCourse.objects
+                               .filter(canvascourse_id=course.id, canvasstudent_id__in=student_ids)
+                               .values_list('canvasstudent_id', flat=True))
+    StudentCourse.objects.bulk_create([StudentCourse(canvasstudent_id=student_id, canvascourse_id=course.id)
+                                       for student_id in student_ids
+                                       if student_id not in enrolled_student_ids])
+
+    section_memberships = set()
+    for raw_student in raw_students:
+        for enrollment in raw_student['enrollments']:
+            section_id = enrollment['course_section_id']
+            if section_id not in course_section_ids:
+                # not one of this course's sections; fails just as it always has if the section is unknown
+                section_id = CanvasSection.objects.get(id=section_id).id
+            section_memberships.add((raw_student['id'], section_id))
+
+    StudentSection = CanvasStudent.sections.through
+    existing_memberships = set(StudentSection.objects
+                               .filter(canvasstudent_id__in=student_ids)
+                               .values_list('canvasstudent_id', 'canvassection_id'))
+    StudentSection.objects.bulk_create([StudentSection(canvasstudent_id=student_id, canvassection_id=section_id)
+                                        for student_id, section_id in section_memberships - existing_memberships])
+
+    return counts
+
+
 def persist_students(course_id):
+    """
+    :return: `PersistCounts` of the course's students
+    """
     course = CanvasCourse.objects.get(id=course_id)
-    raw_students = retrieve('students', course_id)
-    enrollments_by_student_id = {s['id']: s['enrollments'] for s in raw_students}
-    students = list(map(_convert_student, raw_students))
+    course_section_ids = set(CanvasSection.objects.filter(course=course).values_list('id', flat=True))
+    counts = PersistCounts(0, 0, 0)
+    for raw_students in partition_all(BATCH_SIZE, iter_retrieve('students', course_id)):
+        with transaction.atomic():
+            batch_counts = _persist_student_batch(course, course_section_ids, raw_students)
+        counts = PersistCounts(*map(sum, zip(counts, batch_counts)))
+    log.debug('Persisted students for course (%d): %s' % (course_id, counts))
+    return counts
 
-    with transaction.atomic():
-        for student in students:
-            student.save()
-            student.courses.add(course)
-            for enrollment in enrollments_by_student_id[student.id]:
-                student.sections.add(CanvasSection.objects.get(id=enrollment['course_section_id']))
+
+def _make_download_session():
+    """
+    Make a session for downloading submission attachments, which reuses up to
+    `settings.SUBMISSION_DOWNLOAD_CONNECTIONS_PER_HOST` keep-alive connections to each host.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=settings.SUBMISSION_DOWNLOAD_CONNECTIONS_PER_HOST,
+                          pool_block=True)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
 
-def _download_single_attachment(destination, attachment, useFaultTolerance: bool):
+def _write_chunks(response, destination_file):
     """
-    Try to download an attachment and save to destination directory.
+    Copy a streamed response's body into an open file one chunk at a time.
+
+    :return: Tuple of the body's SHA-256 hex digest and its size in bytes
+    """
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+        destination_file.write(chunk)
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
 
-    :return: Tuple of strings containing filename and error message (or None)
+def _fetch_attachment(session, attachment, write, useFaultTolerance: bool):
+    """
+    Try to download an attachment, passing the streamed response to `write`.
+
+    :return: String containing an error message, or None
     """
     attachment_filename = '%d_%s' % (attachment['id'], attachment['filename'])
     log.info('Downloading "%s"...' % (attachment_filename))
-    attachment_response = requests.get(attachment['url'])
 
     try:
-        if (settings.DEBUG) and (settings.TOLERANCE_TEST_ERRONEOUS_FILENAME == attachment['filename']):
-            raise Exception('got "%s" test file (see "MPR_TOLERANCE_TEST_ERRONEOUS_FILENAME" in environment)' %
-                            (settings.TOLERANCE_TEST_ERRONEOUS_FILENAME))
-        attachment_response.raise_for_status()
+        attachment_response = session.get(attachment['url'], stream=True,
+                                          timeout=settings.SUBMISSION_DOWNLOAD_TIMEOUT)
+        try:
+            if (settings.DEBUG) and (settings.TOLERANCE_TEST_ERRONEOUS_FILENAME == attachment['filename']):
+                raise Exception('got "%s" test file (see "MPR_TOLERANCE_TEST_ERRONEOUS_FILENAME" in environment)' %
+                                (settings.TOLERANCE_TEST_ERRONEOUS_FILENAME))
+            attachment_response.raise_for_status()
+            digest, size = write(attachment_response)
+        finally:
+            attachment_response.close()
     except Exception as requestException:
         if (not useFaultTolerance):
             raise
         message = 'Trouble downloading "%s": %s' % (attachment_filename, requestException)
         JobLog.addMessage(message)
         log.warning(message)
-        return (attachment_filename, str(requestException))
+        return str(requestException)
 
-    attachment_path = os.path.join(destination, attachment_filename)
-    with open(attachment_path, 'wb') as attachment_file:
-        attachment_file.write(attachment_response.content)
-    return (attachment_filename, None)
+    log.debug('Saved "%s" (%d bytes, SHA-256 %s)' % (attachment_filename, size, digest))
+    return None
 
 
-def _download_multiple_attachments(destination, submission, useFaultTolerance: bool):
+def _download_single_attachment(session, attachment, useFaultTolerance: bool):
     """
-    Try to download multiple attachments and save to ZIP file in destination directory.
+    Try to download an attachment and save it to the submission store.
 
-    :return: Tuple of strings containing filename and error message (or None)
+    :return: Tuple of error message (or None) and stored content's digest and size (or None)
     """
-    submission_id_str = str(submission['id'])
-    temp_directory_path = os.path.join(settings.MEDIA_ROOT, 'temporary', submission_id_str)
-    os.makedirs(temp_directory_path, exist_ok=True)
-    error = None
-    for attachment in submission['attachments']:
-        (filename, error) = _download_single_attachment(temp_directory_path, attachment, useFaultTolerance)
-        if (error):
-            break
-    attachment_archive_filename = '%d_submissions.zip' % submission['id']
-    attachment_archive_full_path = os.path.join(destination, attachment_archive_filename)
-    with ZipFile(attachment_archive_full_path, 'w') as archive_file:
-        for _, _, files in os.walk(temp_directory_path):
-            for fn in files:
-                archive_file.write(os.path.join(temp_directory_path, fn),
-                                   arcname=os.path.join(submission_id_str, fn))
-    return (attachment_archive_filename, error)
+    stored = []
+
+    def write(response):
+        stored.append(storage.store(lambda f: _write_chunks(response, f)))
+        return stored[0]
+
+    error = _fetch_attachment(session, attachment, write, useFaultTolerance)
+    return (error, stored[0] if stored else None)
+
+
+def _archive_entry(submission_id, attachment):
+    attachment_filename = '%d_%s' % (attachment['id'], attachment['filename'])
+    entry = ZipInfo(os.path.join(str(submission_id), attachment_filename), date_time=time.localtime()[:6])
+    _, extension = os.path.splitext(attachment_filename)
+    if extension.lower() in PRECOMPRESSED_EXTENSIONS:
+        entry.compress_type = ZIP_STORED
+    else:
+        entry.compress_type = ZIP_DEFLATED
+    return entry
+
+
+def _download_multiple_attachments(session, submission, useFaultTolerance: bool):
+    """
+    Try to download multiple attachments and save them to the submission store as one ZIP file.  Each attachment is
+    streamed straight into its archive entry; the archive is only kept if every attachment was downloaded.
+
+    :return: Tuple of error message (or None) and stored archive's digest and size (or None)
+    """
+    class IncompleteArchive(Exception):
+        pass
+
+    def write_archive(archive_file):
+        with ZipFile(archive_file, 'w') as archive:
+            for attachment in submission['attachments']:
+                entry = _archive_entry(submission['id'], attachment)
+                force_zip64 = attachment.get('size') is None or attachment['size'] >= ZIP64_LIMIT
+
+                def write_entry(response):
+                    with archive.open(entry, 'w', force_zip64=force_zip64) as entry_file:
+                        return _write_chunks(response, entry_file)
+
+                error = _fetch_attachment(session, attachment, write_entry, useFaultTolerance)
+                if (error):
+                    raise IncompleteArchive(error)
+
+    try:
+        return (None, storage.store(write_archive))
+    except IncompleteArchive as ex:
+        return (str(ex), None)
+
+
+def _submission_filename(raw_submission):
+    attachments = raw_submission['attachments']
+    if len(attachments) > 1:
+        return '%d_submissions.zip' % raw_submission['id']
+    else:
+        return '%d_%s' % (attachments[0]['id'], attachments[0]['filename'])
 
 
 def _convert_submission(raw_submission, filename, error):
@@ -258,33 +487,79 @@ def _convert_submission(raw_submission, filename, error):
     return submissionData
 
 
-def _download_submission(raw_submission, useFaultTolerance: bool):
+def _download_submission(session, raw_submission, useFaultTolerance: bool):
+    """
+    :return: Tuple of submission data (see `_convert_submission`) and stored content's digest and size (or None)
+    """
     log.info('Downloading submission (%d) file(s) from student (%d) for assignment (%d)...' %
              (raw_submission['id'], raw_submission['user_id'], raw_submission['assignment_id']))
     attachments = raw_submission['attachments']
-    destination = os.path.join(settings.MEDIA_ROOT, 'submissions')
-    os.makedirs(destination, exist_ok=True)
     if len(attachments) > 1:
-        (filename, error) = _download_multiple_attachments(destination, raw_submission, useFaultTolerance)
+        (error, stored) = _download_multiple_attachments(session, raw_submission, useFaultTolerance)
     else:
-        (filename, error) = _download_single_attachment(destination, raw_submission['attachments'][0], useFaultTolerance)
-    return _convert_submission(raw_submission, filename, error)
+        (error, stored) = _download_single_attachment(session, attachments[0], useFaultTolerance)
+    return (_convert_submission(raw_submission, _submission_filename(raw_submission), error), stored)
+
+
+def _download_submission_batch(session, raw_submissions, useFaultTolerance: bool):
+    fingerprints = {_submission_filename(s): storage.fingerprint(s['attachments']) for s in raw_submissions}
+    current_filenames = storage.current_filenames(fingerprints)
+
+    def download(raw_submission):
+        filename = _submission_filename(raw_submission)
+        if filename in current_filenames:
+            log.info('Submission (%d) is unchanged since it was last downloaded; skipping download' %
+                     raw_submission['id'])
+            return (_convert_submission(raw_submission, filename, None), None)
+        return _download_submission(session, raw_submission, useFaultTolerance)
+
+    downloaded = map_concurrently(download, raw_submissions, settings.SUBMISSION_DOWNLOAD_WORKERS)
+
+    # the index is written once the batch's downloads have finished, so worker threads only ever touch the file system
+    storage.index((submission['filename'], fingerprints[submission['filename']]) + stored
+                  for submission, stored in downloaded
+                  if stored is not None)
+    return [submission for submission, _ in downloaded]
+
+
+def remove_legacy_staging_directory():
+    """
+    Remove the directory that attachments used to be staged in before being archived; nothing uses it any more.  Call
+    this before any downloads start, never while they are running.
+    """
+    shutil.rmtree(os.path.join(settings.MEDIA_ROOT, 'temporary'), ignore_errors=True)
+
+
+def _download_submissions(raw_submissions, useFaultTolerance: bool):
+    """
+    Download the attachments of each submission, `settings.SUBMISSION_DOWNLOAD_WORKERS` submissions at a time, over
+    one shared session.  Submissions whose attachments have not changed since they were last downloaded are skipped.
+
+    `raw_submissions` is consumed `BATCH_SIZE` at a time, so downloads can start while later submissions are still
+    being retrieved from Canvas.
+
+    :return: List of submission data (see `_convert_submission`), in the same order as `raw_submissions`
+    """
+    submission_data = []
+    with _make_download_session() as session:
+        for raw_submission_batch in partition_all(BATCH_SIZE, raw_submissions):
+            submission_data += _download_submission_batch(session, raw_submission_batch, useFaultTolerance)
+    return submission_data
 
 
 def persist_submissions(assignment: CanvasAssignment, useFaultTolerance: bool):
     log.info('Persisting submissions for course (%d), assignment (%d)...' %
              (assignment.course.id, assignment.id))
 
-    courseStudentIds = CanvasStudent.objects \
-        .filter(courses=assignment.course) \
-        .values_list('id', flat=True)
+    courseStudentIds = set(CanvasStudent.objects
+                           .filter(courses=assignment.course)
+                           .values_list('id', flat=True))
 
-    submissionData: list = thread_last(retrieve('submissions', assignment.course.id, assignment.id),
+    submissionData: list = thread_last(iter_retrieve('submissions', assignment.course.id, assignment.id),
                                        (remove, lambda s: s['user_id'] not in courseStudentIds),
                                        (remove, lambda s: s['workflow_state'] == 'unsubmitted'),
                                        (remove, lambda s: s.get('attachments') is None),
-                                       (map, lambda s: _download_submission(s, useFaultTolerance)),
-                                       list)
+                                       partial(_download_submissions, useFaultTolerance=useFaultTolerance))
 
     if (len(submissionData) == 0):
         message = ('Unable to persist submissions for course (%d), assignment (%d).'
@@ -315,10 +590,14 @@ def persist_submissions(assignment: CanvasAssignment, useFaultTolerance: bool):
                       (assignment.course.id, assignment.id, errorRate, settings.TOLERANCE_RATE)
             log.info(message)
 
-    thread_last(submissionData,
-                (remove, lambda s: s.get('error') is not None),
-                (map, lambda s: CanvasSubmission.objects.update_or_create(id=s['id'], defaults=dissoc(s, 'id'))),
-                list)
+    submissions: list = thread_last(submissionData,
+                                    (remove, lambda s: s.get('error') is not None),
+                                    (map, lambda s: CanvasSubmission(**dissoc(s, 'error'))),
+                                    list)
 
-    log.info('Persisting submissions for course (%d), assignment (%d) complete.' %
-             (assignment.course.id, assignment.id))
+    # a submission may already be stored under another assignment, so it is matched by ID alone
+    with transaction.atomic():
+        counts = _persist_changes(CanvasSubmission, submissions, SUBMISSION_FIELDS)
+
+    log.info('Persisting submissions for course (%d), assignment (%d) complete: %s.' %
+             (assignment.course.id, assignment.id, counts))
@@ -10,9 +10,17 @@ logger = logging.getLogger('management_commands')
 class Command(BaseCommand):
     help = 'Distributes submissions for peer review'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', dest='workers', type=int, required=False,
+                            help='Number of courses/prompts to process concurrently (defaults to MPR_DIST_WORKERS)')
+        parser.add_argument('--timings', dest='report_timings', action='store_true', default=None,
+                            help='Report wall-clock time for each phase of the distribution')
+
     def handle(self, *args, **options):
         try:
-            review_distribution_task(datetime.now(tzutc()))
+            review_distribution_task(datetime.now(tzutc()),
+                                     workers=options.get('workers'),
+                                     report_timings=options.get('report_timings'))
         except Exception as ex:
             logger.exception('Uncaught exception when running review distribution task')
             raise CommandError('Failed to distribute peer reviews') from ex
@@ -0,0 +1,22 @@
+import logging
+from django.core.management import BaseCommand, CommandError
+from peer_review.completion import rebuild
+
+logger = logging.getLogger('management_commands')
+
+
+class Command(BaseCommand):
+    help = 'Recounts rubric criteria and peer review comments, and fixes the stored completion counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rubric', dest='rubric_ids', type=int, action='append', required=False,
+                            help='Only rebuild the counters for this rubric (may be given more than once)')
+        parser.add_argument('--check', dest='check', action='store_true', default=False,
+                            help='Only report stale counters, without fixing them; fails if any are found')
+
+    def handle(self, *args, **options):
+        stale = rebuild(rubric_ids=options.get('rubric_ids'), fix=not options['check'])
+        message = '%d rubrics and %d peer reviews had stale counters' % (stale.rubrics, stale.peer_reviews)
+        if options['check'] and any(stale):
+            raise CommandError(message)
+        self.stdout.write(message)
@@ -0,0 +1,24 @@
+import logging
+from django.core.management import BaseCommand, CommandError
+from peer_review.summaries import rebuild
+
+logger = logging.getLogger('management_commands')
+
+
+class Command(BaseCommand):
+    help = 'Compares the instructor dashboard\'s rubric summaries with the reviews they summarize, and fixes them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rubric', dest='rubric_ids', type=int, action='append', required=False,
+                            help='Only rebuild the summary of this rubric (may be given more than once)')
+        parser.add_argument('--check', dest='check', action='store_true', default=False,
+                            help='Only report stale summaries, without fixing them; fails if any are found')
+
+    def handle(self, *args, **options):
+        stale_rubric_ids = rebuild(rubric_ids=options.get('rubric_ids'), fix=not options['check'])
+        message = '%d rubric summaries were stale' % len(stale_rubric_ids)
+        if stale_rubric_ids:
+            message += ': %s' % ', '.join(map(str, stale_rubric_ids))
+        if options['check'] and stale_rubric_ids:
+            raise CommandError(message)
+        self.stdout.write(message)
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 12:35
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peer_review', '0010_utf8mb4_conversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubmissionFile',
+            fields=[
+                ('filename', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('fingerprint', models.CharField(blank=True, max_length=64)),
+                ('sha256', models.CharField(db_index=True, max_length=64)),
+                ('size', models.BigIntegerField()),
+                ('stored_at_utc', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'submission_files',
+            },
+        ),
+    ]
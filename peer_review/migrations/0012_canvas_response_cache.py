@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 12:49
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peer_review', '0011_submission_files'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CanvasResponseCache',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('url', models.TextField()),
+                ('etag', models.TextField(blank=True)),
+                ('last_modified', models.TextField(blank=True)),
+                ('link', models.TextField(blank=True)),
+                ('body', models.TextField()),
+                ('fetched_at_utc', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'canvas_response_cache',
+            },
+        ),
+    ]
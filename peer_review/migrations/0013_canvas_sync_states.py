@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 12:51
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peer_review', '0012_canvas_response_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CanvasSyncState',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('course_id', models.IntegerField()),
+                ('resource', models.CharField(max_length=32)),
+                ('synced_at_utc', models.DateTimeField(blank=True, null=True)),
+                ('refresh_claimed_until_utc', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'canvas_sync_states',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='canvassyncstate',
+            unique_together=set([('course_id', 'resource')]),
+        ),
+    ]
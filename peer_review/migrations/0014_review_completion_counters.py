@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 13:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_completion(apps, schema_editor):
+    Rubric = apps.get_model('peer_review', 'Rubric')
+    Criterion = apps.get_model('peer_review', 'Criterion')
+    PeerReview = apps.get_model('peer_review', 'PeerReview')
+    PeerReviewComment = apps.get_model('peer_review', 'PeerReviewComment')
+
+    criteria = Criterion.objects.filter(rubric=OuterRef('pk')).order_by().values('rubric')
+    Rubric.objects.update(criteria_count=Coalesce(
+        Subquery(criteria.annotate(count=Count('id')).values('count'), output_field=models.IntegerField()), 0))
+
+    comments = PeerReviewComment.objects.filter(peer_review=OuterRef('pk')).order_by().values('peer_review')
+    PeerReview.objects.update(
+        comment_count=Coalesce(
+            Subquery(comments.annotate(count=Count('id')).values('count'), output_field=models.IntegerField()), 0),
+        completed_at_utc=Subquery(comments.annotate(last=Max('commented_at_utc')).values('last'),
+                                  output_field=models.DateTimeField()))
+
+    for rubric in Rubric.objects.exclude(reviewed_assignment=None):
+        peer_reviews = PeerReview.objects.filter(submission__assignment_id=rubric.reviewed_assignment_id)
+        peer_reviews.filter(comment_count__gte=rubric.criteria_count).update(is_complete=True)
+        peer_reviews.filter(comment_count__lt=rubric.criteria_count).update(completed_at_utc=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peer_review', '0013_canvas_sync_states'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='peerreview',
+            name='comment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='peerreview',
+            name='completed_at_utc',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='peerreview',
+            name='is_complete',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='rubric',
+            name='criteria_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_completion, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 13:03
+from __future__ import unicode_literals
+
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+from django.db.models import Count, Case, When, Value
+import django.db.models.deletion
+
+
+def summarize_rubrics(apps, schema_editor):
+    Rubric = apps.get_model('peer_review', 'Rubric')
+    RubricSummary = apps.get_model('peer_review', 'RubricSummary')
+    PeerReviewDistribution = apps.get_model('peer_review', 'PeerReviewDistribution')
+
+    peer_reviews = 'reviewed_assignment__canvas_submission_set__peer_reviews_for_submission'
+    rubrics = Rubric.objects \
+        .filter(reviewed_assignment__isnull=False) \
+        .select_related('reviewed_assignment') \
+        .annotate(number_of_assigned_reviews=Count(peer_reviews),
+                  number_of_completed_reviews=Count(Case(When(**{peer_reviews + '__is_complete': True},
+                                                               then=Value(1)))))
+    distributions = {d.rubric_id: d for d in PeerReviewDistribution.objects.all()}
+
+    now = datetime.now(timezone.utc)
+    summaries = []
+    for rubric in rubrics:
+        distribution = distributions.get(rubric.id)
+        summaries.append(RubricSummary(
+            rubric_id=rubric.id,
+            course_id=rubric.reviewed_assignment.course_id,
+            prompt_id=rubric.reviewed_assignment_id,
+            peer_review_assignment_id=rubric.passback_assignment_id,
+            open_date=distribution.distributed_at_utc if distribution and distribution.distributed_at_utc
+            else rubric.peer_review_open_date,
+            number_of_assigned_reviews=rubric.number_of_assigned_reviews,
+            number_of_completed_reviews=rubric.number_of_completed_reviews,
+            evaluation_due_date=rubric.peer_review_evaluation_due_date,
+            evaluation_mandatory=rubric.peer_review_evaluation_is_mandatory,
+            reviews_in_progress=distribution is not None and distribution.is_distribution_complete,
+            refreshed_at_utc=now))
+    RubricSummary.objects.bulk_create(summaries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peer_review', '0014_review_completion_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RubricSummary',
+            fields=[
+                ('rubric', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='summary', serialize=False, to='peer_review.Rubric')),
+                ('course_id', models.IntegerField()),
+                ('prompt_id', models.IntegerField()),
+                ('open_date', models.DateTimeField(blank=True, null=True)),
+                ('number_of_assigned_reviews', models.IntegerField(default=0)),
+                ('number_of_completed_reviews', models.IntegerField(default=0)),
+                ('evaluation_due_date', models.DateTimeField(blank=True, null=True)),
+                ('evaluation_mandatory', models.BooleanField(default=False)),
+                ('reviews_in_progress', models.BooleanField(default=False)),
+                ('refreshed_at_utc', models.DateTimeField()),
+                ('peer_review_assignment', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='rubric_summaries', to='peer_review.CanvasAssignment')),
+            ],
+            options={
+                'db_table': 'rubric_summaries',
+            },
+        ),
+        migrations.RunPython(summarize_rubrics, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 13:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peer_review', '0015_rubric_summaries'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='submissionfile',
+            name='stored_at_utc',
+            field=models.DateTimeField(),
+        ),
+    ]
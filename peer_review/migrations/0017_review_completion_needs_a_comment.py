@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 13:34
+from __future__ import unicode_literals
+
+from datetime import datetime, timezone
+
+from django.db import migrations
+from django.db.models import Q
+
+
+def uncomplete_reviews_without_comments(apps, schema_editor):
+    PeerReview = apps.get_model('peer_review', 'PeerReview')
+    RubricSummary = apps.get_model('peer_review', 'RubricSummary')
+
+    # 0014 counted reviews of rubrics without criteria as complete before they had any comments (and without a
+    # completion time), and left a completion time on reviews of prompts without a rubric
+    wrongly_complete = PeerReview.objects.filter(Q(comment_count=0) | Q(completed_at_utc=None), is_complete=True)
+    prompt_ids = set(wrongly_complete.values_list('submission__assignment_id', flat=True))
+    wrongly_complete.update(is_complete=False, completed_at_utc=None)
+    PeerReview.objects.filter(is_complete=False).exclude(completed_at_utc=None).update(completed_at_utc=None)
+
+    now = datetime.now(timezone.utc)
+    for summary in RubricSummary.objects.filter(prompt_id__in=prompt_ids):
+        summary.number_of_completed_reviews = PeerReview.objects \
+            .filter(submission__assignment_id=summary.prompt_id, is_complete=True) \
+            .count()
+        summary.refreshed_at_utc = now
+        summary.save(update_fields=['number_of_completed_reviews', 'refreshed_at_utc'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peer_review', '0016_submission_file_stored_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(uncomplete_reviews_without_comments, migrations.RunPython.noop),
+    ]
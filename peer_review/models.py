@@ -74,17 +74,59 @@ class CanvasSubmission(models.Model):
     @property
     def num_comments_each_review_per_student(self):
         return PeerReview.objects.filter(student=self.author, submission__assignment=self.assignment) \
-                                 .annotate(completed=models.Count('comments', distinct=True))
+                                 .annotate(completed=models.F('comment_count'))
 
     @property
     def num_comments_each_review_per_submission(self):
         return PeerReview.objects.filter(submission=self) \
-                                 .annotate(received=models.Count('comments', distinct=True))
+                                 .annotate(received=models.F('comment_count'))
 
     class Meta:
         db_table = 'canvas_submissions'
 
 
+# noinspection PyClassHasNoInit
+class SubmissionFile(models.Model):
+
+    filename = models.CharField(primary_key=True, max_length=255)
+    fingerprint = models.CharField(max_length=64, blank=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField()
+    stored_at_utc = models.DateTimeField()  # set by peer_review.storage.index
+
+    class Meta:
+        db_table = 'submission_files'
+
+
+# noinspection PyClassHasNoInit
+class CanvasResponseCache(models.Model):
+
+    key = models.CharField(primary_key=True, max_length=64)
+    url = models.TextField()
+    etag = models.TextField(blank=True)
+    last_modified = models.TextField(blank=True)
+    link = models.TextField(blank=True)
+    body = models.TextField()
+    fetched_at_utc = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'canvas_response_cache'
+
+
+# noinspection PyClassHasNoInit
+class CanvasSyncState(models.Model):
+
+    id = models.AutoField(primary_key=True)
+    course_id = models.IntegerField()
+    resource = models.CharField(max_length=32)
+    synced_at_utc = models.DateTimeField(blank=True, null=True)
+    refresh_claimed_until_utc = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'canvas_sync_states'
+        unique_together = ('course_id', 'resource')
+
+
 # noinspection PyClassHasNoInit
 class Rubric(models.Model):
 
@@ -113,10 +155,12 @@ class Rubric(models.Model):
     peer_review_evaluation_due_date = models.DateTimeField(blank=True, null=True)
     distribute_peer_reviews_for_sections = models.BooleanField(default=False)
     sections = models.ManyToManyField(CanvasSection, blank=True)
+    # maintained by peer_review.completion
+    criteria_count = models.IntegerField(default=0)
 
     @property
     def num_criteria(self):
-        return Criterion.objects.filter(rubric=self).count()
+        return self.criteria_count
 
     class Meta:
         db_table = 'rubrics'
@@ -175,6 +219,10 @@ class PeerReview(models.Model):
                                 related_name='peer_reviews_for_student')
     submission = models.ForeignKey(CanvasSubmission, on_delete=models.DO_NOTHING,
                                    related_name='peer_reviews_for_submission')
+    # maintained by peer_review.completion
+    comment_count = models.IntegerField(default=0)
+    is_complete = models.BooleanField(default=False)
+    completed_at_utc = models.DateTimeField(blank=True, null=True)
 
     @property
     def evaluation_is_mandatory(self):
@@ -234,3 +282,24 @@ class PeerReviewDistribution(models.Model):
 
     class Meta:
         db_table = 'peer_review_distributions'
+
+
+# noinspection PyClassHasNoInit
+class RubricSummary(models.Model):
+    # what the instructor dashboard shows about a rubric; maintained by peer_review.summaries
+
+    rubric = models.OneToOneField(Rubric, on_delete=models.DO_NOTHING, primary_key=True, related_name='summary')
+    course_id = models.IntegerField()
+    prompt_id = models.IntegerField()
+    peer_review_assignment = models.ForeignKey(CanvasAssignment, on_delete=models.DO_NOTHING,
+                                               related_name='rubric_summaries')
+    open_date = models.DateTimeField(blank=True, null=True)
+    number_of_assigned_reviews = models.IntegerField(default=0)
+    number_of_completed_reviews = models.IntegerField(default=0)
+    evaluation_due_date = models.DateTimeField(blank=True, null=True)
+    evaluation_mandatory = models.BooleanField(default=False)
+    reviews_in_progress = models.BooleanField(default=False)
+    refreshed_at_utc = models.DateTimeField()
+
+    class Meta:
+        db_table = 'rubric_summaries'
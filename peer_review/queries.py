@@ -3,6 +3,7 @@ import logging
 import pytz
 from datetime import datetime
 from itertools import chain
+from collections import defaultdict
 
 from django.db.models.query import QuerySet
 from django.http import Http404
@@ -10,11 +11,10 @@ from toolz.dicttoolz import valfilter
 from toolz.functoolz import thread_last
 from toolz.itertoolz import groupby, unique
 
-from django.db import connection
-from django.db.models import BooleanField, Subquery, OuterRef, Count, Case, When, Value, F, Q
+from django.db.models import BooleanField, Case, When, Value, Q, Exists, OuterRef
 
-from peer_review.util import some, fetchall_dicts
-from peer_review.models import PeerReview, Criterion, PeerReviewComment, Rubric, \
+from peer_review.util import some
+from peer_review.models import PeerReview, PeerReviewComment, Rubric, \
     PeerReviewDistribution, CanvasCourse, CanvasStudent, CanvasAssignment, CanvasSubmission, \
     PeerReviewEvaluation
 
@@ -23,78 +23,22 @@ logger = logging.getLogger(__name__)
 # TODO move to settings
 API_DATE_FORMAT = '%Y-%m-%d %H:%M:%SZ'
 
+# comments are exported this many at a time, so a whole term's worth is never held in memory at once
+CSV_CHUNK_SIZE = 2000
+
 
 class InstructorDashboardStatus:
-    query = """
-    SELECT
-      total_reviews.rubric_id,
-      total_reviews.prompt_id,
-      peer_review_assignments.id           AS peer_review_assignment_id,
-      peer_review_assignments.title        AS peer_review_title,
-      CASE WHEN peer_review_distributions.distributed_at_utc IS NOT NULL
-        THEN peer_review_distributions.distributed_at_utc
-      ELSE open_date
-      END                                  AS open_date,
-      peer_review_assignments.due_date_utc AS due_date,
-      number_of_completed_reviews,
-      number_of_assigned_reviews,
-      evaluation_due_date,
-      evaluation_mandatory,
-      CASE WHEN peer_review_distributions.is_distribution_complete IS TRUE
-        THEN TRUE
-      ELSE FALSE
-      END                                  AS reviews_in_progress
-    FROM
-      canvas_assignments peer_review_assignments
-      LEFT JOIN
-      (SELECT
-         rubrics.id                      AS rubric_id,
-         rubrics.peer_review_open_date   AS open_date,
-         peer_review_evaluation_due_date AS evaluation_due_date,
-         peer_review_evaluation_is_mandatory AS evaluation_mandatory,
-         rubrics.reviewed_assignment_id  AS prompt_id,
-         rubrics.passback_assignment_id  AS peer_review_assignment_id,
-         count(DISTINCT peer_reviews.id) AS number_of_assigned_reviews
-       FROM rubrics
-         LEFT JOIN canvas_assignments ON rubrics.reviewed_assignment_id = canvas_assignments.id
-         LEFT JOIN canvas_submissions ON canvas_assignments.id = canvas_submissions.assignment_id
-         LEFT JOIN peer_reviews ON canvas_submissions.id = peer_reviews.submission_id
-       WHERE course_id = %s
-       GROUP BY rubric_id) AS total_reviews ON peer_review_assignments.id = total_reviews.peer_review_assignment_id
-      LEFT JOIN (SELECT
-                   criteria_by_rubric.rubric_id,
-                   cast(sum(number_of_criteria = number_of_comments AND
-                            number_of_comments IS NOT NULL)
-                        AS SIGNED) AS number_of_completed_reviews
-                 FROM
-                   (SELECT
-                      rubrics.id                  AS rubric_id,
-                      rubrics.passback_assignment_id,
-                      count(DISTINCT criteria.id) AS number_of_criteria
-                    FROM rubrics
-                      LEFT JOIN criteria ON rubrics.id = criteria.rubric_id
-                    GROUP BY rubrics.id) AS criteria_by_rubric
-                   LEFT JOIN (SELECT
-                                rubric_id,
-                                peer_review_id,
-                                count(DISTINCT peer_review_comments.id) AS number_of_comments
-                              FROM rubrics
-                                LEFT JOIN criteria ON rubrics.id = criteria.rubric_id
-                                LEFT JOIN canvas_assignments ON rubrics.reviewed_assignment_id = canvas_assignments.id
-                                LEFT JOIN canvas_submissions ON canvas_assignments.id = canvas_submissions.assignment_id
-                                LEFT JOIN peer_reviews ON canvas_submissions.id = peer_reviews.submission_id
-                                LEFT JOIN peer_review_comments
-                                  ON peer_reviews.id = peer_review_comments.peer_review_id AND
-                                     criteria.id = peer_review_comments.criterion_id
-                              WHERE peer_review_comments.id IS NOT NULL
-                              GROUP BY rubric_id, peer_review_id
-                              ORDER BY NULL) AS comments_by_rubric
-                     ON criteria_by_rubric.rubric_id = comments_by_rubric.rubric_id
-                 GROUP BY criteria_by_rubric.rubric_id) AS completed_reviews
-        ON total_reviews.rubric_id = completed_reviews.rubric_id
-      LEFT JOIN peer_review_distributions ON total_reviews.rubric_id = peer_review_distributions.rubric_id
-    WHERE peer_review_assignments.id in %s and peer_review_assignments.is_peer_review_assignment IS TRUE;
-    """
+    # read from the rubric summaries (see peer_review.summaries) rather than counted from every review in the course
+    summary_columns = {
+        'rubric_id':                   'rubric_summaries__rubric_id',
+        'prompt_id':                   'rubric_summaries__prompt_id',
+        'open_date':                   'rubric_summaries__open_date',
+        'number_of_completed_reviews': 'rubric_summaries__number_of_completed_reviews',
+        'number_of_assigned_reviews':  'rubric_summaries__number_of_assigned_reviews',
+        'evaluation_due_date':         'rubric_summaries__evaluation_due_date',
+        'evaluation_mandatory':        'rubric_summaries__evaluation_mandatory',
+        'reviews_in_progress':         'rubric_summaries__reviews_in_progress'
+    }
 
     @staticmethod
     def _format_details(data):
@@ -111,25 +55,47 @@ class InstructorDashboardStatus:
 
     @classmethod
     def get(cls, course_id, assignment_ids):
-        with connection.cursor() as cursor:
-            cursor.execute(cls.query, [course_id, assignment_ids])
-            data = fetchall_dicts(cursor)
+        rows = CanvasAssignment.objects \
+            .filter(id__in=assignment_ids, is_peer_review_assignment=True) \
+            .values('id', 'title', 'due_date_utc', 'rubric_summaries__course_id', *cls.summary_columns.values())
+
+        data = []
+        for row in rows:
+            # a rubric for a prompt in another course is not shown
+            in_course = str(row['rubric_summaries__course_id']) == str(course_id)
+            details = {column: row[field] if in_course else None for column, field in cls.summary_columns.items()}
+            details.update({
+                'peer_review_assignment_id': row['id'],
+                'peer_review_title':         row['title'],
+                'due_date':                  row['due_date_utc']
+            })
+            data.append(details)
         return cls._format_details(data)
 
 
 class StudentDashboardStatus:
+    # everything the dashboard shows about a review and its prompt, joined in one query
+    review_fields = {
+        'review_id':          'id',
+        'review_is_complete': 'is_complete',
+        'prompt_id':          'submission__assignment_id',
+        'prompt_name':        'submission__assignment__title',
+        'rubric_id':          'submission__assignment__rubric_for_prompt__id',
+        'due_date_utc':       'submission__assignment__rubric_for_prompt__passback_assignment__due_date_utc'
+    }
+
     @staticmethod
-    def _make_review(peer_review):
+    def _make_review(row):
         return {
-            'review_id': peer_review.id,
-            'review_is_complete': peer_review.review_is_complete
+            'review_id': row['review_id'],
+            'review_is_complete': row['review_is_complete']
         }
 
     @staticmethod
     def _make_data(entry):
-        prompt_id, peer_reviews = entry
-        prompt_name = peer_reviews[0].submission.assignment.title
-        due_date_utc: datetime = peer_reviews[0].submission.assignment.rubric_for_prompt.passback_assignment.due_date_utc
+        prompt_id, rows = entry
+        prompt_name = rows[0]['prompt_name']
+        due_date_utc: datetime = rows[0]['due_date_utc']
         due_date_has_passed: bool = None
 
         try:
@@ -146,24 +112,23 @@ class StudentDashboardStatus:
 
     @staticmethod
     def _make_assigned_prompt(entry):
-        _, peer_reviews = entry
+        _, rows = entry
         prompt_data = StudentDashboardStatus._make_data(entry)
-        prompt_data['reviews'] = sorted(map(StudentDashboardStatus._make_review, peer_reviews),
+        prompt_data['reviews'] = sorted(map(StudentDashboardStatus._make_review, rows),
                                         key=lambda r: r['review_id'])
         return prompt_data
 
     @staticmethod
     def _make_completed_prompt(entry):
 
-        def complete_review_pred(pr):
-            return pr.review_is_complete
+        def complete_review_pred(row):
+            return row['review_is_complete']
 
-        _, peer_reviews = entry
+        _, rows = entry
         prompt_data = StudentDashboardStatus._make_data(entry)
-        prompt_data['prompt_id'] = peer_reviews[0].submission.assignment.id
-        prompt_data['rubric_id'] = peer_reviews[0].submission.assignment.rubric_for_prompt.id
+        prompt_data['rubric_id'] = rows[0]['rubric_id']
 
-        reviews_by_reviewer = groupby(lambda pr: pr.student_is_reviewer, peer_reviews)
+        reviews_by_reviewer = groupby(lambda row: row['student_is_reviewer'], rows)
         reviews_given = reviews_by_reviewer.get(True) or []
         reviews_received = reviews_by_reviewer.get(False) or []
 
@@ -202,49 +167,27 @@ class StudentDashboardStatus:
         return sorted_data_with_due_dates + data_without_due_dates
 
     @staticmethod
-    def _review_completion_status(qs):
-        return qs.annotate(
-                number_of_criteria=Subquery(
-                    Criterion.objects.filter(rubric_id=OuterRef('submission__assignment__rubric_for_prompt__id'))
-                        .values('rubric')
-                        .annotate(count=Count('id'))
-                        .values('count')
-                )
-            ) \
-            .annotate(
-                number_of_comments=Subquery(
-                    PeerReviewComment.objects.filter(peer_review__id=OuterRef('id'))
-                        .values('peer_review')
-                        .annotate(count=Count('id'))
-                        .values('count')
-                )
-            ) \
-            .annotate(
-                review_is_complete=Case(
-                    When(number_of_comments=F('number_of_criteria'), then=Value(True)),
-                    default=Value(False),
-                    output_field=BooleanField()
-                )
-            )
+    def _rows(qs, *extra_fields):
+        fields = StudentDashboardStatus.review_fields
+        for row in qs.order_by('submission__assignment_id', 'id').values(*fields.values(), *extra_fields):
+            yield dict({column: row[field] for column, field in fields.items()},
+                       **{field: row[field] for field in extra_fields})
 
     @staticmethod
-    def _unflatten(qs, filter_predicate, transform):
-        return thread_last(qs,
-                           (groupby, lambda pr: pr.submission.assignment_id),
-                           (valfilter, lambda prs: some(filter_predicate, prs)),
+    def _unflatten(rows, filter_predicate, transform):
+        return thread_last(rows,
+                           (groupby, lambda row: row['prompt_id']),
+                           (valfilter, lambda prompt_rows: some(filter_predicate, prompt_rows)),
                            (lambda d: d.items(),),
                            (map, transform),
                            (StudentDashboardStatus._sort_and_format,))
 
     @staticmethod
     def assigned_work(course_id, student_id):
-        qs = PeerReview.objects.filter(student_id=student_id, submission__assignment__course__id=course_id) \
-            .select_related('submission__assignment__rubric_for_prompt')
-        qs = StudentDashboardStatus._review_completion_status(qs) \
-            .order_by('submission__assignment_id', 'id')
+        qs = PeerReview.objects.filter(student_id=student_id, submission__assignment__course__id=course_id)
 
         return StudentDashboardStatus._unflatten(
-            qs,
+            StudentDashboardStatus._rows(qs),
             lambda _: True,
             StudentDashboardStatus._make_assigned_prompt
         )
@@ -262,11 +205,10 @@ class StudentDashboardStatus:
                     output_field=BooleanField()
                 )
             )
-        qs = StudentDashboardStatus._review_completion_status(qs)
 
         return StudentDashboardStatus._unflatten(
-            qs,
-            lambda pr: pr.review_is_complete,
+            StudentDashboardStatus._rows(qs, 'student_is_reviewer'),
+            lambda row: row['review_is_complete'],
             StudentDashboardStatus._make_completed_prompt
         )
 
@@ -377,60 +319,65 @@ class ReviewStatus:
 
         return data
 
-    # TODO refactor to push load onto the DB
     # this method was pulled out of peer_review.views.core.OverviewForAStudent
     @staticmethod
     def all_rubric_statuses_for_student(course_id, student):
-        rubrics = Rubric.objects.filter(reviewed_assignment__course_id=course_id)
+        rubrics = Rubric.objects \
+            .filter(reviewed_assignment__course_id=course_id) \
+            .select_related('reviewed_assignment', 'passback_assignment', 'peer_review_distribution') \
+            .order_by('id')
+        rubrics = list(rubrics)
+
+        submitted_prompt_ids = set(CanvasSubmission.objects
+                                   .filter(author_id=student.id,
+                                           assignment_id__in=[r.reviewed_assignment_id for r in rubrics])
+                                   .values_list('assignment_id', flat=True))
+
+        # one row per review the student gave or received for any of the rubrics
+        peer_reviews = PeerReview.objects \
+            .filter(Q(student_id=student.id) | Q(submission__author_id=student.id),
+                    submission__assignment_id__in=submitted_prompt_ids) \
+            .values('student_id', 'submission__author_id', 'submission__assignment_id', 'is_complete',
+                    'completed_at_utc')
+        peer_reviews = groupby(lambda pr: pr['submission__assignment_id'], peer_reviews)
 
         reviews = []
         for rubric in rubrics:
             prompt = rubric.reviewed_assignment
             peer_review_assignment = rubric.passback_assignment
-            number_of_criteria = rubric.num_criteria
-
-            try:
-                submission = prompt.canvas_submission_set.get(author__id=student.id)
-            except CanvasSubmission.DoesNotExist:
-                submission = None
-
-            if submission:
-                to_be_completed = submission.total_completed_by_a_student
-                completed = submission.num_comments_each_review_per_student \
-                    .filter(completed__gte=number_of_criteria)
-                if peer_review_assignment.due_date_utc:
-                    reviews_completed_late = completed \
-                        .filter(comments__commented_at_utc__gte=peer_review_assignment.due_date_utc)
-                    num_reviews_completed_late = reviews_completed_late.count()
-                else:
-                    num_reviews_completed_late = 0
-
-                to_be_received = submission.total_received_of_a_student
-                received = submission.num_comments_each_review_per_submission \
-                    .filter(received__gte=number_of_criteria)
-                if peer_review_assignment.due_date_utc:
-                    reviews_received_late = received \
-                        .filter(comments__commented_at_utc__gte=peer_review_assignment.due_date_utc)
-                    num_reviews_received_late = reviews_received_late.count()
-                else:
-                    num_reviews_received_late = 0
+            due_date_utc = peer_review_assignment.due_date_utc
 
+            if prompt.id in submitted_prompt_ids:
                 review_info = {
                     'submission_present': True,
-                    'total_to_complete': to_be_completed.count(),
-                    'completed': completed.count(),
-                    'completed_late': num_reviews_completed_late,
-                    'total_to_receive': to_be_received.count(),
-                    'received': received.count(),
-                    'received_late': num_reviews_received_late
+                    'total_to_complete': 0,
+                    'completed': 0,
+                    'completed_late': 0,
+                    'total_to_receive': 0,
+                    'received': 0,
+                    'received_late': 0
                 }
+                for peer_review in peer_reviews.get(prompt.id, []):
+                    is_complete = peer_review['is_complete']
+                    # a review is late if any of its comments was made on or after the due date
+                    is_late = is_complete and due_date_utc is not None and \
+                        peer_review['completed_at_utc'] is not None and \
+                        peer_review['completed_at_utc'] >= due_date_utc
+                    if peer_review['student_id'] == student.id:
+                        review_info['total_to_complete'] += 1
+                        review_info['completed'] += is_complete
+                        review_info['completed_late'] += is_late
+                    if peer_review['submission__author_id'] == student.id:
+                        review_info['total_to_receive'] += 1
+                        review_info['received'] += is_complete
+                        review_info['received_late'] += is_late
             else:
                 review_info = {
                     'submission_present': False
                 }
 
-            if peer_review_assignment.due_date_utc:
-                due_date = peer_review_assignment.due_date_utc.strftime(API_DATE_FORMAT)
+            if due_date_utc:
+                due_date = due_date_utc.strftime(API_DATE_FORMAT)
             else:
                 due_date = None
 
@@ -457,90 +404,96 @@ class ReviewStatus:
 
         return reviews
 
-    # TODO refactor to push load onto the DB
     # this method was pulled out of peer_review.views.core.AssignmentStatus
     @staticmethod
     def status_for_rubric(course_id, rubric_id, for_api=True):
-        rubric = Rubric.objects.get(id=rubric_id)
-        submissions = rubric.reviewed_assignment.canvas_submission_set.all()
-
-        reviewerIds = (PeerReview.objects
-                       .filter(submission_id__in=submissions.values_list('id', flat=True))
-                       .distinct().values_list('student_id', flat=True))
+        rubric = Rubric.objects.select_related('reviewed_assignment', 'passback_assignment').get(id=rubric_id)
+        prompt = rubric.reviewed_assignment
+        rubric_sections_ids = set(rubric.sections.values_list('id', flat=True))
+        submissions = list(prompt.canvas_submission_set.select_related('author').order_by('id'))
+
+        # one row per review of the prompt, with everything the totals below are counted from
+        peer_reviews = PeerReview.objects \
+            .filter(submission__assignment=prompt) \
+            .values('student_id', 'submission_id', 'submission__author_id', 'comment_count', 'is_complete',
+                    'evaluation__id')
+
+        total_completed_by_student = defaultdict(int)
+        completed_by_student = defaultdict(int)
+        commented_by_student = defaultdict(int)
+        total_received_by_submission = defaultdict(int)
+        received_by_submission = defaultdict(int)
+        evaluations_by_author = defaultdict(int)
+        for peer_review in peer_reviews:
+            total_completed_by_student[peer_review['student_id']] += 1
+            total_received_by_submission[peer_review['submission_id']] += 1
+            if peer_review['is_complete']:
+                completed_by_student[peer_review['student_id']] += 1
+                received_by_submission[peer_review['submission_id']] += 1
+            if peer_review['comment_count'] > 0:
+                commented_by_student[peer_review['student_id']] += 1
+            if peer_review['evaluation__id'] is not None:
+                evaluations_by_author[peer_review['submission__author_id']] += 1
+
+        author_ids = [submission.author_id for submission in submissions]
+        reviewer_ids = set(total_completed_by_student).difference(author_ids)
+        reviewers = CanvasStudent.objects.filter(id__in=reviewer_ids).order_by('id')
+
+        sections_by_student = defaultdict(list)
+        student_sections = CanvasStudent.sections.through.objects \
+            .filter(canvasstudent_id__in=list(chain(author_ids, reviewer_ids)), canvassection__course_id=course_id) \
+            .select_related('canvassection') \
+            .order_by('canvassection_id')
+        for student_section in student_sections:
+            sections_by_student[student_section.canvasstudent_id].append(student_section.canvassection)
 
         reviewsByAuthor = {}
         sections = set()
         for submission in submissions:
-            total_completed_num = submission.total_completed_by_a_student.count()
-            completed_reviews_num = submission.num_comments_each_review_per_student       \
-                                              .filter(completed__gte=rubric.num_criteria) \
-                                              .count()
-
-            total_received_num = submission.total_received_of_a_student.count()
-            received_reviews_num = submission.num_comments_each_review_per_submission   \
-                                             .filter(received__gte=rubric.num_criteria) \
-                                             .count()
-
-            reviews_with_evaluations = PeerReview.objects.filter(
-                submission__assignment=rubric.reviewed_assignment,
-                submission__author_id=submission.author, evaluation__isnull=False
-            )
-
-            if rubric.sections.all():
-                rubric_sections_ids = rubric.sections.values_list('id', flat=True)
-                author_sections = submission.author.sections.filter(
-                    id__in=rubric_sections_ids,
-                    course_id=course_id
-                )
-            else:
-                author_sections = submission.author.sections.filter(course_id=course_id)
-
-            for section in author_sections:
-                sections.add(section)
+            author_sections = [section for section in sections_by_student[submission.author_id]
+                               if not rubric_sections_ids or section.id in rubric_sections_ids]
+            sections.update(author_sections)
 
             if for_api:
                 author = {
                     'id': submission.author.id,
                     'name': submission.author.sortable_name
                 }
-                author_sections = [{'id': s.id, 'name': s.name} for s in author_sections]
+                review_sections = [{'id': s.id, 'name': s.name} for s in author_sections]
             else:
                 author = submission.author
+                review_sections = author_sections
 
+            received_reviews_num = received_by_submission[submission.id]
             review = {
                 'author':          author,
-                'total_completed': total_completed_num,
-                'completed':       completed_reviews_num,
-                'total_received':  total_received_num,
+                'total_completed': total_completed_by_student[submission.author_id],
+                'completed':       completed_by_student[submission.author_id],
+                'total_received':  total_received_by_submission[submission.id],
                 'received':        received_reviews_num,
-                'sections':        author_sections,
-                'evaluations_given': reviews_with_evaluations.count(),
+                'sections':        review_sections,
+                'evaluations_given': evaluations_by_author[submission.author_id],
                 'total_evaluations': received_reviews_num, # because they can't eval more than received
             }
             if not for_api:
-                review['json_sections'] = json.dumps(list(author_sections.values_list('id', flat=True)))
+                review['json_sections'] = json.dumps([s.id for s in author_sections])
 
             reviewsByAuthor[submission.author.id] = review
 
-        for reviewer in CanvasStudent.objects.filter(id__in=set(reviewerIds).difference(reviewsByAuthor.keys())):
+        # reviewers without a submission of their own only count reviews of prompts in this course
+        prompt_is_in_course = str(prompt.course_id) == str(course_id)
+        for reviewer in reviewers:
             reviewerSections = [
                 {'id': section.id, 'name': section.name}
-                for section in reviewer.sections.filter(course_id=course_id)]
-            assignedReviews = [
-                ReviewStatus._make_peer_review_details(peerReview, False)
-                for peerReview in ReviewStatus.getAssignedReviewsForStudentCourseIdAssignment(
-                    reviewer, course_id, rubric.reviewed_assignment)]
-            completedReviews = [
-                peerReview for peerReview in assignedReviews if peerReview['completed_at'] is not None
-            ]
+                for section in sections_by_student[reviewer.id]]
             reviewsByAuthor[reviewer.id] = {
                 'author': {
                     'id': reviewer.id,
                     'name': reviewer.sortable_name
                 },
                 'sections': reviewerSections,
-                'total_completed': len(assignedReviews),
-                'completed': len(completedReviews),
+                'total_completed': total_completed_by_student[reviewer.id] if prompt_is_in_course else 0,
+                'completed': commented_by_student[reviewer.id] if prompt_is_in_course else 0,
                 'total_received': None,
                 'received': None,
                 'evaluations_given': None,
@@ -641,12 +594,33 @@ class RubricForm:
 
 
 class Comments:
+    csv_header = ['Prompt', 'Reviewer', 'Author', 'Criterion ID', 'Comment']
+    csv_fields = ['peer_review__submission__assignment__title', 'peer_review__student__sortable_name',
+                  'peer_review__submission__author__sortable_name', 'criterion_id', 'comment']
+
     @staticmethod
-    def all_comments_for_student(**kwargs):
-        student_id = kwargs['student_id']
-        rubric_id = kwargs.get('rubric_id')
+    def csv_rows(comments, chunk_size=CSV_CHUNK_SIZE):
+        """
+        Read comments as CSV rows (see `csv_header`) in ID order, `chunk_size` at a time.  Every chunk after the first
+        starts from the last ID of the one before, so no chunk is slower to read than the first and at most one chunk
+        is held in memory.
+        """
+        last_id = 0
+        while True:
+            chunk = list(comments
+                         .filter(id__gt=last_id)
+                         .order_by('id')
+                         .values_list('id', *Comments.csv_fields)[:chunk_size])
+            for row in chunk:
+                yield row[1:]
+            if len(chunk) < chunk_size:
+                return
+            last_id = chunk[-1][0]
 
-        student = CanvasStudent.objects.get(id=student_id)
+    @staticmethod
+    def csv_rows_for_student(student_id, rubric_id=None):
+        """ Rows of the comments a student gave, then of those they received, for one rubric or all of them. """
+        CanvasStudent.objects.get(id=student_id)
 
         comments_given_args = {'peer_review__student_id': student_id}
         comments_received_args = {'peer_review__submission__author_id': student_id}
@@ -658,7 +632,17 @@ class Comments:
         comments_given = PeerReviewComment.objects.filter(**comments_given_args)
         comments_received = PeerReviewComment.objects.filter(**comments_received_args)
 
-        return chain(comments_given, comments_received)
+        return chain(Comments.csv_rows(comments_given), Comments.csv_rows(comments_received))
+
+    @staticmethod
+    def csv_rows_for_course(course_id, rubric_id=None):
+        """ Rows of every comment made in a course, for one of its rubrics or all of them. """
+        comments = PeerReviewComment.objects.filter(peer_review__submission__assignment__course_id=course_id)
+        if rubric_id:
+            rubric = Rubric.objects.get(id=rubric_id, reviewed_assignment__course_id=course_id)
+            comments = comments.filter(peer_review__submission__assignment_id=rubric.reviewed_assignment_id)
+
+        return Comments.csv_rows(comments)
 
 
 class Students:
@@ -677,48 +661,44 @@ class Students:
 
 
 class Evaluations:
+    # the evaluation state of every review and what is shown about its rubric, in one query
+    review_fields = {
+        'peer_review_id':          'id',
+        'rubric_id':               'submission__assignment__rubric_for_prompt__id',
+        'peer_review_title':       'submission__assignment__rubric_for_prompt__passback_assignment__title',
+        'due_date_utc':            'submission__assignment__rubric_for_prompt__peer_review_evaluation_due_date',
+        'evaluation_is_mandatory': 'submission__assignment__rubric_for_prompt__peer_review_evaluation_is_mandatory',
+        'ready_for_evaluation':    'ready_for_evaluation',
+        'evaluation_is_complete':  'evaluation_is_complete'
+    }
+
     @staticmethod
-    def _collect_evaluation_data(reviews):
+    def _collect_evaluation_data(rows):
 
-        reviews_by_rubric = groupby(lambda r: r.submission.assignment.rubric_for_prompt.id, reviews)
+        reviews_by_rubric = groupby(lambda row: row['rubric_id'], rows)
 
         evaluations = []
         for rubric_id, reviews_for_rubric in reviews_by_rubric.items():
-            peer_review_ids = sorted(r.id for r in reviews_for_rubric)
+            peer_review_ids = sorted(row['peer_review_id'] for row in reviews_for_rubric)
             student_numbers = {pr_id: i for i, pr_id in enumerate(peer_review_ids, start=1)}
 
-            prompt = reviews_for_rubric[0].submission.assignment
-            rubric = prompt.rubric_for_prompt
-            peer_review_title = rubric.passback_assignment.title
-
-            due_date_utc = reviews_for_rubric[0].evaluation_due_date
+            due_date_utc = reviews_for_rubric[0]['due_date_utc']
             if due_date_utc:
                 due_date_utc_str = due_date_utc.strftime(API_DATE_FORMAT)
             else:
                 due_date_utc_str = None
 
             evaluations_for_rubric = []
-            for review in reviews_for_rubric:
-
-                student_id = student_numbers[review.id]
-                ready_for_evaluation = review.comments.exists()
-
-                evaluation_is_complete = False
-                try:
-                    if review.evaluation:
-                        evaluation_is_complete = True
-                except PeerReviewEvaluation.DoesNotExist:
-                    pass
-
+            for row in reviews_for_rubric:
                 evaluations_for_rubric.append({
                     'rubric_id': rubric_id,
-                    'peer_review_title': peer_review_title,
+                    'peer_review_title': row['peer_review_title'],
                     'due_date_utc': due_date_utc_str,
-                    'peer_review_id': review.id,
-                    'student_id': student_id,
-                    'ready_for_evaluation': ready_for_evaluation,
-                    'evaluation_is_complete': evaluation_is_complete,
-                    'evaluation_is_mandatory': review.evaluation_is_mandatory
+                    'peer_review_id': row['peer_review_id'],
+                    'student_id': student_numbers[row['peer_review_id']],
+                    'ready_for_evaluation': bool(row['ready_for_evaluation']),
+                    'evaluation_is_complete': bool(row['evaluation_is_complete']),
+                    'evaluation_is_mandatory': row['evaluation_is_mandatory']
                 })
 
             if some(lambda e: not e['evaluation_is_complete'], evaluations_for_rubric):
@@ -733,9 +713,15 @@ class Evaluations:
             submission__assignment__rubric_for_prompt__id__isnull=False,
             submission__author_id=student_id,
         )\
-            .order_by('id')
+            .annotate(
+                ready_for_evaluation=Exists(PeerReviewComment.objects.filter(peer_review=OuterRef('pk'))),
+                evaluation_is_complete=Exists(PeerReviewEvaluation.objects.filter(peer_review=OuterRef('pk')))
+            )\
+            .order_by('id')\
+            .values(*Evaluations.review_fields.values())
 
-        return Evaluations._collect_evaluation_data(reviews)
+        rows = [{column: row[field] for column, field in Evaluations.review_fields.items()} for row in reviews]
+        return Evaluations._collect_evaluation_data(rows)
 
     @staticmethod
     def evaluation_for_review(course_id, review_id):
@@ -762,24 +748,31 @@ class Evaluations:
 
 class Reviews:
 
+    @staticmethod
+    def _with_comments(reviews):
+        # everything _collect_received_reviews_data reads, in a fixed number of queries
+        return reviews \
+            .select_related('submission__assignment__rubric_for_prompt', 'evaluation') \
+            .prefetch_related('comments__criterion')
+
     @staticmethod
     def _collect_received_reviews_data(reviews):
 
         comments_by_id = {}
 
-        reviews_by_rubric = groupby(lambda r: r.submission.assignment.rubric_for_prompt.id, reviews)
+        reviews_by_rubric = groupby(lambda r: r.submission.assignment.rubric_for_prompt.id,
+                                    Reviews._with_comments(reviews))
 
         for rubric_id, reviews_for_rubric in reviews_by_rubric.items():
             prompt_title = reviews_for_rubric[0].submission.assignment.title
             peer_review_ids = [r.id for r in reviews_for_rubric]
             student_numbers = {pr_id: i for i, pr_id in enumerate(peer_review_ids, start=1)}
 
-            review_comments = list(chain(*map(lambda r: r.comments.all(), reviews)))
-            criterion_ids = set(c.criterion_id for c in review_comments)
+            review_comments = [(r, c) for r in reviews_for_rubric for c in r.comments.all()]
+            criterion_ids = sorted(set(c.criterion_id for _, c in review_comments))
             criterion_numbers = {cr_id: i for i, cr_id in enumerate(criterion_ids, start=1)}
 
-            for comment in review_comments:
-                peer_review = comment.peer_review
+            for peer_review, comment in review_comments:
                 try:
                     peer_review.evaluation
                     evaluation_submitted = True
@@ -805,7 +798,7 @@ class Reviews:
 
     @staticmethod
     def single_review(peer_review):
-        return Reviews._collect_received_reviews_data([peer_review])
+        return Reviews._collect_received_reviews_data(PeerReview.objects.filter(id=peer_review.id))
 
     @staticmethod
     def reviews_received(course_id, student_id, rubric_id=None):
@@ -0,0 +1,147 @@
+import os
+import uuid
+import hashlib
+import logging
+from datetime import datetime, timezone
+from collections import namedtuple
+
+from django.db import transaction
+from django.conf import settings
+
+from peer_review.util import bulk_update
+from peer_review.models import SubmissionFile
+
+log = logging.getLogger(__name__)
+
+# content-addressed files live under the submissions directory so that they are included in backups
+BLOB_DIRECTORY = 'blobs'
+HASH_CHUNK_SIZE = 64 * 1024
+
+StoredContent = namedtuple('StoredContent', ['path', 'sha256'])
+
+
+def _submissions_path(*parts):
+    return os.path.join(settings.MEDIA_ROOT, 'submissions', *parts)
+
+
+def _blob_path(sha256):
+    return _submissions_path(BLOB_DIRECTORY, sha256[:2], sha256)
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def fingerprint(attachments):
+    """
+    Identify the versions of a submission's Canvas attachments by their IDs, last update times and sizes.
+
+    :return: String fingerprint, or None if Canvas did not describe the attachments well enough to tell versions apart
+    """
+    parts = []
+    for attachment in attachments:
+        if attachment.get('updated_at') is None or attachment.get('size') is None:
+            return None
+        parts.append('%d:%s:%d' % (attachment['id'], attachment['updated_at'], attachment['size']))
+    return hashlib.sha256('|'.join(parts).encode('utf8')).hexdigest()
+
+
+def current_filenames(fingerprints_by_filename):
+    """
+    Find which of the given submission files were already stored from the same attachment versions, and whose
+    content is still present and intact.
+
+    :param fingerprints_by_filename: Dictionary of submission filenames to their attachments' fingerprints
+    :return: Set of filenames that do not need to be downloaded again
+    """
+    stored_files = SubmissionFile.objects.filter(filename__in=[filename
+                                                               for filename, attachments_fingerprint
+                                                               in fingerprints_by_filename.items()
+                                                               if attachments_fingerprint is not None])
+    current = set()
+    for stored_file in stored_files:
+        if stored_file.fingerprint != fingerprints_by_filename[stored_file.filename]:
+            continue
+        try:
+            if os.path.getsize(_blob_path(stored_file.sha256)) == stored_file.size:
+                current.add(stored_file.filename)
+        except OSError:
+            pass
+    return current
+
+
+def store(write):
+    """
+    Store a file's content.  `write` is called with a temporary file to write the content to; it may return a tuple
+    of the content's SHA-256 hex digest and size, otherwise the temporary file is hashed afterward.  Content that is
+    already in the store is not stored twice.  If `write` raises, nothing is stored.
+
+    The content is not found by filename until it is passed to `index`.
+
+    :return: Tuple of the content's SHA-256 hex digest and its size in bytes
+    """
+    os.makedirs(_submissions_path(BLOB_DIRECTORY), exist_ok=True)
+    temp_path = _submissions_path(BLOB_DIRECTORY, '.%s.part' % uuid.uuid4().hex)
+    try:
+        with open(temp_path, 'xb') as temp_file:
+            result = write(temp_file)
+        digest, size = result if result else _hash_file(temp_path)
+
+        blob_path = _blob_path(digest)
+        if os.path.exists(blob_path):
+            log.debug('Content (SHA-256 %s) is already stored' % digest)
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(temp_path, blob_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return digest, size
+
+
+def index(entries):
+    """
+    Record where the content of submission files is stored.
+
+    :param entries: Iterable of tuples of filename, attachments' fingerprint (or None), SHA-256 hex digest and size
+    """
+    stored_files = {filename: SubmissionFile(filename=filename, fingerprint=attachments_fingerprint or '',
+                                             sha256=digest, size=size)
+                    for filename, attachments_fingerprint, digest, size in entries}
+    if not stored_files:
+        return
+    now = datetime.now(timezone.utc)
+    with transaction.atomic():
+        existing = SubmissionFile.objects.in_bulk(list(stored_files))
+        for stored_file in stored_files.values():
+            stored_file.stored_at_utc = now
+        SubmissionFile.objects.bulk_create([f for f in stored_files.values() if f.filename not in existing])
+        bulk_update(SubmissionFile, [f for f in stored_files.values() if f.filename in existing],
+                    ['fingerprint', 'sha256', 'size', 'stored_at_utc'])
+
+
+def content_for(filename):
+    """
+    Resolve a submission filename to where its content is stored.  Files downloaded before the content-addressed
+    store existed are still found at their original location.
+
+    :return: StoredContent of the path and, if the content is in the content-addressed store, its SHA-256 hex digest
+    """
+    try:
+        sha256 = SubmissionFile.objects.get(filename=filename).sha256
+        return StoredContent(path=_blob_path(sha256), sha256=sha256)
+    except SubmissionFile.DoesNotExist:
+        return StoredContent(path=_submissions_path(filename), sha256=None)
+
+
+def path_for(filename):
+    """ Resolve a submission filename to where its content is stored (see `content_for`). """
+    return content_for(filename).path
@@ -0,0 +1,126 @@
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+
+from django.db import transaction
+from django.db.models import Count, Max, F
+
+from peer_review.util import bulk_update
+from peer_review.models import Rubric, RubricSummary, PeerReview, PeerReviewDistribution
+
+log = logging.getLogger(__name__)
+
+SUMMARY_FIELDS = ['course_id', 'prompt_id', 'peer_review_assignment_id', 'open_date', 'number_of_assigned_reviews',
+                  'number_of_completed_reviews', 'evaluation_due_date', 'evaluation_mandatory', 'reviews_in_progress']
+
+_peer_reviews = 'reviewed_assignment__canvas_submission_set__peer_reviews_for_submission'
+
+
+def _summary(rubric, number_of_completed_reviews):
+    try:
+        distribution = rubric.peer_review_distribution
+    except PeerReviewDistribution.DoesNotExist:
+        distribution = None
+
+    if distribution is not None and distribution.distributed_at_utc is not None:
+        open_date = distribution.distributed_at_utc
+    else:
+        open_date = rubric.peer_review_open_date
+
+    return RubricSummary(rubric_id=rubric.id,
+                         course_id=rubric.reviewed_assignment.course_id,
+                         prompt_id=rubric.reviewed_assignment_id,
+                         peer_review_assignment_id=rubric.passback_assignment_id,
+                         open_date=open_date,
+                         number_of_assigned_reviews=rubric.number_of_assigned_reviews,
+                         number_of_completed_reviews=number_of_completed_reviews,
+                         evaluation_due_date=rubric.peer_review_evaluation_due_date,
+                         evaluation_mandatory=rubric.peer_review_evaluation_is_mandatory,
+                         reviews_in_progress=distribution is not None and distribution.is_distribution_complete)
+
+
+def _completed_reviews_by_prompt(rubrics):
+    """
+    Count each rubric's completed reviews from its criteria and the reviews' comments, not from the completion counters
+    that `peer_review.completion` keeps, so that summaries rebuilt (or checked) from here catch counters that drifted.
+    """
+    # imported here since `peer_review.completion` itself brings summaries up to date
+    from peer_review.completion import review_is_complete
+
+    criteria_counts = {rubric.reviewed_assignment_id: rubric.actual_criteria_count for rubric in rubrics}
+    peer_reviews = PeerReview.objects \
+        .filter(submission__assignment_id__in=list(criteria_counts)) \
+        .values('id', 'submission__assignment_id') \
+        .annotate(comment_count=Count('comments'), last_commented_at_utc=Max('comments__commented_at_utc')) \
+        .order_by()
+    return Counter(pr['submission__assignment_id'] for pr in peer_reviews
+                   if review_is_complete(pr['comment_count'], criteria_counts[pr['submission__assignment_id']],
+                                         pr['last_commented_at_utc']))
+
+
+def live_summaries(rubric_ids=None):
+    """
+    Summarize rubrics from their reviews, comments and distributions as they are now, in two queries.
+
+    :param rubric_ids: Rubrics to summarize (defaults to all of them that have a prompt)
+    :return: Dictionary of unsaved `RubricSummary` objects by rubric ID
+    """
+    rubrics = Rubric.objects \
+        .filter(reviewed_assignment__isnull=False) \
+        .select_related('reviewed_assignment', 'peer_review_distribution') \
+        .annotate(number_of_assigned_reviews=Count(_peer_reviews, distinct=True),
+                  actual_criteria_count=Count('criteria', distinct=True))
+    if rubric_ids is not None:
+        rubrics = rubrics.filter(id__in=rubric_ids)
+    rubrics = list(rubrics)
+    completed = _completed_reviews_by_prompt(rubrics)
+    return {rubric.id: _summary(rubric, completed.get(rubric.reviewed_assignment_id, 0)) for rubric in rubrics}
+
+
+def _is_stale(stored, live):
+    return any(getattr(stored, field) != getattr(live, field) for field in SUMMARY_FIELDS)
+
+
+def rebuild(rubric_ids=None, fix=True):
+    """
+    Compare the stored rubric summaries with what they summarize, and rewrite the ones that are missing or out of
+    date.  Call this in the transaction that changed a rubric, its distribution or which reviews it has.
+
+    :param rubric_ids: Rubrics to rebuild the summaries of (defaults to all of them)
+    :param fix: Whether to rewrite stale summaries, or only report them
+    :return: List of the IDs of the rubrics whose summaries were stale
+    """
+    now = datetime.now(timezone.utc)
+    with transaction.atomic():
+        live = live_summaries(rubric_ids)
+        stored = RubricSummary.objects.in_bulk(rubric_ids)
+
+        missing = [summary for rubric_id, summary in live.items() if rubric_id not in stored]
+        changed = [summary for rubric_id, summary in live.items()
+                   if rubric_id in stored and _is_stale(stored[rubric_id], summary)]
+        orphaned = [rubric_id for rubric_id in stored if rubric_id not in live]
+        stale = sorted([summary.rubric_id for summary in missing + changed] + orphaned)
+
+        if stale:
+            log.info('Summaries for (%d) rubric(s) were stale: %s' % (len(stale), stale))
+        if fix and stale:
+            for summary in missing + changed:
+                summary.refreshed_at_utc = now
+            RubricSummary.objects.bulk_create(missing)
+            bulk_update(RubricSummary, changed, SUMMARY_FIELDS + ['refreshed_at_utc'])
+            RubricSummary.objects.filter(rubric_id__in=orphaned).delete()
+
+    return stale
+
+
+def add_completed_reviews(rubric_id, number_of_reviews):
+    """
+    Count reviews that were just completed (or, with a negative number, are no longer complete) in a rubric's
+    summary, without recounting the rest of its reviews.
+    """
+    updated = RubricSummary.objects \
+        .filter(rubric_id=rubric_id) \
+        .update(number_of_completed_reviews=F('number_of_completed_reviews') + number_of_reviews,
+                refreshed_at_utc=datetime.now(timezone.utc))
+    if not updated:
+        rebuild(rubric_ids=[rubric_id])
@@ -0,0 +1,166 @@
+import time
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection, IntegrityError
+from django.db.models import Q
+from django.conf import settings
+
+import peer_review.etl as etl
+from peer_review.models import CanvasSyncState
+from peer_review.exceptions import APIException
+
+log = logging.getLogger(__name__)
+
+# how long to wait between checks on another request's first sync of a course
+WAIT_INTERVAL = 0.5
+
+
+def _refresh_roster(course_id):
+    etl.persist_sections(course_id)
+    etl.persist_students(course_id)
+
+
+def _refresh_assignments(course_id):
+    etl.persist_course(course_id)
+    etl.persist_sections(course_id)  # names the sections in validations served by `course_assignments`
+    etl.persist_assignments(course_id)
+
+
+_refreshers = {
+    'roster':      _refresh_roster,
+    'assignments': _refresh_assignments
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _background_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.CANVAS_SYNC_WORKERS)
+        return _executor
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _state(course_id, resource):
+    try:
+        return CanvasSyncState.objects.get_or_create(course_id=course_id, resource=resource)[0]
+    except IntegrityError:
+        # another request created it first
+        return CanvasSyncState.objects.get(course_id=course_id, resource=resource)
+
+
+def _claim(state):
+    """
+    Claim the right to refresh a course's resource for `settings.CANVAS_SYNC_LEASE` seconds, across every process.
+
+    :return: Whether the claim was won
+    """
+    now = _now()
+    return CanvasSyncState.objects \
+        .filter(id=state.id) \
+        .filter(Q(refresh_claimed_until_utc__isnull=True) | Q(refresh_claimed_until_utc__lt=now)) \
+        .update(refresh_claimed_until_utc=now + timedelta(seconds=settings.CANVAS_SYNC_LEASE)) == 1
+
+
+def _refresh(state):
+    try:
+        _refreshers[state.resource](state.course_id)
+    except Exception:
+        log.exception('Refreshing %s for course (%d) from Canvas failed' % (state.resource, state.course_id))
+        CanvasSyncState.objects.filter(id=state.id).update(refresh_claimed_until_utc=None)
+        raise
+    CanvasSyncState.objects.filter(id=state.id).update(synced_at_utc=_now(), refresh_claimed_until_utc=None)
+    log.debug('Refreshed %s for course (%d) from Canvas' % (state.resource, state.course_id))
+
+
+def _refresh_in_background(state):
+    try:
+        _refresh(state)
+    except Exception:
+        pass  # already logged; the next request will try again
+    finally:
+        connection.close()
+
+
+def _wait_for_first_sync(state):
+    """
+    Wait up to `settings.CANVAS_SYNC_WAIT` seconds for another request's first sync of a course's resource.
+
+    :return: Whether it finished; if not, it either failed or is still running
+    """
+    deadline = time.monotonic() + settings.CANVAS_SYNC_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        state.refresh_from_db()
+        if state.synced_at_utc is not None:
+            return True
+        if state.refresh_claimed_until_utc is None:
+            return False  # the other request failed
+    return False
+
+
+def ensure_synced(course_id, resource):
+    """
+    Make sure what is stored about a course's `resource` ('roster' or 'assignments') can be served.
+
+    * Never synced: it is synced from Canvas before returning.  If another request is already doing that, this waits
+      for it (for up to `settings.CANVAS_SYNC_WAIT` seconds) rather than asking Canvas for the same data again; if it
+      is still not done by then, an `APIException` asks the client to try again later.
+    * Synced more than `settings.CANVAS_SYNC_TTL` seconds ago: a refresh is started in the background (unless one is
+      already running in any process) and the stored data is served as it is.  With `settings.CANVAS_SYNC_WORKERS` set
+      to 0, the refresh happens before returning instead.
+    * Otherwise nothing needs to be done.
+    """
+    course_id = int(course_id)  # endpoints pass it as it appeared in the URL
+    state = _state(course_id, resource)
+
+    if state.synced_at_utc is None:
+        if not _claim(state):
+            if _wait_for_first_sync(state):
+                return
+            # only take over if the other request gave up its claim; never sync the same data twice at once
+            if not _claim(state):
+                log.warning('%s for course (%d) is still being synced for the first time' % (resource, course_id))
+                raise APIException(data={'error': 'Course data is still being retrieved from Canvas; '
+                                                  'please try again in a moment.'},
+                                   status_code=503)
+        _refresh(state)
+        return
+
+    if state.synced_at_utc >= _now() - timedelta(seconds=settings.CANVAS_SYNC_TTL):
+        return
+
+    if not _claim(state):
+        log.debug('%s for course (%d) is already being refreshed' % (resource, course_id))
+        return
+
+    if settings.CANVAS_SYNC_WORKERS > 0:
+        log.debug('%s for course (%d) is stale; refreshing in the background' % (resource, course_id))
+        _background_executor().submit(_refresh_in_background, state)
+    else:
+        _refresh(state)
+
+
+def course_assignments(course_id):
+    """
+    The course's assignments as last retrieved from Canvas, with their validations (see `etl.persist_assignments`).
+
+    :return: List of assignments
+    """
+    course_id = int(course_id)
+    ensure_synced(course_id, 'assignments')
+    assignments = etl.stored_assignments(course_id)
+    if assignments is None:
+        # only possible for a course synced before every Canvas response was stored; the next refresh stores it
+        log.warning('No stored assignments for course (%d) to serve' % course_id)
+        return []
+    return assignments
@@ -0,0 +1,177 @@
+import os
+import time
+import hashlib
+
+import pytest
+from django.contrib.auth.models import User
+from django.http import Http404
+from django.test import RequestFactory
+from django.utils.http import http_date
+from rolepermissions.roles import assign_role
+
+import peer_review.storage as storage
+from peer_review.api.endpoints import submission_for_review
+from peer_review.models import PeerReview
+from peer_review.tests.queries.fixtures import make_reviewed_class
+
+CONTENT = b'0123456789 an essay about peer review'
+
+
+class Download:
+    def __init__(self, peer_review, content_path, sha256):
+        self.peer_review = peer_review
+        self.content_path = content_path
+        self.sha256 = sha256
+        self.user = User.objects.create_user(username=peer_review.student.username)
+        assign_role(self.user, 'student')
+
+    def get(self, **headers):
+        request = RequestFactory().get('/', **headers)
+        request.user = self.user
+        request.session = {'lti_launch_params': {
+            'custom_canvas_course_id': str(self.peer_review.submission.assignment.course_id),
+            'custom_canvas_user_id': str(self.peer_review.student_id),
+            'context_title': 'Course',
+            'roles': 'Learner'
+        }}
+        response = submission_for_review(request, str(self.peer_review.submission.assignment.course_id),
+                                         str(self.peer_review.id))
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+
+def _write_content(f):
+    f.write(CONTENT)
+
+
+@pytest.fixture(params=['content-addressed', 'legacy'])
+def download(request, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    settings.SUBMISSION_SENDFILE_HEADER = None
+    make_reviewed_class(4)
+    peer_review = PeerReview.objects.select_related('student', 'submission__assignment').order_by('id').first()
+    filename = peer_review.submission.filename
+
+    if request.param == 'content-addressed':
+        digest, size = storage.store(_write_content)
+        storage.index([(filename, None, digest, size)])
+    else:
+        tmpdir.mkdir('submissions').join(filename).write_binary(CONTENT)
+    content = storage.content_for(filename)
+    return Download(peer_review, content.path, content.sha256)
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_whole_submission(download):
+    response, body = download.get()
+
+    assert response.status_code == 200
+    assert body == CONTENT
+    assert response['Content-Length'] == str(len(CONTENT))
+    assert response['Accept-Ranges'] == 'bytes'
+    assert response['Content-Disposition'] == 'attachment; filename="%s"' % download.peer_review.submission.filename
+    assert 'private' in response['Cache-Control']
+    if download.sha256:
+        assert response['ETag'] == '"%s"' % hashlib.sha256(CONTENT).hexdigest()
+
+
+# noinspection PyShadowingNames
+@pytest.mark.parametrize('byte_range, expected', [
+    ('bytes=2-5', CONTENT[2:6]),
+    ('bytes=30-', CONTENT[30:]),
+    ('bytes=30-1000', CONTENT[30:]),
+    ('bytes=-4', CONTENT[-4:]),
+    ('bytes=-1000', CONTENT),
+])
+@pytest.mark.django_db
+def test_byte_range(download, byte_range, expected):
+    response, body = download.get(HTTP_RANGE=byte_range)
+
+    assert response.status_code == 206
+    assert body == expected
+    assert response['Content-Length'] == str(len(expected))
+    first = CONTENT.index(expected) if expected != CONTENT else 0
+    assert response['Content-Range'] == 'bytes %d-%d/%d' % (first, first + len(expected) - 1, len(CONTENT))
+
+
+# noinspection PyShadowingNames
+@pytest.mark.parametrize('byte_range', ['bytes=0-1,4-5', 'bytes=5-2', 'items=0-1', 'bytes=-'])
+@pytest.mark.django_db
+def test_byte_range_not_served_as_such(download, byte_range):
+    response, body = download.get(HTTP_RANGE=byte_range)
+
+    assert response.status_code == 200
+    assert body == CONTENT
+
+
+# noinspection PyShadowingNames
+@pytest.mark.parametrize('byte_range', ['bytes=%d-' % len(CONTENT), 'bytes=-0'])
+@pytest.mark.django_db
+def test_byte_range_outside_of_submission(download, byte_range):
+    response, _ = download.get(HTTP_RANGE=byte_range)
+
+    assert response.status_code == 416
+    assert response['Content-Range'] == 'bytes */%d' % len(CONTENT)
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_conditional_requests(download):
+    response, _ = download.get()
+    etag, last_modified = response['ETag'], response['Last-Modified']
+
+    assert download.get(HTTP_IF_NONE_MATCH=etag)[0].status_code == 304
+    assert download.get(HTTP_IF_MODIFIED_SINCE=last_modified)[0].status_code == 304
+    assert download.get(HTTP_IF_NONE_MATCH='"something else"')[0].status_code == 200
+
+    assert download.get(HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=etag)[0].status_code == 206
+    response, body = download.get(HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"something else"')
+    assert response.status_code == 200
+    assert body == CONTENT
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_conditional_request_after_the_submission_changed(download):
+    response, _ = download.get()
+    modified_at = time.time() + 3600
+    os.utime(download.content_path, (modified_at, modified_at))
+
+    assert download.get(HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])[0].status_code == 200
+    assert download.get(HTTP_IF_MODIFIED_SINCE=http_date(modified_at))[0].status_code == 304
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_x_accel_redirect(download, settings):
+    settings.SUBMISSION_SENDFILE_HEADER = 'X-Accel-Redirect'
+    settings.SUBMISSION_SENDFILE_PREFIX = '/internal/'
+    response, body = download.get(HTTP_RANGE='bytes=2-5')
+
+    assert response.status_code == 200
+    assert body == b''
+    assert response['X-Accel-Redirect'] == \
+        '/internal/' + os.path.relpath(download.content_path, settings.MEDIA_ROOT)
+    assert 'ETag' in response
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_x_sendfile(download, settings):
+    settings.SUBMISSION_SENDFILE_HEADER = 'X-Sendfile'
+    response, body = download.get()
+
+    assert response.status_code == 200
+    assert body == b''
+    assert response['X-Sendfile'] == download.content_path
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_missing_submission(download):
+    os.remove(download.content_path)
+
+    with pytest.raises(Http404):
+        download.get()
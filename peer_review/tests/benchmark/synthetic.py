@@ -0,0 +1,110 @@
+import random
+from datetime import datetime, timedelta, timezone
+from collections import namedtuple
+
+import peer_review.summaries as summaries
+import peer_review.completion as completion
+from peer_review.distribution import make_distribution
+from peer_review.models import CanvasCourse, CanvasSection, CanvasAssignment, CanvasStudent, CanvasSubmission, \
+    Rubric, Criterion, PeerReview, PeerReviewComment, PeerReviewEvaluation, PeerReviewDistribution
+
+Scale = namedtuple('Scale', ['sections', 'students', 'rubrics', 'criteria', 'reviews_per_student',
+                             'commented_reviews', 'evaluated_reviews'])
+
+# fractions of reviews that are commented on / evaluated are given as 0..1
+SCALES = {
+    'small':  Scale(sections=2, students=20, rubrics=2, criteria=3, reviews_per_student=3,
+                    commented_reviews=0.7, evaluated_reviews=0.3),
+    'medium': Scale(sections=4, students=120, rubrics=4, criteria=4, reviews_per_student=3,
+                    commented_reviews=0.7, evaluated_reviews=0.3),
+    'large':  Scale(sections=8, students=400, rubrics=8, criteria=5, reviews_per_student=3,
+                    commented_reviews=0.7, evaluated_reviews=0.3)
+}
+
+SyntheticCourse = namedtuple('SyntheticCourse', ['course', 'sections', 'students', 'rubrics'])
+
+COURSE_ID = 1
+
+
+def _prompt_and_peer_review(course, number, due_date):
+    prompt = CanvasAssignment.objects.create(id=course.id * 1000 + number * 2, course=course,
+                                             title='Prompt %d' % number, due_date_utc=due_date - timedelta(days=7))
+    peer_review_assignment = CanvasAssignment.objects.create(id=course.id * 1000 + number * 2 + 1, course=course,
+                                                             title='Peer Review %d' % number, due_date_utc=due_date,
+                                                             is_peer_review_assignment=True)
+    return prompt, peer_review_assignment
+
+
+def _reviewed_rubric(rng, number, course, students, scale, now):
+    due_date = now + timedelta(days=rng.randint(-14, 14))
+    prompt, peer_review_assignment = _prompt_and_peer_review(course, number, due_date)
+    rubric = Rubric.objects.create(description='Rubric %d' % number, reviewed_assignment=prompt,
+                                   passback_assignment=peer_review_assignment,
+                                   peer_review_open_date=prompt.due_date_utc,
+                                   peer_review_evaluation_is_mandatory=rng.random() < 0.5,
+                                   peer_review_evaluation_due_date=due_date + timedelta(days=7))
+    criteria = [Criterion.objects.create(rubric=rubric, description='Criterion %d.%d' % (number, i))
+                for i in range(scale.criteria)]
+
+    submitters = [student for student in students if rng.random() < 0.95]
+    submissions = [CanvasSubmission(id=prompt.id * 10000 + student.id, author=student, assignment=prompt,
+                                    filename='%d_%d_essay.docx' % (prompt.id, student.id))
+                   for student in submitters]
+    CanvasSubmission.objects.bulk_create(submissions)
+
+    distribution, _ = make_distribution(prompt, submitters, submissions, n=scale.reviews_per_student)
+    PeerReview.objects.bulk_create([PeerReview(student_id=student_id, submission_id=submission_id)
+                                    for student_id, submission_ids in sorted(distribution.items())
+                                    for submission_id in sorted(submission_ids)])
+    PeerReviewDistribution.objects.create(rubric=rubric, is_distribution_complete=True,
+                                          distributed_at_utc=prompt.due_date_utc)
+
+    comments = []
+    evaluations = []
+    for peer_review in PeerReview.objects.filter(submission__assignment=prompt).order_by('id'):
+        if rng.random() >= scale.commented_reviews:
+            continue
+        commented_at = due_date + timedelta(hours=rng.randint(-72, 24))
+        for criterion in criteria[:rng.choice([1, len(criteria), len(criteria)])]:
+            comments.append(PeerReviewComment(criterion=criterion, peer_review=peer_review, comment='Comment',
+                                              commented_at_utc=commented_at))
+        if rng.random() < scale.evaluated_reviews / scale.commented_reviews:
+            evaluations.append(PeerReviewEvaluation(peer_review=peer_review, usefulness=rng.randint(1, 5),
+                                                    comment='Evaluation'))
+    PeerReviewComment.objects.bulk_create(comments, batch_size=500)
+    PeerReviewEvaluation.objects.bulk_create(evaluations, batch_size=500)
+    return rubric
+
+
+def make_course(scale, seed=0):
+    """
+    Build a course at the given `Scale`: students spread across sections, and for each rubric a prompt that most
+    students submitted to, distributed reviews, comments in every state of completion and some evaluations.  The
+    same `seed` always builds the same course.
+    """
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+
+    course = CanvasCourse.objects.create(id=COURSE_ID, name='Benchmark Course')
+    sections = [CanvasSection.objects.create(id=course.id * 100 + i, course=course, name='Section %d' % i)
+                for i in range(scale.sections)]
+
+    students = [CanvasStudent(id=10000 + i, username='student%d' % i, full_name='Student %d' % i,
+                              sortable_name='%d, Student' % i)
+                for i in range(scale.students)]
+    CanvasStudent.objects.bulk_create(students, batch_size=500)
+    CanvasStudent.courses.through.objects.bulk_create([
+        CanvasStudent.courses.through(canvasstudent_id=student.id, canvascourse_id=course.id) for student in students
+    ], batch_size=500)
+    CanvasStudent.sections.through.objects.bulk_create([
+        CanvasStudent.sections.through(canvasstudent_id=student.id, canvassection_id=rng.choice(sections).id)
+        for student in students
+    ], batch_size=500)
+
+    rubrics = [_reviewed_rubric(rng, number, course, students, scale, now) for number in range(scale.rubrics)]
+
+    # nothing was created through the API or the distribution job, so what they maintain has to be brought up to date
+    completion.rebuild()
+    summaries.rebuild()
+
+    return SyntheticCourse(course=course, sections=sections, students=students, rubrics=rubrics)
@@ -0,0 +1,238 @@
+"""
+Query count, database time and wall-clock time of every API endpoint against a synthetic course.
+
+The scale of the course is picked with the MPR_BENCHMARK_SCALE environment variable (one of `synthetic.SCALES`;
+defaults to "small").  A JSON report of every endpoint's measurements is written to the path in
+MPR_BENCHMARK_REPORT (or to the test's temporary directory).  The run fails if any endpoint takes more queries or
+time than `thresholds.json` allows at that scale.
+"""
+import os
+import json
+import time
+from datetime import datetime, timezone
+from collections import namedtuple, OrderedDict
+
+import pytest
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, reset_queries
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rolepermissions.roles import assign_role
+
+import peer_review.api.endpoints as api
+import peer_review.etl as etl
+import peer_review.canvas as canvas
+from peer_review.models import CanvasAssignment, CanvasSyncState, PeerReview, PeerReviewEvaluation
+from peer_review.tests.benchmark.synthetic import SCALES, make_course
+
+THRESHOLDS_PATH = os.path.join(os.path.dirname(__file__), 'thresholds.json')
+
+Endpoint = namedtuple('Endpoint', ['name', 'view', 'role', 'kwargs', 'body', 'repeatable'])
+
+
+def _get(name, view, role, **kwargs):
+    return Endpoint(name=name, view=view, role=role, kwargs=kwargs, body=None, repeatable=True)
+
+
+def _post(name, view, role, body, repeatable=True, **kwargs):
+    return Endpoint(name=name, view=view, role=role, kwargs=kwargs, body=body, repeatable=repeatable)
+
+
+def _endpoints(synthetic_course):
+    course_id = str(synthetic_course.course.id)
+    rubric = synthetic_course.rubrics[0]
+    prompt = rubric.reviewed_assignment
+
+    # the student whose pages are measured reviewed others and was reviewed, with one review left to evaluate
+    received = PeerReview.objects.filter(submission__assignment=prompt, evaluation=None, comment_count__gt=0) \
+        .order_by('id').first()
+    student = received.submission.author
+    given = PeerReview.objects.filter(student=student, submission__assignment=prompt).order_by('id').first()
+    evaluated = PeerReviewEvaluation.objects.filter(peer_review__submission__assignment=prompt) \
+        .order_by('id').first().peer_review
+    student_id = str(student.id)
+    new_prompt = CanvasAssignment.objects.create(id=900001, course=synthetic_course.course, title='New Prompt',
+                                                 due_date_utc=datetime.now(timezone.utc))
+    new_peer_review = CanvasAssignment.objects.create(id=900002, course=synthetic_course.course,
+                                                      title='New Peer Review', is_peer_review_assignment=True)
+
+    return student, [
+        _get('logged_in_user_details', api.logged_in_user_details, 'student'),
+        _get('all_students', api.all_students, 'instructor', course_id=course_id),
+        _get('all_peer_review_assignment_details', api.all_peer_review_assignment_details, 'instructor',
+             course_id=course_id),
+        _get('all_rubrics_for_course', api.all_rubrics_for_course, 'instructor', course_id=course_id),
+        _get('student_info', api.student_info, 'instructor', course_id=course_id, student_id=student_id),
+        _get('all_rubric_statuses_for_student', api.all_rubric_statuses_for_student, 'instructor',
+             course_id=course_id, student_id=student_id),
+        _get('rubric_status_for_student', api.rubric_status_for_student, 'instructor',
+             course_id=course_id, rubric_id=str(rubric.id), student_id=student_id),
+        _get('rubric_info_for_peer_review_assignment', api.rubric_info_for_peer_review_assignment, 'instructor',
+             course_id=course_id, passback_assignment_id=str(rubric.passback_assignment_id)),
+        _get('review_status', api.review_status, 'instructor', course_id=course_id, rubric_id=str(rubric.id)),
+        _get('non_reviewers_for_rubric', api.non_reviewers_for_rubric, 'instructor',
+             course_id=course_id, rubric_id=str(rubric.id)),
+        _get('evaluation_for_review', api.evaluation_for_review, 'instructor',
+             course_id=course_id, review_id=str(evaluated.id)),
+        _get('single_review (instructor)', api.single_review, 'instructor',
+             course_id=course_id, review_id=str(given.id)),
+        _get('csv_for_student', api.csv_for_student_and_rubric, 'instructor',
+             course_id=course_id, student_id=student_id),
+        _get('csv_for_student_and_rubric', api.csv_for_student_and_rubric, 'instructor',
+             course_id=course_id, student_id=student_id, rubric_id=str(rubric.id)),
+        _get('csv_for_course', api.csv_for_course_and_rubric, 'instructor', course_id=course_id),
+        _get('csv_for_course_and_rubric', api.csv_for_course_and_rubric, 'instructor',
+             course_id=course_id, rubric_id=str(rubric.id)),
+        _get('assigned_work', api.assigned_work, 'student', course_id=course_id, student_id=student_id),
+        _get('completed_work', api.completed_work, 'student', course_id=course_id, student_id=student_id),
+        _get('reviews_given', api.reviews_given, 'student',
+             course_id=course_id, student_id=student_id, rubric_id=str(rubric.id)),
+        _get('reviews_received', api.reviews_received, 'student',
+             course_id=course_id, student_id=student_id, rubric_id=str(rubric.id)),
+        _get('peer_review_evaluations', api.peer_review_evaluations, 'student',
+             course_id=course_id, student_id=student_id),
+        _get('single_review (student)', api.single_review, 'student', course_id=course_id, review_id=str(given.id)),
+        _get('rubric_for_review', api.rubric_for_review, 'student', course_id=course_id, review_id=str(given.id)),
+        _get('submission_for_review', api.submission_for_review, 'student',
+             course_id=course_id, review_id=str(given.id)),
+        _post('submit_peer_review', api.submit_peer_review, 'student',
+              {'comments': [{'criterion_id': c.id, 'comment': 'Benchmark'} for c in rubric.criteria.all()]},
+              course_id=course_id, review_id=str(given.id)),
+        _post('submit_peer_review_evaluation', api.submit_peer_review_evaluation, 'student',
+              {'usefulness': 4, 'comment': 'Benchmark'}, repeatable=False,
+              course_id=course_id, student_id=student_id, peer_review_id=str(received.id)),
+        _post('create_or_update_rubric', api.create_or_update_rubric, 'instructor',
+              {'description': 'New Rubric', 'criteria': ['First', 'Second', 'Third'],
+               'prompt_id': new_prompt.id, 'peer_review_assignment_id': new_peer_review.id,
+               'peer_review_open_date_is_prompt_due_date': True, 'peer_review_open_date': None,
+               'peer_review_evaluation_is_mandatory': False},
+              course_id=course_id),
+        _post('add_students_to_distribution', api.add_students_to_distribution, 'instructor',
+              {'student_ids': [s.id for s in synthetic_course.students[-3:]]}, repeatable=False,
+              course_id=course_id, rubric_id=str(rubric.id)),
+    ]
+
+
+def _mock_canvas(requests_mock, synthetic_course):
+    course_id = synthetic_course.course.id
+    requests_mock.get(canvas._make_url('assignments', [course_id]), json=[
+        dict({'id': a.id, 'course_id': course_id, 'name': a.title,
+              'due_at': a.due_date_utc.isoformat() if a.due_date_utc else None,
+              'submission_types': ['online_upload']},
+             **({'external_tool_tag_attributes': {'url': 'https://%s/launch' % settings.APP_HOST}}
+                if a.is_peer_review_assignment else {}))
+        for a in CanvasAssignment.objects.filter(course_id=course_id)
+    ])
+    for rubric in synthetic_course.rubrics:
+        submissions = rubric.reviewed_assignment.canvas_submission_set.all()
+        requests_mock.get(canvas._make_url('submissions', [course_id, rubric.reviewed_assignment_id]), json=[
+            {'user_id': s.author_id, 'workflow_state': 'submitted', 'late': False, 'attachments': []}
+            for s in submissions
+        ])
+    # the roster and assignments are served as stored, as they would be between refreshes
+    etl.persist_assignments(course_id)
+    for resource in ('roster', 'assignments'):
+        CanvasSyncState.objects.create(course_id=course_id, resource=resource,
+                                       synced_at_utc=datetime.now(timezone.utc))
+
+
+def _users(synthetic_course, student):
+    instructor = User.objects.create_user(username='instructor')
+    assign_role(instructor, 'instructor')
+    student_user = User.objects.create_user(username=student.username)
+    assign_role(student_user, 'student')
+
+    def launch_params(canvas_user_id, roles):
+        return {'custom_canvas_course_id': str(synthetic_course.course.id),
+                'custom_canvas_user_id': str(canvas_user_id),
+                'context_title': synthetic_course.course.name,
+                'roles': roles}
+
+    return {
+        'instructor': (instructor, launch_params(1, 'Instructor')),
+        'student': (student_user, launch_params(student.id, 'Learner'))
+    }
+
+
+def _request(endpoint, users):
+    factory = RequestFactory()
+    if endpoint.body is None:
+        request = factory.get('/')
+    else:
+        request = factory.post('/', data=json.dumps(endpoint.body), content_type='application/json')
+    request.user, launch_params = users[endpoint.role]
+    request.session = {'lti_launch_params': launch_params}
+    return request
+
+
+def _measure(endpoint, users):
+    request = _request(endpoint, users)
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        response = endpoint.view(request, **endpoint.kwargs)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+            response.close()
+        wall_seconds = time.perf_counter() - start
+
+    assert response.status_code < 400, '%s responded with %d' % (endpoint.name, response.status_code)
+    return OrderedDict([
+        ('status', response.status_code),
+        ('queries', len(queries)),
+        ('db_seconds', round(sum(float(q['time']) for q in queries.captured_queries), 4)),
+        ('wall_seconds', round(wall_seconds, 4))
+    ])
+
+
+def _regressions(results, thresholds):
+    regressions = []
+    for name, result in results.items():
+        threshold = thresholds.get(name)
+        if threshold is None:
+            regressions.append('%s has no threshold' % name)
+            continue
+        if result['queries'] > threshold['max_queries']:
+            regressions.append('%s ran %d queries (at most %d allowed)'
+                               % (name, result['queries'], threshold['max_queries']))
+        if result['wall_seconds'] > threshold['max_seconds']:
+            regressions.append('%s took %.3fs (at most %.3fs allowed)'
+                               % (name, result['wall_seconds'], threshold['max_seconds']))
+    return regressions
+
+
+@pytest.mark.django_db
+def test_endpoint_benchmark(requests_mock, settings, tmpdir):
+    scale_name = os.environ.get('MPR_BENCHMARK_SCALE', 'small')
+    scale = SCALES[scale_name]
+    settings.MEDIA_ROOT = str(tmpdir)
+
+    synthetic_course = make_course(scale)
+    _mock_canvas(requests_mock, synthetic_course)
+    student, endpoints = _endpoints(synthetic_course)
+    users = _users(synthetic_course, student)
+    tmpdir.mkdir('submissions')
+    for submission in student.peer_reviews_for_student.select_related('submission'):
+        tmpdir.join('submissions', submission.submission.filename).write_binary(b'essay')
+
+    results = OrderedDict()
+    for endpoint in endpoints:
+        if endpoint.repeatable:
+            # whatever a first request caches (e.g. Canvas responses) is not what is being measured
+            _measure(endpoint, users)
+        results[endpoint.name] = _measure(endpoint, users)
+
+    report = OrderedDict([('scale', scale_name), ('parameters', scale._asdict()), ('endpoints', results)])
+    report_path = os.environ.get('MPR_BENCHMARK_REPORT', str(tmpdir.join('benchmark-report.json')))
+    with open(report_path, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+    print('Endpoint benchmark report (%s scale) written to %s' % (scale_name, report_path))
+
+    with open(THRESHOLDS_PATH) as thresholds_file:
+        thresholds = json.load(thresholds_file)
+    if scale_name not in thresholds:
+        pytest.skip('No thresholds for the %s scale' % scale_name)
+    regressions = _regressions(results, thresholds[scale_name])
+    assert not regressions, '\n'.join(regressions)
@@ -0,0 +1,72 @@
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit
+
+import pytest
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeCanvasServer:
+    """
+    A local HTTP/1.1 server that stands in for Canvas's file storage (or API).  Register content with `add_file`, then
+    point attachment URLs at the returned URL; query strings are ignored when looking content up.  Requests and distinct client connections are counted so that tests can
+    check for connection reuse.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+        self.connections = set()
+        self._lock = threading.Lock()
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return 'http://%s:%d' % (host, port)
+
+    def add_file(self, path, content, status=200):
+        self.files[path] = (status, content)
+        return self.base_url + path
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _make_handler(self):
+        fake_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with fake_server._lock:
+                    fake_server.requests.append(self.path)
+                    fake_server.connections.add(self.client_address)
+                status, content = fake_server.files.get(urlsplit(self.path).path, (404, b'Not Found'))
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def fake_canvas_server():
+    server = FakeCanvasServer()
+    server.start()
+    yield server
+    server.stop()
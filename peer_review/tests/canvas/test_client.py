@@ -0,0 +1,242 @@
+import io
+import pytest
+import requests
+
+import peer_review.canvas as canvas
+from peer_review.canvas import CanvasClient
+from peer_review.tests.canvas.server import fake_canvas_server
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    delays = []
+    monkeypatch.setattr(canvas.time, 'sleep', delays.append)
+    return delays
+
+
+# noinspection PyShadowingNames
+def test_retrieve_retries_server_errors_and_throttling(requests_mock, settings, no_sleep):
+    settings.CANVAS_API_MAX_RETRIES = 3
+    requests_mock.get(canvas._make_url('sections', [1]), [
+        {'status_code': 503},
+        {'status_code': 429, 'headers': {'Retry-After': '5'}},
+        {'json': [{'id': 1}, {'id': 2}]}
+    ])
+
+    with CanvasClient() as client:
+        assert client.retrieve('sections', 1) == [{'id': 1}, {'id': 2}]
+        assert client.metrics['requests'] == 3
+        assert client.metrics['retries'] == 2
+
+    assert len(no_sleep) == 2
+    assert no_sleep[0] <= settings.CANVAS_API_BACKOFF
+    assert no_sleep[1] >= 5
+
+
+# noinspection PyShadowingNames
+def test_retrieve_gives_up_after_max_retries(requests_mock, settings, no_sleep):
+    settings.CANVAS_API_MAX_RETRIES = 2
+    requests_mock.get(canvas._make_url('sections', [1]), status_code=502)
+
+    with CanvasClient() as client, pytest.raises(requests.HTTPError):
+        client.retrieve('sections', 1)
+
+    assert requests_mock.call_count == 3
+
+
+# noinspection PyShadowingNames
+def test_retry_after_longer_than_max_backoff_is_not_waited_for(requests_mock, settings, no_sleep):
+    settings.CANVAS_API_MAX_BACKOFF = 10
+    settings.CANVAS_API_BACKOFF = 100
+    requests_mock.get(canvas._make_url('sections', [1]), [
+        {'status_code': 503},
+        {'status_code': 429, 'headers': {'Retry-After': '3600'}},
+        {'json': [{'id': 1}]}
+    ])
+
+    with CanvasClient() as client, pytest.raises(requests.HTTPError):
+        client.retrieve('sections', 1)
+
+    assert requests_mock.call_count == 2
+    assert len(no_sleep) == 1
+    assert no_sleep[0] <= settings.CANVAS_API_MAX_BACKOFF
+
+
+# noinspection PyShadowingNames
+def test_create_is_not_retried_after_server_error(requests_mock, no_sleep):
+    requests_mock.post(canvas._make_url('assignments', [1]), status_code=500)
+
+    with CanvasClient() as client, pytest.raises(requests.HTTPError):
+        client.create('assignments', 1, data={'assignment': {}})
+
+    assert requests_mock.call_count == 1
+
+
+# noinspection PyShadowingNames
+def test_requests_slow_down_when_rate_limit_is_low(requests_mock, settings, no_sleep):
+    settings.CANVAS_API_RATE_LIMIT_THRESHOLD = 100
+    requests_mock.get(canvas._make_url('course', [1]), [
+        {'json': {'id': 1}, 'headers': {'X-Rate-Limit-Remaining': '700.0'}},
+        {'json': {'id': 1}, 'headers': {'X-Rate-Limit-Remaining': '25.0'}},
+        {'json': {'id': 1}, 'headers': {'X-Rate-Limit-Remaining': '600.0'}},
+        {'json': {'id': 1}}
+    ])
+
+    with CanvasClient() as client:
+        for _ in range(4):
+            client.retrieve('course', 1)
+        assert client.metrics['throttled_seconds'] == pytest.approx(0.75 * canvas.MAX_THROTTLE_DELAY)
+
+    # only the request after the quota dropped below the threshold waits
+    assert no_sleep == [pytest.approx(0.75 * canvas.MAX_THROTTLE_DELAY)]
+
+
+# noinspection PyShadowingNames
+def test_client_authenticates_with_its_token(requests_mock, settings):
+    settings.CANVAS_API_TOKEN = 'application-token'
+    requests_mock.get(canvas._make_url('course', [1]), json={'id': 1})
+
+    canvas.retrieve('course', 1)
+    with CanvasClient(token='user-token') as client:
+        client.retrieve('course', 1)
+
+    assert [r.headers['Authorization'] for r in requests_mock.request_history] == \
+        ['Bearer application-token', 'Bearer user-token']
+
+
+# noinspection PyShadowingNames
+def test_client_reuses_connections(fake_canvas_server, settings):
+    settings.CANVAS_API_URL = fake_canvas_server.base_url + '/api/v1/'
+    for section_id in range(10):
+        fake_canvas_server.add_file('/api/v1/courses/1/sections/%d' % section_id, b'{"id": %d}' % section_id)
+
+    with CanvasClient() as client:
+        sections = [client.retrieve('section', 1, section_id) for section_id in range(10)]
+
+    assert sections == [{'id': section_id} for section_id in range(10)]
+    assert len(fake_canvas_server.connections) == 1
+
+
+def _link_header(url, **pages):
+    return ','.join('<%s?page=%s&per_page=100>; rel="%s"' % (url, page, key) for key, page in pages.items())
+
+
+# noinspection PyShadowingNames
+def test_numbered_pages_are_fetched_concurrently_in_order(requests_mock, settings):
+    settings.CANVAS_API_PAGE_WORKERS = 3
+    url = canvas._make_url('students', [1])
+    requests_mock.get(url, json=[{'id': 1}], headers={'Link': _link_header(url, next=2, last=6)})
+    for page in range(2, 7):
+        requests_mock.get(url + '?page=%d' % page, json=[{'id': page}],
+                          headers={'Link': _link_header(url, last=6)})
+
+    pages = list(canvas.iter_pages('students', 1))
+
+    assert pages == [[{'id': page}] for page in range(1, 7)]
+    assert canvas.retrieve('students', 1) == [{'id': page} for page in range(1, 7)]
+
+
+# noinspection PyShadowingNames
+def test_bookmarked_pages_are_fetched_one_at_a_time(requests_mock, settings):
+    settings.CANVAS_API_PAGE_WORKERS = 3
+    url = canvas._make_url('submissions', [1, 2])
+    requests_mock.get(url, json=[{'id': 1}], headers={'Link': _link_header(url, next='bookmark:abc')})
+    requests_mock.get(url + '?page=bookmark:abc', json=[{'id': 2}])
+
+    assert canvas.retrieve('submissions', 1, 2) == [{'id': 1}, {'id': 2}]
+    assert requests_mock.call_count == 2
+
+
+# noinspection PyShadowingNames
+def test_pages_are_only_fetched_as_they_are_consumed(requests_mock, settings):
+    settings.CANVAS_API_PAGE_WORKERS = 1
+    url = canvas._make_url('students', [1])
+    requests_mock.get(url, json=[{'id': 1}], headers={'Link': _link_header(url, next=2, last=3)})
+    requests_mock.get(url + '?page=2', json=[{'id': 2}])
+
+    pages = canvas.iter_pages('students', 1)
+
+    assert next(pages) == [{'id': 1}]
+    assert requests_mock.call_count == 1
+    pages.close()
+
+
+# noinspection PyShadowingNames
+def test_iter_retrieve_streams_objects_across_pages(requests_mock, settings):
+    settings.CANVAS_API_PAGE_WORKERS = 1
+    url = canvas._make_url('students', [1])
+    requests_mock.get(url, json=[{'id': 1}, {'id': 2}], headers={'Link': _link_header(url, next=2, last=2)})
+    requests_mock.get(url + '?page=2', json=[{'id': 3}])
+
+    students = canvas.iter_retrieve('students', 1)
+
+    assert [next(students), next(students)] == [{'id': 1}, {'id': 2}]
+    assert requests_mock.call_count == 1
+    assert list(students) == [{'id': 3}]
+    assert requests_mock.call_count == 2
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_retrieve_if_modified_sends_conditional_requests(requests_mock):
+    url = canvas._make_url('sections', [1])
+    requests_mock.get(url, [
+        {'json': [{'id': 1}], 'headers': {'ETag': 'W/"abc"'}},
+        {'status_code': 304},
+        {'json': [{'id': 1}, {'id': 2}], 'headers': {'ETag': 'W/"def"'}}
+    ])
+
+    with CanvasClient() as client:
+        assert client.retrieve_if_modified('sections', 1) == ([{'id': 1}], True)
+        assert client.retrieve_if_modified('sections', 1) == ([{'id': 1}], False)
+        assert client.retrieve_if_modified('sections', 1) == ([{'id': 1}, {'id': 2}], True)
+        assert client.metrics['not_modified'] == 1
+
+    assert [r.headers.get('If-None-Match') for r in requests_mock.request_history] == [None, 'W/"abc"', 'W/"abc"']
+
+
+# noinspection PyShadowingNames
+def test_throttled_file_upload_is_resent_in_full(requests_mock, no_sleep):
+    upload_url = 'https://uploads.example.edu/upload'
+    confirmation_url = 'https://uploads.example.edu/confirm'
+    requests_mock.post(canvas._make_url('submission_file', [1, 2]),
+                       json={'upload_url': upload_url, 'upload_params': {'key': 'value'}})
+    requests_mock.post(upload_url, [
+        {'status_code': 429},
+        {'status_code': 301, 'headers': {'Location': confirmation_url}}
+    ])
+    requests_mock.post(confirmation_url, json={'id': 30})
+    requests_mock.post(canvas._make_url('submissions', [1, 2]), json={'id': 40})
+
+    contents = io.BytesIO(b'the whole essay')
+    with CanvasClient() as client:
+        assert client.submit_file(1, 2, 'essay.txt', contents) == {'id': 40}
+
+    uploads = [r for r in requests_mock.request_history if r.url == upload_url]
+    assert len(uploads) == 2
+    assert all(b'the whole essay' in upload.body for upload in uploads)
+
+
+class _Unseekable(io.RawIOBase):
+    def __init__(self, data):
+        self.data = data
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk, self.data = self.data[:len(buffer)], self.data[len(buffer):]
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+# noinspection PyShadowingNames
+def test_unseekable_upload_is_not_retried(requests_mock, no_sleep):
+    upload_url = 'https://uploads.example.edu/upload'
+    requests_mock.post(upload_url, status_code=429)
+
+    with CanvasClient() as client:
+        response = client.request('POST', upload_url, authenticated=False, files={'file': _Unseekable(b'essay')})
+
+    assert response.status_code == 429
+    assert requests_mock.call_count == 1
@@ -105,6 +105,7 @@ def create_test_rubrics(course_id, pairings, section_ids, num_criteria=3):
                                   rubric=rubric)
                         for j in range(1, num_criteria+1)]
             Criterion.objects.bulk_create(criteria)
+            Rubric.objects.filter(id=rubric.id).update(criteria_count=len(criteria))
             rubrics.append(rubric)
     return rubrics
 
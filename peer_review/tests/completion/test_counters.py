@@ -0,0 +1,95 @@
+import importlib
+from datetime import datetime, timezone
+
+import pytest
+from django.apps import apps
+from django.core.management import call_command, CommandError
+
+from peer_review import summaries
+from peer_review.completion import record_comments, rebuild
+from peer_review.models import PeerReview, PeerReviewComment, Rubric, Criterion
+from peer_review.tests.queries.fixtures import reviewed_class, NUMBER_OF_CRITERIA
+
+
+def _counters(peer_review):
+    return peer_review.comment_count, peer_review.is_complete, peer_review.completed_at_utc
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_counters_match_comments(reviewed_class):
+    assert Rubric.objects.get(id=reviewed_class.rubric.id).num_criteria == NUMBER_OF_CRITERIA
+    for peer_review in PeerReview.objects.all():
+        comments = list(peer_review.comments.all())
+        assert peer_review.comment_count == len(comments)
+        assert peer_review.is_complete == (len(comments) >= NUMBER_OF_CRITERIA)
+        if peer_review.is_complete:
+            assert peer_review.completed_at_utc == max(c.commented_at_utc for c in comments)
+        else:
+            assert peer_review.completed_at_utc is None
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_record_comments_completes_review(reviewed_class):
+    peer_review = PeerReview.objects.filter(comment_count=0).first()
+    commented_at = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    comments = [PeerReviewComment.objects.create(criterion=criterion, peer_review=peer_review, comment='Comment',
+                                                 commented_at_utc=commented_at)
+                for criterion in reviewed_class.rubric.criteria.all()]
+
+    record_comments(peer_review, comments, NUMBER_OF_CRITERIA)
+
+    assert _counters(PeerReview.objects.get(id=peer_review.id)) == (NUMBER_OF_CRITERIA, True, commented_at)
+    assert rebuild(fix=False) == (0, 0)
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_rebuild_fixes_stale_counters(reviewed_class):
+    expected = {peer_review.id: _counters(peer_review) for peer_review in PeerReview.objects.all()}
+    PeerReview.objects.update(comment_count=0, is_complete=False, completed_at_utc=None)
+    Rubric.objects.update(criteria_count=0)
+
+    with pytest.raises(CommandError):
+        call_command('rebuild_review_counters', check=True)
+    stale = rebuild()
+
+    assert stale.rubrics == 1
+    assert stale.peer_reviews == len([c for c in expected.values() if c[0] > 0])
+    assert {peer_review.id: _counters(peer_review) for peer_review in PeerReview.objects.all()} == expected
+    call_command('rebuild_review_counters', check=True)
+
+
+def _remove_criteria(rubric):
+    PeerReviewComment.objects.filter(criterion__rubric=rubric).delete()
+    Criterion.objects.filter(rubric=rubric).delete()
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_reviews_of_a_rubric_without_criteria_are_never_complete(reviewed_class):
+    _remove_criteria(reviewed_class.rubric)
+    rebuild()
+    peer_review = PeerReview.objects.first()
+    peer_review.delete()
+    PeerReview.objects.create(student_id=peer_review.student_id, submission_id=peer_review.submission_id)
+
+    assert rebuild(fix=False) == (0, 0)
+    assert {_counters(peer_review) for peer_review in PeerReview.objects.all()} == {(0, False, None)}
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_migrations_count_completion_like_rebuild(reviewed_class):
+    _remove_criteria(reviewed_class.rubric)
+    PeerReview.objects.update(comment_count=0, is_complete=False, completed_at_utc=None)
+
+    importlib.import_module('peer_review.migrations.0014_review_completion_counters').count_completion(apps, None)
+    assert PeerReview.objects.filter(is_complete=True, completed_at_utc=None).exists()
+    summaries.rebuild()
+    importlib.import_module('peer_review.migrations.0017_review_completion_needs_a_comment') \
+        .uncomplete_reviews_without_comments(apps, None)
+
+    assert rebuild(fix=False) == (0, 0)
+    assert summaries.rebuild(fix=False) == []
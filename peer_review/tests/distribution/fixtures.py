@@ -31,9 +31,8 @@ ModelsPackage = namedtuple('ModelsPackage', [
 ])
 
 
-@pytest.fixture
-@pytest.mark.django_db(True)
-def test_models():
+def make_test_models():
+    """ A course with three sections and a prompt whose rubric has three criteria. """
     course = CanvasCourse(id=next_id(CanvasCourse), name='Test Course')
     course.save()
 
@@ -90,10 +89,19 @@ def test_models():
     )
 
 
-# noinspection PyShadowingNames,PyProtectedMember
 @pytest.fixture
 @pytest.mark.django_db(True)
-def rubric_tree_with_mocked_requests(test_models, requests_mock):
+def test_models():
+    return make_test_models()
+
+
+# noinspection PyProtectedMember
+def mock_rubric_tree(test_models, requests_mock, student_id_start=None, submission_id_start=None):
+    """
+    Serve a course made by `make_test_models` from the mocked Canvas API, with four students who all submitted to
+    the prompt.  Students and submissions are numbered after the stored ones unless told where to start, which they
+    must be for more than one course.
+    """
     requests_mock.get(
         canvas._make_url('course', [test_models.course.id]),
         json=test_course_api(test_models.course)
@@ -128,7 +136,8 @@ def rubric_tree_with_mocked_requests(test_models, requests_mock):
         json=test_sections_api(test_models.course.sections.all())
     )
 
-    student_id_start = next_id(CanvasStudent)
+    if student_id_start is None:
+        student_id_start = next_id(CanvasStudent)
     test_students = [
         test_student_api(
             test_models.creation_time,
@@ -148,7 +157,8 @@ def rubric_tree_with_mocked_requests(test_models, requests_mock):
         bytes(submission_template % student['id'], 'utf8')
         for student in test_students
     ]
-    submission_id_start = next_id(CanvasSubmission)
+    if submission_id_start is None:
+        submission_id_start = next_id(CanvasSubmission)
     test_submissions = [
         test_submission_api(
             test_models.creation_time,
@@ -170,3 +180,10 @@ def rubric_tree_with_mocked_requests(test_models, requests_mock):
         requests_mock.get(url, content=attachment_data)
 
     return test_models.rubric
+
+
+# noinspection PyShadowingNames
+@pytest.fixture
+@pytest.mark.django_db(True)
+def rubric_tree_with_mocked_requests(test_models, requests_mock):
+    return mock_rubric_tree(test_models, requests_mock)
@@ -1,12 +1,17 @@
+import threading
 import pytest
 from datetime import datetime
+from collections import defaultdict
+from django.db import connection
 
 from hypothesis import given, settings, HealthCheck, unlimited, Verbosity
 from hypothesis.strategies import data
 
 from .strategies import rubric_ready_for_distribution, students_not_for_peer_review
-from peer_review.models import CanvasStudent, CanvasSubmission, PeerReview, PeerReviewDistribution
-from peer_review.tests.distribution.fixtures import test_models, rubric_tree_with_mocked_requests
+import peer_review.distribution as distribution
+from peer_review.models import CanvasStudent, CanvasSubmission, PeerReview, PeerReviewDistribution, JobLog, Rubric
+from peer_review.tests.distribution.fixtures import test_models, rubric_tree_with_mocked_requests, \
+    make_test_models, mock_rubric_tree
 from peer_review.distribution import make_distribution, review_distribution_task, add_to_distribution, DEFAULT_NUMBER_OF_REVIEWS_PER_STUDENT
 
 
@@ -119,3 +124,74 @@ def test_adding_students_to_existing_distribution(rubric_tree_with_mocked_reques
     # @pytest.mark.django_db(transaction=True) seems to have no effect, so doing cleanup here
     PeerReviewDistribution.objects.filter(rubric=rubric).delete()
     PeerReview.objects.filter(submission__assignment=rubric.reviewed_assignment).delete()
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db(transaction=True)
+def test_adding_authors_to_existing_distribution(rubric_tree_with_mocked_requests):
+    rubric = rubric_tree_with_mocked_requests
+    review_distribution_task(datetime.utcnow(), True)
+
+    own_submission = rubric.reviewed_assignment.canvas_submission_set.order_by('id').first()
+    author = own_submission.author
+    PeerReview.objects.filter(student=author, submission__assignment=rubric.reviewed_assignment).delete()
+
+    add_to_distribution(rubric, [author])
+
+    reviews = PeerReview.objects.filter(student=author, submission__assignment=rubric.reviewed_assignment)
+    assert reviews.count() == DEFAULT_NUMBER_OF_REVIEWS_PER_STUDENT
+    assert not reviews.filter(submission=own_submission).exists()
+
+    # adding the same student again should not try to duplicate any existing pairings
+    add_to_distribution(rubric, [author])
+    assert reviews.count() == DEFAULT_NUMBER_OF_REVIEWS_PER_STUDENT
+
+    PeerReviewDistribution.objects.filter(rubric=rubric).delete()
+    PeerReview.objects.filter(submission__assignment=rubric.reviewed_assignment).delete()
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db(transaction=True)
+def test_distribution_task_with_workers(requests_mock, monkeypatch):
+    # two courses, so that there is more than one of everything for the workers to share
+    rubrics = [mock_rubric_tree(make_test_models(), requests_mock,
+                                student_id_start=1000 * course_number, submission_id_start=1000 * course_number)
+               for course_number in (1, 2)]
+
+    # SQLite's shared in-memory test database locks whole tables against concurrent writers, so there the workers
+    # take turns; they still run on the pool's threads, each with its own connection
+    database_lock = threading.Lock() if connection.vendor == 'sqlite' else None
+    threads_by_phase = defaultdict(list)
+
+    def on_worker(phase):
+        fn = getattr(distribution, phase)
+
+        def run(*args, **kwargs):
+            threads_by_phase[phase].append(threading.current_thread())
+            if database_lock is None:
+                return fn(*args, **kwargs)
+            with database_lock:
+                return fn(*args, **kwargs)
+        return run
+
+    phases = ('_persist_assignments_for_course', '_persist_roster_for_course', '_distribute_prompt')
+    for phase in phases:
+        monkeypatch.setattr(distribution, phase, on_worker(phase))
+
+    review_distribution_task(datetime.utcnow(), True, workers=2, report_timings=True)
+
+    assert set(threads_by_phase) == set(phases)
+    for phase, threads in threads_by_phase.items():
+        assert len(threads) == len(rubrics), phase
+        assert threading.main_thread() not in threads, phase
+    for rubric in rubrics:
+        rubric = Rubric.objects.get(id=rubric.id)
+        assert rubric.peer_review_distribution.is_distribution_complete
+        submissions = rubric.reviewed_assignment.canvas_submission_set.all()
+        assert submissions.count() == 4
+        for submission in submissions:
+            reviews = PeerReview.objects.filter(submission_id=submission.id)
+            assert reviews.exists()
+            # reviewers come from the same course as the submission
+            assert not reviews.exclude(student__courses=rubric.reviewed_assignment.course_id).exists()
+    assert JobLog.objects.filter(message__startswith='Review distribution phase timings (2 worker(s))').exists()
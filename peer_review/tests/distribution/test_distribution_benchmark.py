@@ -0,0 +1,60 @@
+import time
+from collections import namedtuple
+
+import pytest
+
+from peer_review.distribution import make_distribution, DEFAULT_NUMBER_OF_REVIEWS_PER_STUDENT
+
+
+FakeCourse = namedtuple('FakeCourse', ['id'])
+FakeAssignment = namedtuple('FakeAssignment', ['id', 'course'])
+FakeStudent = namedtuple('FakeStudent', ['id'])
+FakeSubmission = namedtuple('FakeSubmission', ['id', 'author_id'])
+
+
+def _fake_class(number_of_students):
+    assignment = FakeAssignment(id=1, course=FakeCourse(id=1))
+    students = [FakeStudent(id=i) for i in range(number_of_students)]
+    submissions = [FakeSubmission(id=number_of_students + s.id, author_id=s.id) for s in students]
+    return assignment, students, submissions
+
+
+@pytest.mark.parametrize('number_of_students,max_seconds', [(100, 1), (1000, 2), (10000, 10)])
+def test_distribution_benchmark(number_of_students, max_seconds):
+    assignment, students, submissions = _fake_class(number_of_students)
+
+    start = time.perf_counter()
+    reviews, counts = make_distribution(assignment, students, submissions)
+    elapsed = time.perf_counter() - start
+
+    print('make_distribution for %d students took %.3fs' % (number_of_students, elapsed))
+    assert elapsed < max_seconds
+
+    author_by_submission = {s.id: s.author_id for s in submissions}
+    for student_id, submissions_to_review in reviews.items():
+        assert len(submissions_to_review) == DEFAULT_NUMBER_OF_REVIEWS_PER_STUDENT
+        assert all(author_by_submission[s] != student_id for s in submissions_to_review)
+
+    # review counts should stay balanced (self-review exclusion can leave the last few off by one)
+    assert max(counts.values()) - min(counts.values()) <= 2
+    assert sum(counts.values()) == number_of_students * DEFAULT_NUMBER_OF_REVIEWS_PER_STUDENT
+
+
+def test_distribution_terminates_without_enough_submissions():
+    assignment, students, submissions = _fake_class(DEFAULT_NUMBER_OF_REVIEWS_PER_STUDENT)
+
+    reviews, counts = make_distribution(assignment, students, submissions)
+
+    assert reviews == {}
+    assert counts is None
+
+
+def test_distribution_terminates_when_submissions_run_out():
+    assignment, students, submissions = _fake_class(3)
+
+    # a student can never review their own submission, so with 3 submissions and n=3 the queue runs dry
+    reviews, counts = make_distribution(assignment, students, submissions[:3] + [FakeSubmission(id=99, author_id=0)],
+                                        n=3)
+
+    assert len(reviews[0]) == 2
+    assert all(len(r) == 3 for student_id, r in reviews.items() if student_id != 0)
@@ -0,0 +1,194 @@
+import os
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+import pytest
+
+import peer_review.storage as storage
+from peer_review.etl import _download_submissions, remove_legacy_staging_directory
+from peer_review.models import JobLog, SubmissionFile
+from peer_review.tests.canvas.server import fake_canvas_server
+
+
+def _raw_submission(server, submission_id, contents_by_filename, status=200):
+    attachments = []
+    for attachment_id, (filename, contents) in enumerate(contents_by_filename.items(), start=submission_id * 10):
+        url = server.add_file('/files/%d/%s' % (attachment_id, filename), contents, status=status)
+        attachments.append({'id': attachment_id, 'filename': filename, 'url': url,
+                            'updated_at': '2018-12-03T17:16:00Z', 'size': len(contents)})
+    return {
+        'id': submission_id,
+        'user_id': submission_id + 1000,
+        'assignment_id': 1,
+        'workflow_state': 'submitted',
+        'attachments': attachments
+    }
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db(transaction=True)
+def test_download_submissions_reuses_connections(fake_canvas_server, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    settings.SUBMISSION_DOWNLOAD_WORKERS = 4
+    settings.SUBMISSION_DOWNLOAD_CONNECTIONS_PER_HOST = 4
+
+    raw_submissions = [
+        _raw_submission(fake_canvas_server, i, {'essay_%d.txt' % i: b'submission for %d' % i})
+        for i in range(1, 41)
+    ]
+
+    submission_data = _download_submissions(raw_submissions, useFaultTolerance=False)
+
+    assert [s['id'] for s in submission_data] == [s['id'] for s in raw_submissions]
+    assert all(s.get('error') is None for s in submission_data)
+    for s in submission_data:
+        with open(storage.path_for(s['filename']), 'rb') as f:
+            assert f.read() == b'submission for %d' % s['id']
+
+    assert len(fake_canvas_server.requests) == len(raw_submissions)
+    assert len(fake_canvas_server.connections) <= settings.SUBMISSION_DOWNLOAD_CONNECTIONS_PER_HOST
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db(transaction=True)
+def test_download_submissions_counts_errors_with_fault_tolerance(fake_canvas_server, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+
+    raw_submissions = [
+        _raw_submission(fake_canvas_server, 1, {'essay.txt': b'fine'}),
+        _raw_submission(fake_canvas_server, 2, {'missing.txt': b''}, status=404)
+    ]
+
+    submission_data = _download_submissions(raw_submissions, useFaultTolerance=True)
+
+    assert submission_data[0].get('error') is None
+    assert submission_data[1].get('error') is not None
+    assert JobLog.objects.filter(message__startswith='Trouble downloading "20_missing.txt"').exists()
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db(transaction=True)
+def test_download_submissions_raises_without_fault_tolerance(fake_canvas_server, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+
+    raw_submissions = [_raw_submission(fake_canvas_server, 2, {'missing.txt': b''}, status=404)]
+
+    with pytest.raises(Exception):
+        _download_submissions(raw_submissions, useFaultTolerance=False)
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db(transaction=True)
+def test_download_streams_large_attachment_to_file(fake_canvas_server, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    contents = os.urandom(5 * 1024 * 1024)
+
+    submission_data = _download_submissions(
+        [_raw_submission(fake_canvas_server, 3, {'large.pdf': contents})],
+        useFaultTolerance=False
+    )
+
+    with open(storage.path_for(submission_data[0]['filename']), 'rb') as f:
+        assert f.read() == contents
+
+    # no partially-written temporary files should be left behind
+    blobs = os.path.join(str(tmpdir), 'submissions', storage.BLOB_DIRECTORY)
+    assert [name for name in os.listdir(blobs) if name.endswith('.part')] == []
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db(transaction=True)
+def test_download_multiple_attachments_streams_into_archive(fake_canvas_server, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    contents_by_filename = {'essay.txt': b'essay ' * 1000, 'figure.png': os.urandom(1024)}
+
+    submission_data = _download_submissions(
+        [_raw_submission(fake_canvas_server, 4, contents_by_filename)],
+        useFaultTolerance=False
+    )
+
+    assert submission_data[0]['filename'] == '4_submissions.zip'
+    with ZipFile(storage.path_for('4_submissions.zip')) as archive:
+        entries = {info.filename: info for info in archive.infolist()}
+        assert archive.read('4/40_essay.txt') == contents_by_filename['essay.txt']
+        assert archive.read('4/41_figure.png') == contents_by_filename['figure.png']
+    assert entries['4/40_essay.txt'].compress_type == ZIP_DEFLATED
+    assert entries['4/41_figure.png'].compress_type == ZIP_STORED
+    assert not os.path.exists(os.path.join(str(tmpdir), 'temporary'))
+
+
+def test_remove_legacy_staging_directory(settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    tmpdir.mkdir('temporary').mkdir('4').join('40_leftover.txt').write('leftover')
+    tmpdir.mkdir('submissions').join('4_submissions.zip').write('archive')
+
+    remove_legacy_staging_directory()
+    remove_legacy_staging_directory()
+
+    assert not os.path.exists(os.path.join(str(tmpdir), 'temporary'))
+    assert tmpdir.join('submissions', '4_submissions.zip').read() == 'archive'
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db(transaction=True)
+def test_download_multiple_attachments_discards_incomplete_archive(fake_canvas_server, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    raw_submission = _raw_submission(fake_canvas_server, 5, {'essay.txt': b'essay'})
+    raw_submission['attachments'].append({'id': 51, 'filename': 'missing.txt',
+                                          'url': fake_canvas_server.base_url + '/files/51/missing.txt'})
+
+    submission_data = _download_submissions([raw_submission], useFaultTolerance=True)
+
+    assert submission_data[0].get('error') is not None
+    assert not SubmissionFile.objects.filter(filename='5_submissions.zip').exists()
+    blobs = os.path.join(str(tmpdir), 'submissions', storage.BLOB_DIRECTORY)
+    assert [name for name in os.listdir(blobs) if name.endswith('.part')] == []
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db(transaction=True)
+def test_download_skips_unchanged_submissions(fake_canvas_server, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    raw_submissions = [_raw_submission(fake_canvas_server, 6, {'essay.txt': b'unchanged'})]
+
+    _download_submissions(raw_submissions, useFaultTolerance=False)
+    submission_data = _download_submissions(raw_submissions, useFaultTolerance=False)
+
+    assert len(fake_canvas_server.requests) == 1
+    assert submission_data[0]['filename'] == '60_essay.txt'
+    with open(storage.path_for('60_essay.txt'), 'rb') as f:
+        assert f.read() == b'unchanged'
+
+    # a resubmission updates the attachment, so it is downloaded again
+    raw_submissions[0]['attachments'][0]['updated_at'] = '2018-12-04T09:00:00Z'
+    _download_submissions(raw_submissions, useFaultTolerance=False)
+    assert len(fake_canvas_server.requests) == 2
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db(transaction=True)
+def test_download_stores_identical_content_once(fake_canvas_server, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    raw_submissions = [
+        _raw_submission(fake_canvas_server, 7, {'essay.txt': b'same essay'}),
+        _raw_submission(fake_canvas_server, 8, {'copy.txt': b'same essay'})
+    ]
+
+    _download_submissions(raw_submissions, useFaultTolerance=False)
+
+    assert storage.path_for('70_essay.txt') == storage.path_for('80_copy.txt')
+    blob_files = [name for _, _, names in os.walk(os.path.join(str(tmpdir), 'submissions', storage.BLOB_DIRECTORY))
+                  for name in names]
+    assert len(blob_files) == 1
+
+
+@pytest.mark.django_db
+def test_index_records_when_each_file_was_stored():
+    storage.index([('90_essay.txt', None, 'a' * 64, 10)])
+    first_stored_at = SubmissionFile.objects.get(filename='90_essay.txt').stored_at_utc
+
+    storage.index([('90_essay.txt', 'fingerprint', 'b' * 64, 20), ('91_essay.txt', None, 'c' * 64, 30)])
+
+    updated = SubmissionFile.objects.get(filename='90_essay.txt')
+    assert (updated.sha256, updated.size, updated.fingerprint) == ('b' * 64, 20, 'fingerprint')
+    assert updated.stored_at_utc > first_stored_at
+    assert SubmissionFile.objects.get(filename='91_essay.txt').stored_at_utc == updated.stored_at_utc
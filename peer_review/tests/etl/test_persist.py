@@ -0,0 +1,209 @@
+from datetime import datetime, timezone
+
+import pytest
+from django.db import connection
+from django.conf import settings as django_settings
+from django.test.utils import CaptureQueriesContext
+
+import peer_review.canvas as canvas
+from peer_review.etl import persist_students, persist_sections, persist_assignments, persist_submissions, \
+    PersistCounts
+from peer_review.models import CanvasCourse, CanvasSection, CanvasStudent, CanvasAssignment, CanvasSubmission, Rubric
+
+
+def _raw_student(student_id, section_ids, name=None):
+    name = name or 'Student %d' % student_id
+    return {
+        'id': student_id,
+        'name': name,
+        'sortable_name': name,
+        'login_id': 'student%d' % student_id,
+        'enrollments': [{'course_section_id': section_id} for section_id in section_ids]
+    }
+
+
+@pytest.fixture
+def course_with_sections():
+    course = CanvasCourse.objects.create(id=1, name='Test Course')
+    for section_id in (11, 12):
+        CanvasSection.objects.create(id=section_id, course=course, name='Section %d' % section_id)
+    return course
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_persist_students_creates_students_and_enrollments(course_with_sections, requests_mock):
+    requests_mock.get(canvas._make_url('students', [1]), json=[
+        _raw_student(student_id, [11] if student_id % 2 else [11, 12]) for student_id in range(100, 250)
+    ])
+
+    persist_students(1)
+
+    assert CanvasStudent.objects.filter(courses=course_with_sections).count() == 150
+    assert CanvasStudent.objects.get(id=101).username == 'student101'
+    assert set(CanvasStudent.objects.get(id=100).sections.values_list('id', flat=True)) == {11, 12}
+    assert set(CanvasStudent.objects.get(id=101).sections.values_list('id', flat=True)) == {11}
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_persist_students_updates_only_what_changed(course_with_sections, requests_mock):
+    url = canvas._make_url('students', [1])
+    requests_mock.get(url, json=[_raw_student(student_id, [11]) for student_id in range(100, 200)])
+    persist_students(1)
+
+    requests_mock.get(url, json=[_raw_student(student_id, [11, 12], name='Renamed' if student_id == 150 else None)
+                                 for student_id in range(100, 201)])
+    persist_students(1)
+
+    assert CanvasStudent.objects.filter(courses=course_with_sections).count() == 101
+    assert CanvasStudent.objects.get(id=150).full_name == 'Renamed'
+    assert CanvasStudent.objects.get(id=149).full_name == 'Student 149'
+    assert CanvasStudent.sections.through.objects.filter(canvassection_id=12).count() == 101
+    assert CanvasStudent.sections.through.objects.filter(canvassection_id=11).count() == 101
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_persist_students_query_count_does_not_grow_with_students(course_with_sections, requests_mock):
+    url = canvas._make_url('students', [1])
+    query_counts = []
+    for number_of_students in (10, 80):
+        requests_mock.get(url, json=[_raw_student(student_id, [11, 12])
+                                     for student_id in range(100, 100 + number_of_students)])
+        with CaptureQueriesContext(connection) as queries:
+            persist_students(1)
+        query_counts.append(len(queries))
+
+    # course, its sections, then one batch's existing students, inserts, update, existing course and section links
+    # and their inserts, plus the batch's savepoint
+    assert query_counts[0] == query_counts[1] <= 10
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_persist_students_fails_for_unknown_section(course_with_sections, requests_mock):
+    requests_mock.get(canvas._make_url('students', [1]), json=[_raw_student(100, [99])])
+
+    with pytest.raises(CanvasSection.DoesNotExist):
+        persist_students(1)
+
+
+def _raw_assignment(assignment_id, due_at, peer_review=False):
+    raw_assignment = {
+        'id': assignment_id,
+        'course_id': 1,
+        'name': 'Assignment %d' % assignment_id,
+        'due_at': due_at,
+        'submission_types': ['online_upload'],
+        'allowed_extensions': None,
+        'overrides': []
+    }
+    if peer_review:
+        raw_assignment['submission_types'] = ['external_tool']
+        raw_assignment['external_tool_tag_attributes'] = {'url': 'https://%s/launch' % django_settings.APP_HOST}
+    return raw_assignment
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_persist_sections_writes_only_changes(course_with_sections, requests_mock):
+    requests_mock.get(canvas._make_url('sections', [1]), json=[
+        {'id': 11, 'name': 'Section 11', 'course_id': 1},
+        {'id': 12, 'name': 'Renamed', 'course_id': 1},
+        {'id': 13, 'name': 'Section 13', 'course_id': 1}
+    ])
+
+    counts = persist_sections(1)
+
+    assert counts == PersistCounts(inserted=1, updated=1, unchanged=1)
+    assert CanvasSection.objects.get(id=12).name == 'Renamed'
+    assert CanvasSection.objects.filter(course=course_with_sections).count() == 3
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_persist_assignments_writes_only_changes_and_follows_due_dates(course_with_sections, requests_mock):
+    url = canvas._make_url('assignments', [1])
+    requests_mock.get(url, json=[_raw_assignment(21, '2018-12-03T17:00:00Z'),
+                                 _raw_assignment(22, '2018-12-03T17:00:00Z'),
+                                 _raw_assignment(23, None, peer_review=True)])
+    assignments, counts = persist_assignments(1, with_counts=True)
+    assert [(a.id, a.is_peer_review_assignment) for a in assignments] == [(21, False), (22, False), (23, True)]
+    assert counts == PersistCounts(inserted=3, updated=0, unchanged=0)
+
+    rubric = Rubric.objects.create(description='Rubric', reviewed_assignment_id=21, passback_assignment_id=23,
+                                   peer_review_open_date_is_prompt_due_date=True)
+
+    requests_mock.get(url, json=[_raw_assignment(21, '2018-12-05T17:00:00Z'),
+                                 _raw_assignment(22, '2018-12-03T17:00:00Z'),
+                                 _raw_assignment(23, None, peer_review=True),
+                                 _raw_assignment(24, None)])
+    assignments, counts = persist_assignments(1, with_counts=True)
+
+    assert counts == PersistCounts(inserted=1, updated=1, unchanged=2)
+    assert CanvasAssignment.objects.get(id=21).due_date_utc == datetime(2018, 12, 5, 17, tzinfo=timezone.utc)
+    rubric.refresh_from_db()
+    assert rubric.peer_review_open_date == datetime(2018, 12, 5, 17, tzinfo=timezone.utc)
+    assert persist_assignments(1, with_counts=True)[1] == PersistCounts(inserted=0, updated=0, unchanged=4)
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_persist_assignments_skips_diff_when_canvas_reports_no_change(course_with_sections, requests_mock):
+    url = canvas._make_url('assignments', [1])
+    requests_mock.get(url, [
+        {'json': [_raw_assignment(21, '2018-12-03T17:00:00Z')], 'headers': {'ETag': '"v1"'}},
+        {'status_code': 304}
+    ])
+    persist_assignments(1)
+
+    with CaptureQueriesContext(connection) as queries:
+        assignments, counts = persist_assignments(1, with_counts=True)
+
+    assert [a.id for a in assignments] == [21]
+    assert assignments[0].validation.due_date_utc == '2018-12-03T17:00:00+00:00'
+    assert counts == PersistCounts(inserted=0, updated=0, unchanged=1)
+    assert not any('canvas_assignments' in query['sql'] for query in queries.captured_queries)
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_persist_assignments_names_sections_from_storage_when_canvas_reports_no_change(course_with_sections,
+                                                                                       requests_mock):
+    raw_assignment = dict(_raw_assignment(21, None), overrides=[{'course_section_id': 12,
+                                                                 'due_at': '2018-12-03T17:00:00Z'}])
+    requests_mock.get(canvas._make_url('assignments', [1]), [
+        {'json': [raw_assignment], 'headers': {'ETag': '"v1"'}},
+        {'status_code': 304}
+    ])
+    section = requests_mock.get(canvas._make_url('section', [1, 12]), json={'id': 12, 'name': 'Section 12'})
+    persist_assignments(1)
+    section_calls = section.call_count
+
+    assignments = persist_assignments(1)
+
+    assert assignments[0].validation.section_name == 'Section 12'
+    assert section.call_count == section_calls
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_persist_submissions_moves_submissions_stored_under_another_assignment(course_with_sections, requests_mock,
+                                                                                 settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    prompt = CanvasAssignment.objects.create(id=21, course=course_with_sections, title='Prompt')
+    other_prompt = CanvasAssignment.objects.create(id=22, course=course_with_sections, title='Other Prompt')
+    student = CanvasStudent.objects.create(id=1, username='student1', full_name='Student 1', sortable_name='1')
+    student.courses.add(course_with_sections)
+    CanvasSubmission.objects.create(id=31, author=student, assignment=other_prompt, filename='31_essay.txt')
+    requests_mock.get(canvas._make_url('submissions', [1, 21]), json=[{
+        'id': 31, 'user_id': 1, 'assignment_id': 21, 'workflow_state': 'submitted',
+        'attachments': [{'id': 41, 'filename': 'essay.txt', 'size': 5, 'updated_at': '2018-12-03T17:00:00Z',
+                         'url': 'https://files.example/41/essay.txt'}]
+    }])
+    requests_mock.get('https://files.example/41/essay.txt', content=b'essay')
+
+    persist_submissions(prompt, useFaultTolerance=False)
+
+    assert list(CanvasSubmission.objects.values_list('id', 'assignment_id')) == [(31, 21)]
@@ -0,0 +1,80 @@
+import re
+import time
+
+import pytest
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+
+import peer_review.canvas as canvas
+from peer_review.etl import persist_submissions
+from peer_review.models import CanvasCourse, CanvasAssignment, CanvasStudent, CanvasSubmission
+
+NUMBER_OF_SUBMISSIONS = 2000
+PAGE_SIZE = 100
+
+
+@pytest.fixture
+def assignment_with_students():
+    course = CanvasCourse.objects.create(id=1, name='Test Course')
+    assignment = CanvasAssignment.objects.create(id=1, course=course, title='Prompt')
+    CanvasStudent.objects.bulk_create([
+        CanvasStudent(id=student_id, username=str(student_id), full_name='Student', sortable_name='Student')
+        for student_id in range(1, NUMBER_OF_SUBMISSIONS + 1)
+    ])
+    CanvasStudent.courses.through.objects.bulk_create([
+        CanvasStudent.courses.through(canvasstudent_id=student_id, canvascourse_id=course.id)
+        for student_id in range(1, NUMBER_OF_SUBMISSIONS + 1)
+    ])
+    return assignment
+
+
+def _mock_submissions(requests_mock):
+    url = canvas._make_url('submissions', [1, 1])
+    last_page = NUMBER_OF_SUBMISSIONS // PAGE_SIZE
+    for page in range(1, last_page + 1):
+        submissions = [{
+            'id': 10000 + student_id,
+            'user_id': student_id,
+            'assignment_id': 1,
+            'workflow_state': 'submitted',
+            'attachments': [{'id': 20000 + student_id, 'filename': 'essay.txt', 'size': 5,
+                             'updated_at': '2018-12-03T17:00:00Z',
+                             'url': 'https://files.example/%d/essay.txt' % student_id}]
+        } for student_id in range((page - 1) * PAGE_SIZE + 1, page * PAGE_SIZE + 1)]
+        links = ','.join('<%s?page=%d&per_page=100>; rel="%s"' % (url, p, key)
+                         for key, p in (('next', page + 1), ('last', last_page)) if p <= last_page)
+        requests_mock.get(url + ('?page=%d' % page if page > 1 else ''), json=submissions,
+                          headers={'Link': links})
+    requests_mock.get(re.compile('https://files.example/.*'), content=b'essay')
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_persist_submissions_benchmark(assignment_with_students, requests_mock, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    _mock_submissions(requests_mock)
+
+    timings = []
+    query_counts = []
+    for _ in range(2):
+        reset_queries()
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            persist_submissions(assignment_with_students, useFaultTolerance=False)
+        timings.append(time.perf_counter() - start)
+        query_counts.append(len(queries))
+
+    print('persist_submissions for %d submissions took %.3fs (%d queries), then %.3fs unchanged (%d queries)' %
+          (NUMBER_OF_SUBMISSIONS, timings[0], query_counts[0], timings[1], query_counts[1]))
+    assert CanvasSubmission.objects.filter(assignment=assignment_with_students).count() == NUMBER_OF_SUBMISSIONS
+    assert timings[0] < 30
+    assert timings[1] < 10
+
+    # a handful of queries per batch of downloads, rather than several per submission
+    batches = NUMBER_OF_SUBMISSIONS // PAGE_SIZE
+    assert query_counts[0] <= 6 * batches + 10
+    assert query_counts[1] <= 2 * batches + 10
+
+    # unchanged attachments are not downloaded again
+    downloads = [r for r in requests_mock.request_history if r.hostname == 'files.example']
+    assert len(downloads) == NUMBER_OF_SUBMISSIONS
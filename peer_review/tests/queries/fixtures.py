@@ -0,0 +1,125 @@
+import random
+from datetime import datetime, timedelta, timezone
+from collections import namedtuple
+
+import pytest
+
+import peer_review.summaries as summaries
+import peer_review.completion as completion
+from peer_review.distribution import make_distribution
+from peer_review.models import CanvasCourse, CanvasSection, CanvasAssignment, CanvasStudent, CanvasSubmission, \
+    Rubric, Criterion, PeerReview, PeerReviewComment, PeerReviewEvaluation, PeerReviewDistribution
+
+ReviewedClass = namedtuple('ReviewedClass', ['course', 'sections', 'rubric', 'students'])
+
+NUMBER_OF_CRITERIA = 3
+
+
+def make_reviewed_class(number_of_students, seed=0, course_id=1, first_student_id=1000):
+    """
+    Build a course with one distributed rubric: most students submitted, reviews are in every state of completion
+    (some finished after the peer review due date), some received reviews are evaluated, and a couple of students
+    without submissions were assigned reviews by hand.  The same `seed` always builds the same class.
+    """
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    due_date = now - timedelta(days=1)
+
+    course = CanvasCourse.objects.create(id=course_id, name='Course %d' % course_id)
+    sections = [CanvasSection.objects.create(id=course_id * 100 + i, course=course, name='Section %s' % name)
+                for i, name in enumerate('CAB')]
+    prompt = CanvasAssignment.objects.create(id=course_id * 100, course=course, title='Prompt',
+                                             due_date_utc=due_date - timedelta(days=7))
+    peer_review_assignment = CanvasAssignment.objects.create(id=course_id * 100 + 1, course=course,
+                                                             title='Peer Review', due_date_utc=due_date,
+                                                             is_peer_review_assignment=True)
+    rubric = Rubric.objects.create(description='Rubric', reviewed_assignment=prompt,
+                                   passback_assignment=peer_review_assignment,
+                                   peer_review_evaluation_due_date=now + timedelta(days=7))
+    criteria = [Criterion.objects.create(rubric=rubric, description='Criterion %d' % i)
+                for i in range(NUMBER_OF_CRITERIA)]
+    PeerReviewDistribution.objects.create(rubric=rubric, is_distribution_complete=True, distributed_at_utc=now)
+
+    students = [CanvasStudent(id=student_id, username='student%d' % student_id,
+                              full_name='Student %d' % student_id, sortable_name='%d, Student' % student_id)
+                for student_id in range(first_student_id, first_student_id + number_of_students)]
+    CanvasStudent.objects.bulk_create(students)
+    CanvasStudent.courses.through.objects.bulk_create([
+        CanvasStudent.courses.through(canvasstudent_id=student.id, canvascourse_id=course.id) for student in students
+    ])
+    CanvasStudent.sections.through.objects.bulk_create([
+        CanvasStudent.sections.through(canvasstudent_id=student.id, canvassection_id=section.id)
+        for student in students
+        for section in rng.sample(sections, rng.choice([1, 1, 2]))
+    ])
+
+    submitters = [student for student in students if rng.random() < 0.9]
+    submissions = [CanvasSubmission(id=student.id * 10, author=student, assignment=prompt,
+                                    filename='%d_essay.docx' % student.id)
+                   for student in submitters]
+    CanvasSubmission.objects.bulk_create(submissions)
+
+    distribution, _ = make_distribution(prompt, submitters, submissions)
+    pairs = [(student_id, submission_id)
+             for student_id, submission_ids in sorted(distribution.items())
+             for submission_id in sorted(submission_ids)]
+    late_reviewers = [student for student in students if student not in submitters][:2]
+    pairs += [(reviewer.id, submission.id) for reviewer in late_reviewers for submission in submissions[:2]]
+    PeerReview.objects.bulk_create([PeerReview(student_id=student_id, submission_id=submission_id)
+                                    for student_id, submission_id in pairs])
+
+    comments = []
+    evaluations = []
+    for peer_review in PeerReview.objects.filter(submission__assignment=prompt).order_by('id'):
+        commented_at = due_date + timedelta(hours=rng.choice([-48, -1, 1]))
+        for criterion in criteria[:rng.choice([0, 1, NUMBER_OF_CRITERIA, NUMBER_OF_CRITERIA])]:
+            comments.append(PeerReviewComment(criterion=criterion, peer_review=peer_review, comment='Comment',
+                                              commented_at_utc=commented_at))
+        if rng.random() < 0.3:
+            evaluations.append(PeerReviewEvaluation(peer_review=peer_review, usefulness=rng.randint(1, 5),
+                                                    comment='Evaluation'))
+    PeerReviewComment.objects.bulk_create(comments)
+    PeerReviewEvaluation.objects.bulk_create(evaluations)
+    # nothing was created through the API or the distribution job, so what they maintain has to be brought up to date
+    completion.rebuild(rubric_ids=[rubric.id])
+    summaries.rebuild(rubric_ids=[rubric.id])
+
+    return ReviewedClass(course=course, sections=sections, rubric=rubric, students=students)
+
+
+def add_rubric(course, students, number):
+    """
+    Add another rubric to a course made by `make_reviewed_class`, where every student submitted and completed a
+    review of the next student's submission.  `number` must be different for every rubric added to the course.
+    """
+    due_date = datetime.now(timezone.utc) + timedelta(days=number)
+    prompt = CanvasAssignment.objects.create(id=course.id * 100 + number * 2, course=course,
+                                             title='Prompt %d' % number, due_date_utc=due_date)
+    peer_review_assignment = CanvasAssignment.objects.create(id=course.id * 100 + number * 2 + 1, course=course,
+                                                             title='Peer Review %d' % number,
+                                                             due_date_utc=due_date + timedelta(days=7),
+                                                             is_peer_review_assignment=True)
+    rubric = Rubric.objects.create(description='Rubric %d' % number, reviewed_assignment=prompt,
+                                   passback_assignment=peer_review_assignment)
+    criteria = [Criterion.objects.create(rubric=rubric, description='Criterion %d.%d' % (number, i))
+                for i in range(NUMBER_OF_CRITERIA)]
+
+    submissions = [CanvasSubmission(id=prompt.id * 10000 + student.id, author=student, assignment=prompt,
+                                    filename='%d_%d_essay.docx' % (prompt.id, student.id))
+                   for student in students]
+    CanvasSubmission.objects.bulk_create(submissions)
+    PeerReview.objects.bulk_create([PeerReview(student=student, submission=submissions[(i + 1) % len(students)])
+                                    for i, student in enumerate(students)])
+    PeerReviewComment.objects.bulk_create([
+        PeerReviewComment(criterion=criterion, peer_review=peer_review, comment='Comment', commented_at_utc=due_date)
+        for peer_review in PeerReview.objects.filter(submission__assignment=prompt)
+        for criterion in criteria
+    ])
+    completion.rebuild(rubric_ids=[rubric.id])
+    summaries.rebuild(rubric_ids=[rubric.id])
+    return rubric
+
+
+@pytest.fixture
+def reviewed_class():
+    return make_reviewed_class(40)
@@ -0,0 +1,73 @@
+import pytest
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+
+from peer_review.queries import Comments
+from peer_review.models import CanvasStudent, Rubric, PeerReviewComment
+from peer_review.tests.queries.fixtures import make_reviewed_class, add_rubric
+
+
+def _row(comment):
+    return (comment.peer_review.submission.assignment.title,
+            comment.peer_review.student.sortable_name,
+            comment.peer_review.submission.author.sortable_name,
+            comment.criterion.id,
+            comment.comment)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 10000])
+@pytest.mark.django_db
+def test_csv_rows_in_chunks(chunk_size):
+    make_reviewed_class(10)
+    comments = PeerReviewComment.objects.all()
+
+    assert list(Comments.csv_rows(comments, chunk_size=chunk_size)) == [_row(c) for c in comments.order_by('id')]
+
+
+@pytest.mark.django_db
+def test_csv_rows_for_student():
+    reviewed_class = make_reviewed_class(20)
+    rubric = add_rubric(reviewed_class.course, reviewed_class.students, 1)
+
+    for student in reviewed_class.students:
+        given = PeerReviewComment.objects.filter(peer_review__student=student).order_by('id')
+        received = PeerReviewComment.objects.filter(peer_review__submission__author=student).order_by('id')
+        assert list(Comments.csv_rows_for_student(student.id)) == [_row(c) for c in list(given) + list(received)]
+
+        given = given.filter(peer_review__submission__assignment=rubric.reviewed_assignment)
+        received = received.filter(peer_review__submission__assignment=rubric.reviewed_assignment)
+        assert list(Comments.csv_rows_for_student(student.id, rubric_id=rubric.id)) == \
+            [_row(c) for c in list(given) + list(received)]
+
+    with pytest.raises(CanvasStudent.DoesNotExist):
+        Comments.csv_rows_for_student(1)
+
+
+@pytest.mark.django_db
+def test_csv_rows_for_course():
+    reviewed_class = make_reviewed_class(20)
+    rubric = add_rubric(reviewed_class.course, reviewed_class.students, 1)
+    other_class = make_reviewed_class(10, course_id=2, first_student_id=2000)
+    course_comments = PeerReviewComment.objects \
+        .filter(peer_review__submission__assignment__course=reviewed_class.course) \
+        .order_by('id')
+
+    assert list(Comments.csv_rows_for_course(reviewed_class.course.id)) == [_row(c) for c in course_comments]
+    assert list(Comments.csv_rows_for_course(reviewed_class.course.id, rubric_id=rubric.id)) == \
+        [_row(c) for c in course_comments.filter(peer_review__submission__assignment=rubric.reviewed_assignment)]
+
+    with pytest.raises(Rubric.DoesNotExist):
+        Comments.csv_rows_for_course(reviewed_class.course.id, rubric_id=other_class.rubric.id)
+
+
+@pytest.mark.django_db
+def test_csv_rows_take_one_query_per_chunk():
+    reviewed_class = make_reviewed_class(20)
+    number_of_comments = PeerReviewComment.objects.count()
+
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        rows = list(Comments.csv_rows(PeerReviewComment.objects.all(), chunk_size=10))
+
+    assert len(rows) == number_of_comments
+    assert len(queries) == number_of_comments // 10 + 1
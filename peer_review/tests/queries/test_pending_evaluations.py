@@ -0,0 +1,60 @@
+import pytest
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+
+from peer_review.queries import Evaluations
+from peer_review.models import PeerReview, PeerReviewEvaluation
+from peer_review.tests.queries.fixtures import make_reviewed_class, add_rubric
+
+
+@pytest.mark.django_db
+def test_pending_evaluations_for_every_rubric():
+    reviewed_class = make_reviewed_class(20)
+    course = reviewed_class.course
+    rubrics = [reviewed_class.rubric] + [add_rubric(course, reviewed_class.students, number) for number in (1, 2)]
+    # one student has evaluated everything they received for the second rubric, which is then no longer pending
+    student = reviewed_class.students[0]
+    for peer_review in PeerReview.objects.filter(submission__author=student,
+                                                 submission__assignment=rubrics[1].reviewed_assignment):
+        PeerReviewEvaluation.objects.create(peer_review=peer_review, usefulness=3, comment='Evaluation')
+
+    for student in reviewed_class.students:
+        expected = []
+        for rubric in rubrics:
+            reviews = list(PeerReview.objects.filter(submission__author=student,
+                                                     submission__assignment=rubric.reviewed_assignment)
+                           .order_by('id'))
+            evaluated = [PeerReviewEvaluation.objects.filter(peer_review=pr).exists() for pr in reviews]
+            if all(evaluated):
+                continue
+            due_date = rubric.peer_review_evaluation_due_date
+            expected.extend({
+                'rubric_id': rubric.id,
+                'peer_review_title': rubric.passback_assignment.title,
+                'due_date_utc': due_date.strftime('%Y-%m-%d %H:%M:%SZ') if due_date else None,
+                'peer_review_id': pr.id,
+                'student_id': student_number,
+                'ready_for_evaluation': pr.comments.exists(),
+                'evaluation_is_complete': is_evaluated,
+                'evaluation_is_mandatory': rubric.peer_review_evaluation_is_mandatory
+            } for student_number, (pr, is_evaluated) in enumerate(zip(reviews, evaluated), start=1))
+
+        pending = Evaluations.pending_evaluations(course.id, student.id)
+        assert sorted(pending, key=lambda e: e['peer_review_id']) == \
+            sorted(expected, key=lambda e: e['peer_review_id'])
+
+
+@pytest.mark.django_db
+def test_pending_evaluations_query_count_does_not_grow_with_rubrics():
+    reviewed_class = make_reviewed_class(10)
+    course, student = reviewed_class.course, reviewed_class.students[0]
+
+    query_counts = []
+    for number in range(1, 5):
+        add_rubric(course, reviewed_class.students, number)
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            assert len(Evaluations.pending_evaluations(course.id, student.id)) >= number
+        query_counts.append(len(queries))
+
+    assert query_counts == [1] * len(query_counts)
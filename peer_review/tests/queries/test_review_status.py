@@ -0,0 +1,73 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from peer_review.queries import ReviewStatus
+from peer_review.models import PeerReview
+from peer_review.tests.queries.fixtures import make_reviewed_class, reviewed_class, NUMBER_OF_CRITERIA
+
+
+def _count_queries(fn, *args):
+    with CaptureQueriesContext(connection) as queries:
+        result = fn(*args)
+    return result, len(queries)
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_status_for_rubric_totals(reviewed_class):
+    course, rubric = reviewed_class.course, reviewed_class.rubric
+
+    status = ReviewStatus.status_for_rubric(course.id, rubric.id)
+    reviews = {review['author']['id']: review for review in status['reviews']}
+
+    assert status['course_id'] == course.id
+    assert status['rubric']['peer_review_title'] == 'Peer Review'
+    assert [s['name'] for s in status['sections']] == sorted(s['name'] for s in status['sections'])
+    for student in reviewed_class.students:
+        given = PeerReview.objects.filter(student=student, submission__assignment=rubric.reviewed_assignment)
+        if student.id not in reviews:
+            assert not given.exists()
+            continue
+        review = reviews[student.id]
+        assert review['total_completed'] == given.count()
+        if review['total_received'] is None:
+            # a reviewer without a submission; any comment counts
+            assert review['completed'] == given.filter(comments__isnull=False).distinct().count()
+        else:
+            completed = [pr for pr in given if pr.comments.count() >= NUMBER_OF_CRITERIA]
+            received = PeerReview.objects.filter(submission__author=student,
+                                                 submission__assignment=rubric.reviewed_assignment)
+            assert review['completed'] == len(completed)
+            assert review['total_received'] == received.count()
+            assert review['received'] == len([pr for pr in received if pr.comments.count() >= NUMBER_OF_CRITERIA])
+            assert review['evaluations_given'] == received.filter(evaluation__isnull=False).count()
+            assert review['total_evaluations'] == review['received']
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_status_for_rubric_filters_sections_by_rubric(reviewed_class):
+    course, rubric = reviewed_class.course, reviewed_class.rubric
+    rubric.sections.add(reviewed_class.sections[0])
+
+    status = ReviewStatus.status_for_rubric(course.id, rubric.id)
+
+    assert status['sections'] == [{'id': reviewed_class.sections[0].id, 'name': reviewed_class.sections[0].name}]
+    for review in status['reviews']:
+        if review['total_received'] is not None:
+            assert all(s['id'] == reviewed_class.sections[0].id for s in review['sections'])
+
+
+@pytest.mark.django_db
+def test_status_for_rubric_query_count_does_not_grow_with_class_size():
+    query_counts = []
+    for course_id, number_of_students in ((1, 10), (2, 80)):
+        reviewed_class = make_reviewed_class(number_of_students, course_id=course_id,
+                                             first_student_id=course_id * 1000)
+        status, query_count = _count_queries(ReviewStatus.status_for_rubric,
+                                             reviewed_class.course.id, reviewed_class.rubric.id)
+        assert len(status['reviews']) >= number_of_students * 0.8
+        query_counts.append(query_count)
+
+    assert query_counts[0] == query_counts[1] <= 10
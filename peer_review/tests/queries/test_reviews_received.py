@@ -0,0 +1,73 @@
+import pytest
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+
+from peer_review.queries import Reviews
+from peer_review.models import PeerReview, PeerReviewComment, PeerReviewEvaluation
+from peer_review.tests.queries.fixtures import make_reviewed_class, add_rubric
+
+
+def _expected_comments(reviews):
+    expected = {}
+    reviews = list(reviews.order_by('id'))
+    criterion_ids = sorted(set(PeerReviewComment.objects.filter(peer_review__in=reviews)
+                               .values_list('criterion_id', flat=True)))
+    for reviewer_number, peer_review in enumerate(reviews, start=1):
+        rubric = peer_review.submission.assignment.rubric_for_prompt
+        for comment in peer_review.comments.all():
+            expected[comment.id] = {
+                'rubric_id': rubric.id,
+                'prompt_title': peer_review.submission.assignment.title,
+                'peer_review_id': peer_review.id,
+                'evaluation_submitted': PeerReviewEvaluation.objects.filter(peer_review=peer_review).exists(),
+                'reviewer_id': reviewer_number,
+                'comment_id': comment.id,
+                'comment': comment.comment,
+                'criterion_real_id': comment.criterion_id,
+                'criterion_id': criterion_ids.index(comment.criterion_id) + 1,
+                'criterion': comment.criterion.description
+            }
+    return expected
+
+
+@pytest.mark.django_db
+def test_reviews_received_from_every_rubric():
+    reviewed_class = make_reviewed_class(20)
+    course = reviewed_class.course
+    rubrics = [reviewed_class.rubric] + [add_rubric(course, reviewed_class.students, number) for number in (1, 2)]
+
+    for student in reviewed_class.students:
+        received = Reviews.reviews_received(course.id, student.id)
+        assert len(received) == PeerReviewComment.objects.filter(peer_review__submission__author=student).count()
+
+        for rubric in rubrics:
+            reviews = PeerReview.objects.filter(submission__author=student,
+                                                submission__assignment=rubric.reviewed_assignment)
+            expected = _expected_comments(reviews)
+            assert Reviews.reviews_received(course.id, student.id, rubric_id=rubric.id) == expected
+            assert {comment_id: received[comment_id] for comment_id in expected} == expected
+
+
+@pytest.mark.django_db
+def test_single_review():
+    reviewed_class = make_reviewed_class(10)
+    for peer_review in PeerReview.objects.all():
+        assert Reviews.single_review(peer_review) == _expected_comments(PeerReview.objects.filter(id=peer_review.id))
+
+
+@pytest.mark.django_db
+def test_reviews_received_query_count_does_not_grow_with_rubrics():
+    reviewed_class = make_reviewed_class(10)
+    course, student = reviewed_class.course, reviewed_class.students[0]
+
+    query_counts = []
+    for number in range(1, 5):
+        add_rubric(course, reviewed_class.students, number)
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            Reviews.reviews_received(course.id, student.id)
+            Reviews.single_review(student.peer_reviews_for_student.last())
+        query_counts.append(len(queries))
+
+    # reviews, their comments and the comments' criteria; one more to pick the single review
+    assert query_counts == [7] * len(query_counts)
@@ -0,0 +1,84 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from peer_review.queries import ReviewStatus
+from peer_review.models import PeerReview, PeerReviewComment, CanvasSubmission, Criterion
+from peer_review.tests.queries.fixtures import make_reviewed_class, reviewed_class, NUMBER_OF_CRITERIA
+
+
+def _is_late(peer_review, due_date_utc):
+    return peer_review.comments.filter(commented_at_utc__gte=due_date_utc).exists()
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_rubric_statuses_for_student_counts(reviewed_class):
+    course, rubric = reviewed_class.course, reviewed_class.rubric
+    due_date_utc = rubric.passback_assignment.due_date_utc
+
+    for student in reviewed_class.students:
+        statuses = ReviewStatus.all_rubric_statuses_for_student(course.id, student)
+
+        assert len(statuses) == 1
+        assert statuses[0]['rubric_id'] == rubric.id
+        assert statuses[0]['reviews_were_distributed']
+        review_info = statuses[0]['review_info']
+        if not CanvasSubmission.objects.filter(author=student, assignment=rubric.reviewed_assignment).exists():
+            assert review_info == {'submission_present': False}
+            continue
+
+        given = PeerReview.objects.filter(student=student, submission__assignment=rubric.reviewed_assignment)
+        completed = [pr for pr in given if pr.comments.count() >= NUMBER_OF_CRITERIA]
+        received = PeerReview.objects.filter(submission__author=student,
+                                             submission__assignment=rubric.reviewed_assignment)
+        received_completed = [pr for pr in received if pr.comments.count() >= NUMBER_OF_CRITERIA]
+        assert review_info == {
+            'submission_present': True,
+            'total_to_complete': given.count(),
+            'completed': len(completed),
+            'completed_late': len([pr for pr in completed if _is_late(pr, due_date_utc)]),
+            'total_to_receive': received.count(),
+            'received': len(received_completed),
+            'received_late': len([pr for pr in received_completed if _is_late(pr, due_date_utc)])
+        }
+
+
+@pytest.mark.django_db
+def test_rubric_statuses_for_student_with_a_rubric_without_criteria():
+    reviewed_class = make_reviewed_class(10)
+    course, rubric = reviewed_class.course, reviewed_class.rubric
+    assert rubric.passback_assignment.due_date_utc is not None
+    PeerReviewComment.objects.all().delete()
+    Criterion.objects.filter(rubric=rubric).delete()
+    # how migration 0014 counted them before a review needed a comment to be complete (fixed by migration 0017)
+    PeerReview.objects.update(comment_count=0, is_complete=True, completed_at_utc=None)
+
+    for student in reviewed_class.students:
+        review_info = ReviewStatus.all_rubric_statuses_for_student(course.id, student)[0]['review_info']
+        if review_info['submission_present']:
+            assert review_info['completed'] == review_info['total_to_complete']
+            assert review_info['received'] == review_info['total_to_receive']
+            assert review_info['completed_late'] == review_info['received_late'] == 0
+
+
+@pytest.mark.django_db
+def test_rubric_statuses_for_student_query_count_does_not_grow_with_rubrics():
+    query_counts = []
+    for number_of_rubrics in (1, 4):
+        # every rubric lives in its own course; move them all into the first one
+        classes = [make_reviewed_class(10, seed=i, course_id=number_of_rubrics * 10 + i,
+                                       first_student_id=(number_of_rubrics * 10 + i) * 1000)
+                   for i in range(number_of_rubrics)]
+        course = classes[0].course
+        for reviewed_class in classes[1:]:
+            reviewed_class.rubric.reviewed_assignment.course = course
+            reviewed_class.rubric.reviewed_assignment.save()
+        student = classes[0].students[0]
+
+        with CaptureQueriesContext(connection) as queries:
+            statuses = ReviewStatus.all_rubric_statuses_for_student(course.id, student)
+        assert len(statuses) == number_of_rubrics
+        query_counts.append(len(queries))
+
+    assert query_counts[0] == query_counts[1] <= 3
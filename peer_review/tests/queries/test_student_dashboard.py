@@ -0,0 +1,58 @@
+import pytest
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+
+from peer_review.queries import StudentDashboardStatus
+from peer_review.models import PeerReview
+from peer_review.tests.queries.fixtures import make_reviewed_class, reviewed_class, add_rubric
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_student_dashboard_counts(reviewed_class):
+    course, rubric = reviewed_class.course, reviewed_class.rubric
+    prompt = rubric.reviewed_assignment
+
+    for student in reviewed_class.students:
+        given = PeerReview.objects.filter(student=student).order_by('id')
+        received = PeerReview.objects.filter(submission__author=student)
+
+        assigned = StudentDashboardStatus.assigned_work(course.id, student.id)
+        if given:
+            assert assigned == [{
+                'prompt_id': prompt.id,
+                'prompt_name': prompt.title,
+                'due_date_utc': rubric.passback_assignment.due_date_utc.strftime('%Y-%m-%d %H:%M:%SZ'),
+                'due_date_has_passed': True,
+                'reviews': [{'review_id': pr.id, 'review_is_complete': pr.is_complete} for pr in given]
+            }]
+        else:
+            assert assigned == []
+
+        completed = StudentDashboardStatus.completed_work(course.id, student.id)
+        if any(pr.is_complete for pr in list(given) + list(received)):
+            assert len(completed) == 1
+            assert completed[0]['rubric_id'] == rubric.id
+            assert completed[0]['reviews'] == {
+                'given': {'completed': sum(pr.is_complete for pr in given), 'total': len(given)},
+                'received': {'completed': sum(pr.is_complete for pr in received), 'total': len(received)}
+            }
+        else:
+            assert completed == []
+
+
+@pytest.mark.django_db
+def test_student_dashboard_query_count_does_not_grow_with_prompts():
+    reviewed_class = make_reviewed_class(10)
+    course, student = reviewed_class.course, reviewed_class.students[0]
+
+    query_counts = []
+    for number in range(1, 5):
+        add_rubric(course, reviewed_class.students, number)
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            assert len(StudentDashboardStatus.assigned_work(course.id, student.id)) >= number
+            assert len(StudentDashboardStatus.completed_work(course.id, student.id)) >= number
+        query_counts.append(len(queries))
+
+    assert query_counts == [2] * len(query_counts)
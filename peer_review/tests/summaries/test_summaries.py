@@ -0,0 +1,97 @@
+import importlib
+from datetime import datetime, timezone
+
+import pytest
+from django.apps import apps
+from django.db import connection
+from django.core.management import call_command, CommandError
+from django.test.utils import CaptureQueriesContext
+
+from peer_review import summaries
+from peer_review.completion import record_comments
+from peer_review.queries import InstructorDashboardStatus
+from peer_review.models import PeerReview, PeerReviewComment, RubricSummary
+from peer_review.tests.queries.fixtures import make_reviewed_class, reviewed_class, NUMBER_OF_CRITERIA
+
+
+def _dashboard(reviewed_class):
+    rubric = reviewed_class.rubric
+    details = InstructorDashboardStatus.get(reviewed_class.course.id, (rubric.passback_assignment_id,))
+    assert len(details) == 1
+    return details[0]
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_dashboard_reads_summary(reviewed_class):
+    rubric = reviewed_class.rubric
+    peer_reviews = PeerReview.objects.filter(submission__assignment=rubric.reviewed_assignment)
+
+    with CaptureQueriesContext(connection) as queries:
+        details = _dashboard(reviewed_class)
+
+    assert len(queries) == 1
+    assert details['rubric_id'] == rubric.id
+    assert details['prompt_id'] == rubric.reviewed_assignment_id
+    assert details['peer_review_title'] == 'Peer Review'
+    assert details['number_of_assigned_reviews'] == peer_reviews.count()
+    assert details['number_of_completed_reviews'] == \
+        len([pr for pr in peer_reviews if pr.comments.count() >= NUMBER_OF_CRITERIA])
+    assert details['reviews_in_progress'] is True
+    assert details['evaluation_mandatory'] is False
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_completed_review_is_counted_incrementally(reviewed_class):
+    completed_before = _dashboard(reviewed_class)['number_of_completed_reviews']
+    peer_review = PeerReview.objects.filter(comment_count=0).first()
+    comments = [PeerReviewComment.objects.create(criterion=criterion, peer_review=peer_review, comment='Comment',
+                                                 commented_at_utc=datetime.now(timezone.utc))
+                for criterion in reviewed_class.rubric.criteria.all()]
+
+    record_comments(peer_review, comments, NUMBER_OF_CRITERIA)
+    summaries.add_completed_reviews(reviewed_class.rubric.id, 1)
+
+    assert _dashboard(reviewed_class)['number_of_completed_reviews'] == completed_before + 1
+    assert summaries.rebuild(fix=False) == []
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_rebuild_fixes_stale_summaries(reviewed_class):
+    expected = _dashboard(reviewed_class)
+    RubricSummary.objects.update(number_of_assigned_reviews=0, reviews_in_progress=False)
+
+    with pytest.raises(CommandError):
+        call_command('rebuild_rubric_summaries', check=True)
+    assert summaries.rebuild() == [reviewed_class.rubric.id]
+
+    assert _dashboard(reviewed_class) == expected
+    call_command('rebuild_rubric_summaries', check=True)
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_rebuild_counts_completed_reviews_from_comments(reviewed_class):
+    expected = _dashboard(reviewed_class)
+    assert expected['number_of_completed_reviews'] > 0
+    # completion counters that drifted, with a summary that agrees with them
+    PeerReview.objects.update(is_complete=False, completed_at_utc=None)
+    RubricSummary.objects.update(number_of_completed_reviews=0)
+
+    assert summaries.rebuild(fix=False) == [reviewed_class.rubric.id]
+    summaries.rebuild()
+    assert _dashboard(reviewed_class) == expected
+
+
+@pytest.mark.django_db
+def test_migration_summarizes_like_rebuild():
+    classes = [make_reviewed_class(10, seed=i, course_id=i + 1, first_student_id=(i + 1) * 1000) for i in range(3)]
+    expected = {c.rubric.id: _dashboard(c) for c in classes}
+    RubricSummary.objects.all().delete()
+
+    importlib.import_module('peer_review.migrations.0015_rubric_summaries').summarize_rubrics(apps, None)
+
+    assert {c.rubric.id: _dashboard(c) for c in classes} == expected
+    assert summaries.rebuild(fix=False) == []
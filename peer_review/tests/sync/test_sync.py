@@ -0,0 +1,194 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import peer_review.sync as sync
+import peer_review.canvas as canvas
+from peer_review.exceptions import APIException
+from peer_review.models import CanvasCourse, CanvasSyncState
+
+
+@pytest.fixture
+def refreshes(monkeypatch):
+    refreshed = []
+    monkeypatch.setitem(sync._refreshers, 'roster', refreshed.append)
+    return refreshed
+
+
+@pytest.fixture
+def background(monkeypatch):
+    submitted = []
+
+    class Executor:
+        @staticmethod
+        def submit(fn, *args):
+            submitted.append((fn, args))
+
+    monkeypatch.setattr(sync, '_background_executor', Executor)
+    return submitted
+
+
+def _synced(ago, claimed_for=None):
+    now = datetime.now(timezone.utc)
+    CanvasSyncState.objects.create(course_id=1, resource='roster', synced_at_utc=now - ago,
+                                   refresh_claimed_until_utc=now + claimed_for if claimed_for else None)
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_first_sync_happens_during_the_request(refreshes, background):
+    sync.ensure_synced(1, 'roster')
+
+    assert refreshes == [1]
+    assert background == []
+    state = CanvasSyncState.objects.get(course_id=1, resource='roster')
+    assert state.synced_at_utc is not None
+    assert state.refresh_claimed_until_utc is None
+
+
+def _first_sync_claimed_by_another_request():
+    CanvasSyncState.objects.create(course_id=1, resource='roster',
+                                   refresh_claimed_until_utc=datetime.now(timezone.utc) + timedelta(seconds=60))
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_first_sync_in_another_request_is_waited_for_briefly_then_retried_later(refreshes, monkeypatch, settings):
+    settings.CANVAS_SYNC_WAIT = 2
+    waits = []
+    monkeypatch.setattr(sync.time, 'sleep', waits.append)
+    monotonic = iter(range(100))
+    monkeypatch.setattr(sync.time, 'monotonic', lambda: next(monotonic))
+    _first_sync_claimed_by_another_request()
+
+    with pytest.raises(APIException) as raised:
+        sync.ensure_synced(1, 'roster')
+
+    assert raised.value.status_code == 503
+    assert len(waits) == 1
+    assert refreshes == []
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_failed_first_sync_in_another_request_is_taken_over(refreshes, monkeypatch):
+    def other_request_fails(seconds):
+        CanvasSyncState.objects.update(refresh_claimed_until_utc=None)
+
+    monkeypatch.setattr(sync.time, 'sleep', other_request_fails)
+    _first_sync_claimed_by_another_request()
+
+    sync.ensure_synced(1, 'roster')
+
+    assert refreshes == [1]
+    assert CanvasSyncState.objects.get(course_id=1, resource='roster').synced_at_utc is not None
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_fresh_data_is_served_without_refreshing(refreshes, background, settings):
+    settings.CANVAS_SYNC_TTL = 300
+    _synced(timedelta(seconds=10))
+
+    sync.ensure_synced(1, 'roster')
+
+    assert refreshes == []
+    assert background == []
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_stale_data_is_refreshed_in_the_background_once(refreshes, background, settings):
+    settings.CANVAS_SYNC_TTL = 300
+    settings.CANVAS_SYNC_WORKERS = 2
+    _synced(timedelta(seconds=600))
+
+    sync.ensure_synced(1, 'roster')
+    sync.ensure_synced(1, 'roster')
+
+    assert refreshes == []
+    assert len(background) == 1
+    fn, (state,) = background[0]
+    fn(state)
+    assert refreshes == [1]
+    assert CanvasSyncState.objects.get(id=state.id).refresh_claimed_until_utc is None
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_stale_data_is_not_refreshed_while_another_refresh_is_claimed(refreshes, background, settings):
+    settings.CANVAS_SYNC_TTL = 300
+    settings.CANVAS_SYNC_WORKERS = 0
+    _synced(timedelta(seconds=600), claimed_for=timedelta(seconds=60))
+
+    sync.ensure_synced(1, 'roster')
+    assert refreshes == []
+
+    CanvasSyncState.objects.update(refresh_claimed_until_utc=datetime.now(timezone.utc) - timedelta(seconds=1))
+    sync.ensure_synced(1, 'roster')
+    assert refreshes == [1]
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_failed_refresh_releases_its_claim(monkeypatch, settings):
+    def fail(course_id):
+        raise RuntimeError('Canvas is down')
+
+    monkeypatch.setitem(sync._refreshers, 'roster', fail)
+
+    with pytest.raises(RuntimeError):
+        sync.ensure_synced(1, 'roster')
+
+    state = CanvasSyncState.objects.get(course_id=1, resource='roster')
+    assert state.synced_at_utc is None
+    assert state.refresh_claimed_until_utc is None
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_course_assignments_are_served_from_the_stored_response(requests_mock, background, settings):
+    settings.CANVAS_SYNC_TTL = 300
+    requests_mock.get(canvas._make_url('course', [1]), json={'id': 1, 'name': 'Test Course'})
+    requests_mock.get(canvas._make_url('sections', [1]), json=[])
+    requests_mock.get(canvas._make_url('assignments', [1]), headers={'ETag': '"v1"'}, json=[{
+        'id': 21, 'course_id': 1, 'name': 'Prompt', 'due_at': '2018-12-03T17:00:00Z',
+        'submission_types': ['online_upload'], 'allowed_extensions': ['docx'], 'overrides': []
+    }])
+
+    first = sync.course_assignments(1)
+    calls_after_first_sync = requests_mock.call_count
+    second = sync.course_assignments(1)
+
+    assert CanvasCourse.objects.filter(id=1).exists()
+    assert [a.id for a in first] == [a.id for a in second] == [21]
+    assert second[0].validation.allowed_submission_file_extensions == ['docx']
+    assert requests_mock.call_count == calls_after_first_sync
+
+
+# noinspection PyShadowingNames
+@pytest.mark.django_db
+def test_course_assignments_without_cache_headers_never_go_back_to_canvas(requests_mock, background, settings):
+    settings.CANVAS_SYNC_TTL = 300
+    first_page = canvas._make_url('assignments', [1])
+    second_page = first_page + '?page=2'
+    requests_mock.get(canvas._make_url('course', [1]), json={'id': 1, 'name': 'Test Course'})
+    requests_mock.get(canvas._make_url('sections', [1]), json=[{'id': 5, 'name': 'Lab 5', 'course_id': 1}])
+    requests_mock.get(canvas._make_url('section', [1, 5]), json={'id': 5, 'name': 'Lab 5', 'course_id': 1})
+    requests_mock.get(first_page, headers={'Link': '<%s>; rel="next"' % second_page}, json=[{
+        'id': 21, 'course_id': 1, 'name': 'Prompt', 'due_at': '2018-12-03T17:00:00Z',
+        'submission_types': ['online_upload'], 'overrides': []
+    }])
+    requests_mock.get(second_page, complete_qs=True, json=[{
+        'id': 22, 'course_id': 1, 'name': 'Section Prompt', 'due_at': None,
+        'submission_types': ['online_upload'],
+        'overrides': [{'course_section_id': 5, 'due_at': '2018-12-04T17:00:00Z'}]
+    }])
+
+    first = sync.course_assignments(1)
+    calls_after_first_sync = requests_mock.call_count
+    second = sync.course_assignments(1)
+
+    assert [a.id for a in first] == [a.id for a in second] == [21, 22]
+    assert first[1].validation.section_name == second[1].validation.section_name == 'Lab 5'
+    assert requests_mock.call_count == calls_after_first_sync
@@ -2,8 +2,11 @@ import re
 import json
 from functools import partial
 from collections import Iterable
+from concurrent.futures import ThreadPoolExecutor
 
 import pytz
+from django.db import connection
+from django.db.models import Case, When, Value
 from toolz.dicttoolz import keymap
 
 
@@ -82,3 +85,51 @@ def fetchall_dicts(cursor):
 
 def object_to_json(obj):
     return transform_data_structure(obj.__dict__, dict_transform=camel_case_keys)
+
+
+def map_concurrently(fn, items, workers):
+    """
+    Call `fn` on each item, using a pool of up to `workers` threads when `workers` is greater than one.
+
+    Each pooled call gets its own database connection, which is closed as soon as the call finishes.  Exceptions raised
+    by `fn` propagate to the caller just as they would when run serially.
+
+    :return: List of results, in the same order as `items`
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+
+    def run(item):
+        try:
+            return fn(item)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as executor:
+        return list(executor.map(run, items))
+
+
+def bulk_update(model, objs, fields):
+    """
+    Write `fields` of each of `objs` back to `model`'s table with one UPDATE per batch (as large a batch as the
+    database allows), since `QuerySet.bulk_update` is not available in this version of Django.
+
+    :return: Number of rows updated
+    """
+    objs = list(objs)
+    if not objs:
+        return 0
+    model_fields = [model._meta.get_field(field) for field in fields]
+    # each object takes a parameter for its primary key, plus a key and a value in each field's CASE
+    batch_size = max(1, connection.ops.bulk_batch_size(['pk'] + fields + fields, objs))
+    updated = 0
+    for start in range(0, len(objs), batch_size):
+        batch = objs[start:start + batch_size]
+        updates = {
+            field.name: Case(*[When(pk=obj.pk, then=Value(getattr(obj, field.attname))) for obj in batch],
+                             output_field=field)
+            for field in model_fields
+        }
+        updated += model.objects.filter(pk__in=[obj.pk for obj in batch]).update(**updates)
+    return updated